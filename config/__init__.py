@@ -1,2 +1,12 @@
-from .query import BigQueryClient, MotherduckClient
-from .config import TABLES, MD_TOKEN
\ No newline at end of file
+from .config import TABLES, MD_TOKEN
+
+# the query clients pull in pandas and duckdb, so they are imported on first access
+_LAZY = {"BigQueryClient": ".query", "MotherduckClient": ".query"}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
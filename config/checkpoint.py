@@ -0,0 +1,260 @@
+import functools
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import polars as pl
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS slugs (
+    slug TEXT PRIMARY KEY,
+    protocol_id TEXT,
+    run_id INTEGER,
+    status TEXT NOT NULL,
+    payload_hash TEXT,
+    last_date INTEGER,
+    rows INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS unrefreshed (
+    id TEXT PRIMARY KEY,
+    first_date INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    id TEXT NOT NULL,
+    chain_name TEXT NOT NULL,
+    token_name TEXT NOT NULL,
+    latest_date INTEGER NOT NULL,
+    PRIMARY KEY (id, chain_name, token_name)
+);
+"""
+
+# slug statuses
+DONE = "done"
+FAILED = "failed"
+FLUSHING = "flushing"
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class CheckpointStore:
+    """
+    Local SQLite record of ingest progress, kept next to the downloaded data.
+
+    Per slug it stores the run that last touched it, its status, the hash of the payload
+    that was ingested and the latest date written. It also keeps the per-token watermarks,
+    so a rerun can pick up where it stopped without a GROUP BY over table C.
+
+    A slug is only marked done once its rows have been flushed to the warehouse. Slugs that
+    were mid-flush when a run died are reported by `uncertain_protocols` so their
+    watermarks can be re-read for just those protocol ids.
+
+    Every flush also records the earliest date it wrote per protocol. The tables derived
+    from C (rollups, the Parquet mirror) are brought up to date from `unrefreshed_protocols`
+    and the entries are cleared only after that succeeded, so a run that dies in between
+    leaves them for the next one.
+
+    The flush hooks may run on a writer thread while the event loop records other slugs, so
+    every public method holds a lock around the shared connection.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self.run_id = None
+
+    @_locked
+    def close(self) -> None:
+        self.con.close()
+
+    @_locked
+    def start_run(self) -> int:
+        """Resume the last run if it never finished, otherwise start a new one."""
+        row = self.con.execute(
+            "SELECT run_id FROM runs WHERE finished_at IS NULL ORDER BY run_id DESC LIMIT 1"
+        ).fetchone()
+        if row is not None:
+            self.run_id = row[0]
+        else:
+            with self.con:
+                self.run_id = self.con.execute(
+                    "INSERT INTO runs (started_at) VALUES (?)", (time.time(),)
+                ).lastrowid
+        return self.run_id
+
+    @_locked
+    def finish_run(self) -> None:
+        with self.con:
+            self.con.execute(
+                "UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), self.run_id)
+            )
+
+    @_locked
+    def pending_slugs(self, slugs: Iterable[str]) -> List[str]:
+        """The slugs not yet completed in the current run, in their original order."""
+        done = {
+            row[0]
+            for row in self.con.execute(
+                "SELECT slug FROM slugs WHERE run_id = ? AND status = ?", (self.run_id, DONE)
+            )
+        }
+        return [slug for slug in slugs if slug not in done]
+
+    @_locked
+    def slug_state(self, slug: str) -> Optional[dict]:
+        cursor = self.con.execute("SELECT * FROM slugs WHERE slug = ?", (slug,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    @_locked
+    def is_unchanged(self, slug: str, payload_hash: str) -> bool:
+        state = self.slug_state(slug)
+        return state is not None and state["status"] == DONE and state["payload_hash"] == payload_hash
+
+    def _set_status(self, slugs, status: str) -> None:
+        now = time.time()
+        self.con.executemany(
+            """
+            INSERT INTO slugs (slug, protocol_id, run_id, status, payload_hash, rows, updated_at)
+            VALUES (?, ?, ?, ?, ?, 0, ?)
+            ON CONFLICT (slug) DO UPDATE SET
+                protocol_id = COALESCE(excluded.protocol_id, protocol_id),
+                run_id = excluded.run_id,
+                status = excluded.status,
+                payload_hash = COALESCE(excluded.payload_hash, payload_hash),
+                updated_at = excluded.updated_at
+            """,
+            [(slug, protocol_id, self.run_id, status, payload_hash, now)
+             for slug, protocol_id, payload_hash in slugs],
+        )
+
+    @_locked
+    def mark_done(self, slug: str, protocol_id=None, payload_hash=None) -> None:
+        """Record a slug that needed no write, e.g. an unchanged payload or no new rows."""
+        with self.con:
+            self._set_status([(slug, protocol_id, payload_hash)], DONE)
+
+    @_locked
+    def mark_failed(self, slug: str) -> None:
+        with self.con:
+            self._set_status([(slug, None, None)], FAILED)
+
+    @_locked
+    def mark_flushing(self, keys) -> None:
+        """`keys` are (slug, protocol_id, payload_hash) tuples about to be written."""
+        with self.con:
+            self._set_status(
+                [(slug, str(protocol_id), None) for slug, protocol_id, _ in keys], FLUSHING
+            )
+
+    @_locked
+    def record_flush(self, keys, df: Optional[pl.DataFrame]) -> None:
+        """Advance watermarks from a flushed frame and mark its slugs done, atomically."""
+        with self.con:
+            self._set_status(
+                [(slug, str(protocol_id), payload_hash) for slug, protocol_id, payload_hash in keys],
+                DONE,
+            )
+            if df is None or df.is_empty():
+                return
+            self._upsert_watermarks(
+                df.group_by("id", "chain_name", "token_name").agg(
+                    pl.col("date").max().alias("latest_date")
+                )
+            )
+            per_protocol = df.group_by("id").agg(
+                pl.col("date").max().alias("last_date"), pl.len().alias("rows")
+            )
+            self.con.executemany(
+                "UPDATE slugs SET last_date = MAX(COALESCE(last_date, 0), ?), rows = ? "
+                "WHERE protocol_id = ? AND run_id = ?",
+                [(last_date, rows, protocol_id, self.run_id)
+                 for protocol_id, last_date, rows in per_protocol.iter_rows()],
+            )
+            self.con.executemany(
+                """
+                INSERT INTO unrefreshed (id, first_date) VALUES (?, ?)
+                ON CONFLICT (id) DO UPDATE SET first_date = MIN(first_date, excluded.first_date)
+                """,
+                df.group_by("id").agg(pl.col("date").min()).iter_rows(),
+            )
+
+    @_locked
+    def unrefreshed_protocols(self) -> Dict[str, int]:
+        """Earliest flushed date per protocol not yet folded into the tables derived from C."""
+        return dict(self.con.execute("SELECT id, first_date FROM unrefreshed").fetchall())
+
+    @_locked
+    def clear_unrefreshed(self, first_dates: Dict[str, int]) -> None:
+        """Drop the entries a refresh covered, unless a later flush moved them earlier."""
+        with self.con:
+            self.con.executemany(
+                "DELETE FROM unrefreshed WHERE id = ? AND first_date >= ?",
+                list(first_dates.items()),
+            )
+
+    def _upsert_watermarks(self, df: pl.DataFrame) -> None:
+        self.con.executemany(
+            """
+            INSERT INTO watermarks (id, chain_name, token_name, latest_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (id, chain_name, token_name) DO UPDATE SET
+                latest_date = MAX(latest_date, excluded.latest_date)
+            """,
+            df.select("id", "chain_name", "token_name", "latest_date").iter_rows(),
+        )
+
+    @_locked
+    def save_watermarks(self, df: pl.DataFrame, protocol_ids: Iterable[str] = None) -> None:
+        """
+        Store watermarks read from the warehouse. With `protocol_ids`, the stored watermarks
+        of those protocols are replaced; otherwise `df` is merged into the store.
+        """
+        with self.con:
+            if protocol_ids is not None:
+                self.con.executemany(
+                    "DELETE FROM watermarks WHERE id = ?", [(str(i),) for i in protocol_ids]
+                )
+            self._upsert_watermarks(df.with_columns(pl.col("id").cast(pl.Utf8)))
+
+    @_locked
+    def has_watermarks(self) -> bool:
+        return self.con.execute("SELECT EXISTS (SELECT 1 FROM watermarks)").fetchone()[0] == 1
+
+    @_locked
+    def watermark_frame(self) -> pl.DataFrame:
+        rows = self.con.execute(
+            "SELECT id, chain_name, token_name, latest_date FROM watermarks"
+        ).fetchall()
+        return pl.DataFrame(
+            rows,
+            schema={"id": pl.Utf8, "chain_name": pl.Utf8, "token_name": pl.Utf8,
+                    "latest_date": pl.Int64},
+            orient="row",
+        )
+
+    @_locked
+    def uncertain_protocols(self) -> List[str]:
+        """Protocol ids whose last flush may or may not have reached the warehouse."""
+        return [
+            row[0]
+            for row in self.con.execute(
+                "SELECT DISTINCT protocol_id FROM slugs WHERE status = ?", (FLUSHING,)
+            )
+        ]
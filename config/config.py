@@ -8,6 +8,21 @@ CACHE_DIR = "data/tvl/cache/"
 
 MAPPING_PATH = 'data/mapping/'
 
+# local Hive-partitioned Parquet copy of table C; None reads the table itself
+C_MIRROR_DIR = None
+
+# rows per Arrow record batch when streaming query results
+RESULT_BATCH_SIZE = 65_536
+
+# bumped by the ingest flows after writing tables A and C; the API drops cached results on change
+DATA_VERSION_TABLE = "data_version"
+# byte budget of the API result cache and how often (seconds) it re-reads the data version
+RESULT_CACHE_BYTES = 256 * 1024**2
+DATA_VERSION_TTL = 30
+# DuckDB cursors the API queries on concurrently, and seconds a request waits for a free one
+QUERY_POOL_SIZE = 8
+QUERY_POOL_TIMEOUT = 30
+
 QUERY_PROJECT = "platinum-analog-402701"
 
 QUERY_DATA_SET = "tvl_all"
@@ -235,4 +250,10 @@ NETWORK_PRELIMINARIES = """
                         - $V$ corresponds to protocols in $\mathcal{A}$, with each node $v$ representing a protocol.
                         - $E$ consists of directed edges between nodes in $V$, with each edge $e(v_i, v_j)$ representing the flow of value from protocol $v_i$ to protocol $v_j$, derived from $\mathcal{C}_{sorted}$. The weight of each edge is proportional to the magnitude of the value change.
 
-                        """
\ No newline at end of file
+                        """
+
+CATEGORY_TO_TYPE = {
+    category: type_name
+    for type_name, categories in CATEGORY_MAPPING.items()
+    for category in categories
+}
@@ -0,0 +1,106 @@
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class EdgeTable(NamedTuple):
+    """
+    A netted flow network over integer node codes. `labels[code]` names a node and
+    `node_size[code]` is its size; edge `i` runs from `source[i]` to `target[i]` with weight
+    `size[i]`. Self-loops (`source == target`) carry flows that stay within one node.
+    """
+
+    labels: np.ndarray
+    node_size: np.ndarray
+    source: np.ndarray
+    target: np.ndarray
+    size: np.ndarray
+
+    def top(self, k: Optional[int]) -> "EdgeTable":
+        """
+        The `k` heaviest edges, heaviest first, and only the nodes they touch. The edges are
+        picked with a partial selection, so the cost is linear in the number of edges.
+        """
+        if k is None or k >= len(self.size):
+            return self
+        if k < 0:
+            raise ValueError(f"k must be non-negative, got {k}")
+        keep = np.argpartition(-self.size, k - 1)[:k] if k else np.array([], dtype=np.int64)
+        keep = keep[np.argsort(-self.size[keep], kind="stable")]
+        source, target = self.source[keep], self.target[keep]
+        used = np.unique(np.concatenate([source, target]))
+        code = np.full(len(self.labels), -1, dtype=np.int64)
+        code[used] = np.arange(len(used))
+        return EdgeTable(
+            labels=self.labels[used],
+            node_size=self.node_size[used],
+            source=code[source],
+            target=code[target],
+            size=self.size[keep],
+        )
+
+    def to_json(self, categories: Optional[Sequence] = None) -> dict:
+        """`{'nodes': [...], 'links': [...]}` with plain Python values, as the API returns it."""
+        categories = self.labels if categories is None else categories
+        labels = self.labels.tolist()
+        nodes = [
+            {"id": label, "size": size, "category": category}
+            for label, size, category in zip(labels, self.node_size.tolist(), list(categories))
+        ]
+        links = [
+            {"source": labels[source], "target": labels[target], "size": size}
+            for source, target, size in zip(self.source.tolist(), self.target.tolist(), self.size.tolist())
+        ]
+        return {"nodes": nodes, "links": links}
+
+
+def _values(values, length: int) -> np.ndarray:
+    if values is None:
+        return np.zeros(length)
+    return np.nan_to_num(np.asarray(values, dtype=np.float64))
+
+
+def build_edges(from_nodes, to_nodes, weight, from_value=None, to_value=None) -> EdgeTable:
+    """
+    Net the flows `from_nodes[i] -> to_nodes[i]` of `weight[i]` into one directed edge per
+    node pair, pointing the way the larger total flows, and size every node by the sum of
+    its `from_value` as a sender and its `to_value` as a receiver.
+
+    Node labels are factorized into integer codes once; each row then maps to the key of its
+    unordered pair, signed by direction, and a single `bincount` over the pair keys yields
+    every net flow. Flows within one node add up to a self-loop. Rows missing either node
+    are ignored.
+    """
+    from_nodes = np.asarray(from_nodes, dtype=object)
+    to_nodes = np.asarray(to_nodes, dtype=object)
+    rows = len(from_nodes)
+    codes, labels = pd.factorize(np.concatenate([from_nodes, to_nodes]))
+    labels = np.asarray(labels, dtype=object)
+    n = len(labels)
+    source, target = codes[:rows], codes[rows:]
+    weight = _values(weight, rows)
+    from_value, to_value = _values(from_value, rows), _values(to_value, rows)
+
+    known = (source >= 0) & (target >= 0)
+    source, target = source[known], target[known]
+    weight, from_value, to_value = weight[known], from_value[known], to_value[known]
+
+    node_size = np.bincount(source, from_value, minlength=n) + np.bincount(target, to_value, minlength=n)
+
+    low, high = np.minimum(source, target), np.maximum(source, target)
+    signed = np.where(source <= target, weight, -weight)
+    pairs, inverse = np.unique(low.astype(np.int64) * n + high, return_inverse=True)
+    net = np.bincount(inverse.ravel(), signed, minlength=len(pairs))
+
+    keep = net != 0
+    pairs, net = pairs[keep], net[keep]
+    low, high = pairs // n, pairs % n
+    forward = net > 0
+    return EdgeTable(
+        labels=labels,
+        node_size=node_size,
+        source=np.where(forward, low, high),
+        target=np.where(forward, high, low),
+        size=np.abs(net),
+    )
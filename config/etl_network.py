@@ -1,23 +1,32 @@
 from config.config import TABLES, PRIMARY_TOKEN_TO_PROTOCOL, CATEGORY_MAPPING, MAPPING_PATH, SIMILARIY_THRESHOLD
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from config.edges import build_edges
 import ast
 import pandas as pd
 import json
 import numpy as np
 import os
-import dask.dataframe as dd
-import os
 
-try:
-    NUM_CORES = max(1, int(os.cpu_count() * 0.8))
-except:
-    NUM_CORES = 1
+
+def apply_distinct(values: pd.Series, func) -> pd.Series:
+    """
+    Call `func` once per distinct value of `values` and broadcast the results back through
+    the factorized codes, so the per-row cost is a single array take. Missing values map to
+    None without calling `func`.
+    """
+    codes, uniques = pd.factorize(values)
+    lookup = [func(value) for value in uniques]
+    lookup = np.array(lookup + [None], dtype=object)  # code -1 (missing) takes the last slot
+    return pd.Series(lookup[codes], index=values.index, dtype=object)
+
+
+def map_distinct(values: pd.Series, mapping: dict, keep_unmapped: bool = False) -> pd.Series:
+    """`apply_distinct` of a dict lookup; unmapped values become None unless `keep_unmapped`."""
+    return apply_distinct(values, lambda value: mapping.get(value, value if keep_unmapped else None))
 
 class ETLNetwork:
-    def __init__(self, bq):
+    def __init__(self, bq, mapping_path: str = MAPPING_PATH):
         self.bq = bq
-        self.mapping_path = MAPPING_PATH
+        self.mapping_path = mapping_path
         self.rev_map, self.categories, self.id_to_info = {}, {}, {}
         required_files = ['rev_map.json', 'token_to_protocol.json', 'id_to_info.json']
         missing_files = [file for file in required_files if not os.path.exists(self.mapping_path + file)]
@@ -36,6 +45,18 @@ class ETLNetwork:
         self.categories = self._load_json('token_to_protocol.json')
         self.id_to_info = self._load_json('id_to_info.json')
 
+        # Flat indices for process_dataframe: token -> id across all categories (a token is
+        # listed in one category; the first listing wins otherwise) and protocol id -> name
+        self.token_to_id = {}
+        for tokens in self.categories.values():
+            for token, data in tokens.items():
+                self.token_to_id.setdefault(token, str(data.get('id', None)))
+        self.id_to_name = {id: info['name'] for id, info in self.id_to_info.items() if 'name' in info}
+        # protocol name -> broad category, for aggregating networks by type
+        self.name_to_category = {}
+        for info in self.id_to_info.values():
+            self.name_to_category.setdefault(info.get('name'), info.get('category', 'AGGREGATED'))
+
     def _load_json(self, filename):
         with open(os.path.join(self.mapping_path, filename), 'r') as file:
             return json.load(file)
@@ -76,6 +97,9 @@ class ETLNetwork:
                 if isinstance(data['id'], str):
                     input_tokens[token] = data
 
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.metrics.pairwise import cosine_similarity
+
         token_names = list(input_tokens.keys())
         combined_texts = token_names + A['all_text'].tolist()
         vectorizer = TfidfVectorizer()
@@ -197,39 +221,22 @@ class ETLNetwork:
 
         self._save_json(id_to_info, 'id_to_info.json')
 
-    def _process_edges(self, links):
-        edge_aggregate = {}
-        for link in links:
-            key = tuple(sorted([link['source'], link['target']]))
-            edge_aggregate[key] = edge_aggregate.get(key, 0) + (link['size'] if link['source'] < link['target'] else -link['size'])
-
-        final_links = [{'source': node1 if net_size > 0 else node2, 'target': node2 if net_size > 0 else node1, 'size': abs(net_size)} for (node1, node2), net_size in edge_aggregate.items() if net_size != 0]
-
-        return final_links
-
-    def process_dataframe(self, C: pd.DataFrame, TOP_X: int = None, mode: str = 'usd', type: bool = False):
-
-        if TOP_X != None:
-            raise NotImplementedError("TOP_X is not implemented yet")
+    def _node_category(self, node_name: str) -> str:
+        """Category of a protocol node; token nodes keep their name, numeric ids aggregate."""
+        if node_name in self.name_to_category:
+            return self.name_to_category[node_name]
+        # Check if node_name is not what we expect (e.g., numeric or specific unwanted IDs)
+        if node_name.isdigit() or node_name == '3594':  # You can add more conditions here
+            return 'AGGREGATED'
+        return node_name  # Return node_name if it doesn't match any special conditions
 
-        # Initialize the new columns with NaNs or zeros
-        C['qty_from'] = C['qty_to'] = C['usd_from'] = C['usd_to'] = None
-
-        # For rows where 'usd_change' is negative, it means the flow is from 'from_node' to 'to_node'
-        C.loc[C['usd_change'] < 0, ['qty_from', 'usd_from']] = C.loc[C['usd_change'] < 0, ['qty', 'usd']].values
-
-        # For rows where 'usd_change' is positive, it means the flow is from 'to_node' to 'from_node'
-        C.loc[C['usd_change'] >= 0, ['qty_to', 'usd_to']] = C.loc[C['usd_change'] >= 0, ['qty', 'usd']].values
-
-        # Function to find the token_id from self.categories
-        def find_token_id(token_name):
-            for category, tokens in self.categories.items():
-                if token_name in tokens:
-                    return str(tokens[token_name].get('id', None))
-            return None
-
-        # Apply the function to find token_id for each row in DataFrame 'C'
-        C['token_id'] = C['token_name'].apply(find_token_id)
+    def _resolve_nodes(self, C: pd.DataFrame) -> pd.DataFrame:
+        """
+        Name the two ends of every token movement: a protocol that lost value sends to the
+        token's node, one that gained receives from it. Token and protocol ids are looked up
+        once per distinct value rather than once per row.
+        """
+        C['token_id'] = map_distinct(C['token_name'], self.token_to_id)
 
         # Ensure 'id' is also converted to string to avoid type mismatch
         C['id'] = C['id'].astype(str)
@@ -239,91 +246,48 @@ class ETLNetwork:
         C['to_node'] = C['token_id'].where(C['usd_change'] < 0, C['id'])
 
         # Select only the required columns and adjust 'qty_change' and 'usd_change' to be absolute values
-        C = C[['from_node', 'to_node', 'chain_name', 'qty_from', 'qty_to', 'usd_from', 'usd_to', 'qty_change', 'usd_change']].copy()
+        C = C[['from_node', 'to_node', 'chain_name', 'qty_change', 'usd_change']].copy()
         C['qty_change'] = C['qty_change'].abs()
         C['usd_change'] = C['usd_change'].abs()
 
-        def replace_with_name(value):
-            return self.id_to_info.get(str(value), {}).get('name', value)
-
-        C['from_node'] = C['from_node'].apply(replace_with_name)
-        C['to_node'] = C['to_node'].apply(replace_with_name)
-
+        C['from_node'] = map_distinct(C['from_node'], self.id_to_name, keep_unmapped=True)
+        C['to_node'] = map_distinct(C['to_node'], self.id_to_name, keep_unmapped=True)
+        return C
 
-        def get_category(node_name):
-            for id, info in self.id_to_info.items():
-                if info.get('name') == node_name:
-                    return info.get('category', 'AGGREGATED')  # Default to 'AGGREGATED' if category is not found
-            # Check if node_name is not what we expect (e.g., numeric or specific unwanted IDs)
-            if node_name.isdigit() or node_name == '3594':  # You can add more conditions here
-                return 'AGGREGATED'
-            return node_name  # Return node_name if it doesn't match any special conditions
-        
+    def process_dataframe(self, C: pd.DataFrame, TOP_X: int = None, mode: str = 'usd', type: bool = False):
+        """
+        Build the token-flow network of a `compare_periods` frame: every row moves the absolute
+        change of a token between a protocol and the token's node, in the direction of its USD
+        change. Nodes are sized by the start value of what they send plus what they receive.
+        With `type`, protocols and tokens are merged into their categories first. With `TOP_X`,
+        only the TOP_X heaviest links and the nodes they connect are returned.
+        """
+        # A negative USD change means the protocol sent the token: it flows from 'from_node' to 'to_node'
+        outflow = (C['usd_change'] < 0).to_numpy()
+        value = C['usd' if mode == 'usd' else 'qty'].to_numpy(dtype=float)
+        change = C['usd_change' if mode == 'usd' else 'qty_change'].abs().to_numpy(dtype=float)
 
+        C = self._resolve_nodes(C)
+        from_nodes, to_nodes = C['from_node'], C['to_node']
         if type:
-
-            C = dd.from_pandas(C, npartitions=NUM_CORES)
-
-            C['from_node_category'] = C['from_node'].apply(get_category, meta=('from_node', 'object'))
-            C['to_node_category'] = C['to_node'].apply(get_category, meta=('to_node', 'object'))
-
-            C = C.compute()
-            C = C.replace({pd.NA: None})
-
-            # Convert columns to numeric, ensuring `None` values are handled
-            C['qty_from'] = pd.to_numeric(C['qty_from'], errors='coerce').fillna(0)
-            C['qty_to'] = pd.to_numeric(C['qty_to'], errors='coerce').fillna(0)
-            C['usd_from'] = pd.to_numeric(C['usd_from'], errors='coerce').fillna(0)
-            C['usd_to'] = pd.to_numeric(C['usd_to'], errors='coerce').fillna(0)
-
-            # C['from_node_category'] = C['from_node'].apply(get_category)
-            # C['to_node_category'] = C['to_node'].apply(get_category)
-
-            # Initialize a dictionary to hold the total values for each category, starting with 0
-            category_values = {category: 0 for category in set(C['from_node_category']).union(set(C['to_node_category']))}
-            
-            # Choose the mode: 'usd' or 'qty'
-            value_column_from = 'usd_from' if mode == 'usd' else 'qty_from'
-            value_column_to = 'usd_to' if mode == 'usd' else 'qty_to'
-
-            # Aggregate 'from_value' and 'to_value' for each category
-            from_aggregation = C.groupby('from_node_category')[value_column_from].sum().fillna(0)
-            to_aggregation = C.groupby('to_node_category')[value_column_to].sum().fillna(0)
-
-            # Combine the aggregations
-            category_values_aggregate = from_aggregation.add(to_aggregation, fill_value=0)
-
-
-            # Ensure all categories are included, even those without transactions
-            all_categories = set(C['from_node_category']).union(set(C['to_node_category']))
-            category_values = {category: 0 for category in all_categories}  # Initialize all to 0
-
-            # Update the dictionary with aggregated values
-            for category in category_values_aggregate.index:
-                category_values[category] += category_values_aggregate[category]
-
-
-            # Generate nodes with their sizes based on the aggregated values
-            nodes = [{'id': category, 'size': size, 'category': category} for category, size in category_values.items()]
-
-            # Generate links as before
-            links = []
-            for (from_cat, to_cat), group in C.groupby(['from_node_category', 'to_node_category']):
-                size = group['usd_change'].sum() if mode == 'usd' else group['qty_change'].sum()
-                links.append({'source': from_cat, 'target': to_cat, 'size': size, 'chain': 'aggregated'})
-
-            # Handling self-links for within-category transfers
-            for category in category_values.keys():
-                within_category_size = C[(C['from_node_category'] == category) & (C['to_node_category'] == category)]['usd_change'].sum() if mode == 'usd' else C[(C['from_node_category'] == category) & (C['to_node_category'] == category)]['qty_change'].sum()
-                if within_category_size != 0:
-                    links.append({'source': category, 'target': category, 'size': within_category_size, 'chain': 'aggregated'})
-
-
-        network_json = {
-            'nodes': nodes,
-            'links': links
-        }
-
-        network_json['links'] = self._process_edges(network_json['links'])
-
-        return network_json
+            from_nodes = apply_distinct(from_nodes, self._node_category)
+            to_nodes = apply_distinct(to_nodes, self._node_category)
+
+        edges = build_edges(
+            from_nodes,
+            to_nodes,
+            change,
+            from_value=np.where(outflow, value, 0),
+            to_value=np.where(outflow, 0, value),
+        ).top(TOP_X)
+        categories = edges.labels if type else [self._node_category(label) for label in edges.labels]
+        return edges.to_json(categories)
+
+    def process_range(self, start_date: str, end_date: str, granularity: str = 'daily', TOP_X: int = None, mode: str = 'usd', type: bool = False):
+        """
+        Yield `(date, network)` for every day from `start_date` up to, not including,
+        `end_date`, as `process_dataframe` builds it for that day's `compare_periods` frame.
+        All days come from one streamed query; days without comparable positions are skipped.
+        """
+        for day, C in self.bq.compare_period_range(start_date, end_date, granularity):
+            yield day.strftime('%Y-%m-%d'), self.process_dataframe(C, TOP_X=TOP_X, mode=mode, type=type)
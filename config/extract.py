@@ -0,0 +1,176 @@
+import logging
+import sys
+from array import array
+from itertools import repeat
+
+import numpy as np
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TVL_SCHEMA = {
+    "id": pl.Utf8,
+    "chain_name": pl.Utf8,
+    "date": pl.Int64,
+    "token_name": pl.Utf8,
+    "quantity": pl.Float64,
+    "value_usd": pl.Float64,
+    # `date` as a native DATE and as days since the epoch, so filters need no cast
+    "day": pl.Date,
+    "day_idx": pl.Int32,
+}
+
+SECONDS_PER_DAY = 86400
+
+OVERFLOW_POLICIES = ("zero", "clip", "raise")
+
+# Only these parts of a chain entry are needed; "tvl" is skipped by the streaming parser.
+CHAIN_KEYS = ("tokensInUsd", "tokens")
+
+
+class TokenTvlBuilder:
+    """
+    Accumulates the per-(chain, date, token) rows of a protocol payload directly into typed
+    column buffers instead of one dict per row.
+
+    Numbers that do not fit a float64 (DeFiLlama occasionally reports raw 10**30-scale token
+    amounts) are handled according to `on_overflow`:
+    - 'zero': store 0.0, matching how unparseable values have always been filled.
+    - 'clip': store +/- the largest finite float64.
+    - 'raise': raise OverflowError.
+    """
+
+    def __init__(self, on_overflow: str = "zero") -> None:
+        if on_overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unsupported overflow policy: {on_overflow}")
+        self.on_overflow = on_overflow
+        self.overflows = 0
+        self._chain_names = []
+        self._chain_rows = []
+        self._dates = array("q")
+        self._token_names = []
+        self._quantity = array("d")
+        self._value_usd = array("d")
+
+    def __len__(self) -> int:
+        return len(self._dates)
+
+    def _to_float(self, value) -> float:
+        if value is None:
+            return 0.0
+        try:
+            return float(value)
+        except OverflowError:
+            self.overflows += 1
+            if self.on_overflow == "raise":
+                raise
+            if self.on_overflow == "clip":
+                return sys.float_info.max if value > 0 else -sys.float_info.max
+            return 0.0
+
+    def _extend_floats(self, column: array, values: list) -> None:
+        # fromlist leaves the buffer untouched on error, so fall back to converting one by one
+        try:
+            column.fromlist(values)
+        except (TypeError, OverflowError, ValueError):
+            column.fromlist([self._to_float(value) for value in values])
+
+    def add_chain(self, chain_name: str, chain_data: dict) -> None:
+        start = len(self._dates)
+        for usd_entry, quantity_entry in zip(
+            chain_data.get("tokensInUsd") or [], chain_data.get("tokens") or []
+        ):
+            tokens_usd = usd_entry["tokens"]
+            if not tokens_usd:
+                continue
+            tokens_quantity = quantity_entry["tokens"]
+            self._token_names.extend(tokens_usd)
+            self._dates.extend(repeat(int(usd_entry["date"]), len(tokens_usd)))
+            self._extend_floats(self._value_usd, list(tokens_usd.values()))
+            self._extend_floats(
+                self._quantity, [tokens_quantity.get(token, 0) for token in tokens_usd]
+            )
+        self._chain_names.append(chain_name)
+        self._chain_rows.append(len(self._dates) - start)
+
+    def to_frame(self, protocol_id) -> pl.DataFrame:
+        if self.overflows:
+            logger.warning(
+                "%s values of protocol %s overflowed float64 (policy: %s)",
+                self.overflows, protocol_id, self.on_overflow,
+            )
+        if not len(self):
+            return pl.DataFrame(schema=TOKEN_TVL_SCHEMA)
+        chain_names = np.repeat(np.array(self._chain_names, dtype=object), self._chain_rows)
+        dates = np.frombuffer(self._dates, dtype=np.int64)
+        day_idx = (dates // SECONDS_PER_DAY).astype(np.int32)
+        return pl.DataFrame(
+            {
+                "id": np.full(len(self), str(protocol_id), dtype=object),
+                "chain_name": chain_names,
+                "date": dates,
+                "token_name": self._token_names,
+                "quantity": np.frombuffer(self._quantity, dtype=np.float64),
+                "value_usd": np.frombuffer(self._value_usd, dtype=np.float64),
+                "day": day_idx,
+                "day_idx": day_idx,
+            },
+            schema=TOKEN_TVL_SCHEMA,
+        )
+
+
+def token_tvl_frame(data: dict, on_overflow: str = "zero") -> pl.DataFrame:
+    """Flatten a parsed `/protocol/{slug}` payload into one row per (chain, date, token)."""
+    builder = TokenTvlBuilder(on_overflow)
+    for chain_name, chain_data in data["chainTvls"].items():
+        builder.add_chain(chain_name, chain_data)
+    return builder.to_frame(data["id"])
+
+
+def _build_chain(events, prefix: str) -> dict:
+    """Consume the parser events of one `chainTvls` entry, materializing only CHAIN_KEYS."""
+    from ijson import ObjectBuilder
+
+    builders = {}
+    builder = None
+    for event_prefix, event, value in events:
+        if event_prefix == prefix:
+            if event == "map_key":
+                builder = ObjectBuilder() if value in CHAIN_KEYS else None
+                if builder is not None:
+                    builders[value] = builder
+            elif event == "end_map":
+                break
+        elif builder is not None:
+            builder.event(event, value)
+    return {key: builder.value for key, builder in builders.items()}
+
+
+def token_tvl_frame_from_stream(fp, on_overflow: str = "zero") -> pl.DataFrame:
+    """
+    Same as token_tvl_frame, but parses the payload incrementally from a binary file-like
+    object with ijson. Only one chain's token history is held as Python objects at a time,
+    so peak memory no longer scales with the full protocol JSON.
+    """
+    import ijson
+
+    try:
+        return _parse_stream(ijson, fp, on_overflow)
+    except ijson.JSONError:
+        # The C backends reject integers beyond int64; the pure Python one does not.
+        if not fp.seekable() or ijson.backend == "python":
+            raise
+        fp.seek(0)
+        return _parse_stream(ijson.get_backend("python"), fp, on_overflow)
+
+
+def _parse_stream(backend, fp, on_overflow: str) -> pl.DataFrame:
+    builder = TokenTvlBuilder(on_overflow)
+    protocol_id = None
+    events = backend.parse(fp, use_float=True)
+    for prefix, event, value in events:
+        if prefix == "id" and event in ("string", "number"):
+            protocol_id = value
+        elif prefix == "chainTvls" and event == "map_key":
+            builder.add_chain(value, _build_chain(events, f"chainTvls.{value}"))
+    return builder.to_frame(protocol_id)
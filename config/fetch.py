@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    """Spaces out requests so that each host sees at most `rate` requests per second."""
+
+    def __init__(self, rate: Optional[float]) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = {}
+        self._locks = {}
+
+    async def wait(self, host: str) -> None:
+        if not self.interval:
+            return
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of API responses.
+
+    Bodies are stored once under `blobs/<sha256>`; `index/<key>.json` maps a cache key (the
+    protocol slug) to the digest of its latest body together with the ETag / Last-Modified
+    validators the server sent with it. Bodies superseded by a newer one stay on disk until
+    `sweep` removes them.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "index"), exist_ok=True)
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.root, "index", f"{key}.json")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest)
+
+    def entry(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._index_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if os.path.exists(self._blob_path(entry["digest"])) else None
+
+    def load(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), "rb") as f:
+            return f.read()
+
+    def store(self, key: str, content: bytes, headers: httpx.Headers) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            _write_atomic(blob_path, content)
+        entry = {
+            "digest": digest,
+            "size": len(content),
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        _write_atomic(self._index_path(key), json.dumps(entry).encode())
+        return digest
+
+    def sweep(self) -> int:
+        """
+        Delete the blobs no index entry points to any more. Several keys can share a blob,
+        so superseded bodies are not removed by `store`; run this once no payload of the
+        current run is still being read. Returns the number of blobs removed.
+        """
+        referenced = set()
+        for name in os.listdir(os.path.join(self.root, "index")):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.root, "index", name)) as f:
+                    referenced.add(json.load(f)["digest"])
+            except (OSError, ValueError, KeyError):
+                continue
+        removed = 0
+        for digest in os.listdir(os.path.join(self.root, "blobs")):
+            if digest not in referenced:
+                os.remove(self._blob_path(digest))
+                removed += 1
+        return removed
+
+
+def _write_atomic(path: str, content: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class Payload:
+    """A downloaded body with its sha256 digest; `changed` is False if it matches the cache."""
+
+    def __init__(self, digest: str, changed: bool, content: Optional[bytes] = None,
+                 cache: Optional[ResponseCache] = None) -> None:
+        self.digest = digest
+        self.changed = changed
+        self._content = content
+        self._cache = cache
+
+    def read(self) -> bytes:
+        if self._content is None:
+            self._content = self._cache.load(self.digest)
+        return self._content
+
+
+class LlamaFetcher:
+    """
+    Async client for the DeFiLlama API.
+
+    All requests go through one keep-alive connection pool. A semaphore bounds the number of
+    requests in flight, a per-host limiter spaces them out, and transient failures
+    (transport errors, 429 and 5xx responses) are retried with exponential backoff.
+
+    With a `cache`, `fetch_protocol_cached` sends conditional requests using the validators
+    of the last cached response, and a 304 is served from the cache without a body transfer.
+
+    Use as an async context manager so the pool is closed when the run ends:
+
+        async with LlamaFetcher(BASE_URL) as fetcher:
+            data = await fetcher.fetch_protocol("aave")
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_concurrency: int = 16,
+        requests_per_second: Optional[float] = None,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        cache: Optional[ResponseCache] = None,
+    ) -> None:
+        self.base_url = base_url
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_limiter = HostRateLimiter(requests_per_second)
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+            transport=transport,
+        )
+
+    async def __aenter__(self) -> "LlamaFetcher":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return float(response.headers["Retry-After"])
+            except ValueError:
+                pass
+        return self.backoff * 2**attempt * (1 + random.random() / 2)
+
+    async def get(self, url: str, headers: Optional[dict] = None) -> Optional[httpx.Response]:
+        """GET `url`, retrying transient failures. Returns None if every attempt failed."""
+        host = urlsplit(url).netloc
+        for attempt in range(self.max_retries + 1):
+            response = None
+            # wait for the host's slot before taking a connection, so throttled requests
+            # do not hold connections that requests to other hosts could use
+            await self._rate_limiter.wait(host)
+            async with self._semaphore:
+                try:
+                    response = await self._client.get(url, headers=headers)
+                except httpx.TransportError as e:
+                    logger.warning("Request to %s failed: %s", url, e)
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return response
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._retry_delay(attempt, response))
+        logger.warning("Giving up on %s after %s attempts", url, self.max_retries + 1)
+        return None
+
+    async def fetch_json(self, url: str):
+        response = await self.get(url)
+        if response is not None and response.status_code == 200:
+            return response.json()
+
+    async def fetch_protocols(self):
+        return await self.fetch_json(f"{self.base_url}protocols")
+
+    async def fetch_protocol(self, slug: str):
+        return await self.fetch_json(f"{self.base_url}protocol/{slug}")
+
+    async def fetch_protocol_cached(self, slug: str) -> Optional[Payload]:
+        """
+        `/protocol/{slug}` as a Payload. With a cache, the request is conditional and an
+        unchanged body (304, or 200 with the same digest) comes back with `changed=False`.
+        """
+        url = f"{self.base_url}protocol/{slug}"
+        entry = self.cache.entry(slug) if self.cache is not None else None
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = await self.get(url, headers=headers)
+        if response is None:
+            return None
+        if response.status_code == 304 and entry is not None:
+            return Payload(entry["digest"], changed=False, cache=self.cache)
+        if response.status_code != 200:
+            return None
+
+        content = response.content
+        if self.cache is None:
+            return Payload(hashlib.sha256(content).hexdigest(), changed=True, content=content)
+        digest = self.cache.store(slug, content, response.headers)
+        changed = entry is None or entry["digest"] != digest
+        return Payload(digest, changed=changed, content=content)
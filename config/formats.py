@@ -0,0 +1,103 @@
+from typing import Iterator
+
+import pyarrow as pa
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pq
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class _ChunkSink:
+    """
+    Write-only file object that hands back what was written since the last `drain`.
+
+    Writers ask for `tell()` to record offsets (the Parquet footer does), so the position
+    keeps counting across drains even though the bytes themselves are released.
+    """
+
+    def __init__(self) -> None:
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        chunk = b"".join(self._parts)
+        self._parts.clear()
+        return chunk
+
+
+class _CSVWriter:
+    """
+    CSV exactly as `DataFrame.to_csv(index=False)` writes it, which is what the endpoints
+    returned before they streamed and what the dashboard data loaders parse: dates without
+    a time part, pandas' float formatting and quoting only where needed.
+    """
+
+    def __init__(self, sink: pa.PythonFile, schema: pa.Schema) -> None:
+        self.sink = sink
+        self.schema = schema
+        self.header = True
+
+    def _write(self, df) -> None:
+        self.sink.write(df.to_csv(index=False, header=self.header).encode())
+        self.header = False
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        self._write(batch.to_pandas())
+
+    def close(self) -> None:
+        if self.header:
+            # an empty result still gets its header line
+            self._write(self.schema.empty_table().to_pandas())
+
+
+def _writer(fmt: str, sink: pa.PythonFile, schema: pa.Schema):
+    if fmt == "csv":
+        return _CSVWriter(sink, schema)
+    if fmt == "arrow":
+        return pa_ipc.new_stream(sink, schema)
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema)
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+def encode_batches(reader: pa.RecordBatchReader, fmt: str = "csv") -> Iterator[bytes]:
+    """
+    Encode record batches as `fmt` ('csv', 'arrow' or 'parquet'), one chunk per batch.
+
+    Only the current batch is held in memory. CSV starts with the header line, Arrow is the
+    IPC stream format, and Parquet writes one row group per batch followed by the footer.
+    """
+    sink = _ChunkSink()
+    writer = _writer(fmt, pa.PythonFile(sink, mode="w"), reader.schema)
+    try:
+        for batch in reader:
+            writer.write_batch(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+        reader.close()
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
@@ -0,0 +1,207 @@
+import uuid
+
+import polars as pl
+
+
+INCREMENTAL_INSERT = """
+INSERT INTO {table_name} BY NAME
+SELECT s.*
+FROM {view_name} s
+LEFT JOIN (
+    SELECT id, chain_name, token_name, MAX(date) AS latest_date
+    FROM {table_name}
+    WHERE id IN (SELECT DISTINCT id FROM {view_name})
+    GROUP BY id, chain_name, token_name
+) w ON s.id = w.id AND s.chain_name = w.chain_name AND s.token_name = w.token_name
+WHERE w.latest_date IS NULL OR s.date > w.latest_date
+"""
+
+
+DAY_COLUMNS_MIGRATION = """
+ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS day DATE;
+ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS day_idx INTEGER;
+UPDATE {table_name}
+SET day_idx = CAST(FLOOR(date / 86400) AS INTEGER),
+    day = DATE '1970-01-01' + CAST(FLOOR(date / 86400) AS INTEGER)
+WHERE day IS NULL OR day_idx IS NULL;
+"""
+
+
+def table_exists(con, table_name: str) -> bool:
+    return con.execute(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = ?)",
+        [table_name],
+    ).fetchone()[0]
+
+
+def insert_frame(
+    con, table_name: str, df, exists: bool = None, incremental: bool = False
+) -> None:
+    """
+    Append an in-memory Polars/pandas/Arrow frame to `table_name`, creating the table from the
+    frame's schema if it does not exist yet. The frame is registered on the connection as a
+    view, so DuckDB scans the Arrow buffers directly instead of a Parquet round-trip.
+    Columns are matched by name, so the frame may omit columns the table has.
+
+    With `incremental`, only rows newer than the latest date already stored for their
+    (id, chain_name, token_name) are inserted; the comparison runs inside the database.
+    """
+    if isinstance(df, pl.DataFrame):
+        df = df.to_arrow()
+    if exists is None:
+        exists = table_exists(con, table_name)
+
+    view_name = f"staged_{uuid.uuid4().hex}"
+    con.register(view_name, df)
+    try:
+        if exists and incremental:
+            con.execute(INCREMENTAL_INSERT.format(table_name=table_name, view_name=view_name))
+        elif exists:
+            con.execute(f"INSERT INTO {table_name} BY NAME SELECT * FROM {view_name}")
+        else:
+            con.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {view_name}")
+    finally:
+        con.unregister(view_name)
+
+
+def add_day_columns(con, table_name: str) -> None:
+    """
+    Add the `day` (DATE) and `day_idx` (days since epoch) columns to a table of epoch-second
+    `date`s and backfill them for rows written before they existed. Safe to run repeatedly;
+    once backfilled, the UPDATE matches no rows.
+    """
+    if table_exists(con, table_name):
+        con.execute(DAY_COLUMNS_MIGRATION.format(table_name=table_name))
+
+
+def bump_data_version(con, table_name: str) -> int:
+    """
+    Record that the warehouse tables changed and return the new version. Readers compare
+    versions to decide whether results they cached are stale; every bump appends a row, so
+    the table doubles as a log of ingest runs.
+    """
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {table_name} (version BIGINT, updated_at TIMESTAMP)"
+    )
+    con.execute(
+        f"INSERT INTO {table_name} SELECT COALESCE(MAX(version), 0) + 1, now() FROM {table_name}"
+    )
+    return read_data_version(con, table_name)
+
+
+def read_data_version(con, table_name: str) -> int:
+    """The latest version recorded by `bump_data_version`, or 0 before the first bump."""
+    if not table_exists(con, table_name):
+        return 0
+    return con.execute(f"SELECT COALESCE(MAX(version), 0) FROM {table_name}").fetchone()[0]
+
+
+def replace_table(con, table_name: str, df) -> None:
+    """
+    Replace `table_name` with the rows of `df` so that readers never see it missing or
+    half-loaded. The frame is loaded into a shadow table first; the old table is then dropped
+    and the shadow renamed in a single transaction, so concurrent queries read either the
+    old or the new contents.
+    """
+    shadow_name = f"{table_name}__shadow"
+    con.execute(f"DROP TABLE IF EXISTS {shadow_name}")
+    insert_frame(con, shadow_name, df, exists=False)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DROP TABLE IF EXISTS {table_name}")
+        con.execute(f"ALTER TABLE {shadow_name} RENAME TO {table_name}")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+
+class BulkLoader:
+    """
+    Write-behind buffer for appending many small frames to one table.
+
+    Frames passed to `add` are held in memory and written with a single INSERT once the
+    buffered row count or estimated size crosses `max_rows` / `max_bytes`, or when `flush`
+    is called. The table existence check runs once per loader instead of once per insert.
+
+    `before_flush(keys)` is called right before a batch is written and `on_flush(keys, df)`
+    after every successful flush, with the keys passed to `add` and the frame that was
+    written. `incremental` is passed through to insert_frame.
+    """
+
+    def __init__(
+        self,
+        con,
+        table_name: str,
+        max_rows: int = 1_000_000,
+        max_bytes: int = 256 * 1024**2,
+        before_flush=None,
+        on_flush=None,
+        incremental: bool = False,
+    ) -> None:
+        self.con = con
+        self.table_name = table_name
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.before_flush = before_flush
+        self.on_flush = on_flush
+        self.incremental = incremental
+        self.flushes = 0
+        self.rows_written = 0
+        self._exists = None
+        self._frames = []
+        self._keys = []
+        self._rows = 0
+        self._bytes = 0
+
+    def __enter__(self) -> "BulkLoader":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.flush()
+
+    @property
+    def pending_rows(self) -> int:
+        return self._rows
+
+    def add(self, df: pl.DataFrame, key=None) -> None:
+        if key is not None:
+            self._keys.append(key)
+        if df.is_empty():
+            return
+        self._frames.append(df)
+        self._rows += df.height
+        self._bytes += df.estimated_size()
+        if self._rows >= self.max_rows or self._bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write everything buffered so far. Returns the number of rows written."""
+        keys, frames = self._keys, self._frames
+        if not frames and not keys:
+            return 0
+        df = pl.concat(frames, how="vertical") if frames else None
+        if self.before_flush is not None:
+            self.before_flush(keys)
+        if df is not None:
+            if self._exists is None:
+                self._exists = table_exists(self.con, self.table_name)
+            insert_frame(
+                self.con, self.table_name, df,
+                exists=self._exists, incremental=self.incremental,
+            )
+            self._exists = True
+            self.flushes += 1
+            self.rows_written += df.height
+
+        self._frames, self._keys, self._rows, self._bytes = [], [], 0, 0
+        if self.on_flush is not None:
+            self.on_flush(keys, df)
+        return 0 if df is None else df.height
+
+    def discard(self) -> list:
+        """Drop everything buffered, e.g. after a failed flush. Returns the dropped keys."""
+        keys = self._keys
+        self._frames, self._keys, self._rows, self._bytes = [], [], 0, 0
+        return keys
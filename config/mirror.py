@@ -0,0 +1,103 @@
+import glob
+import logging
+import os
+import shutil
+import time
+from datetime import date, datetime, timezone
+from typing import Iterable, Optional, Set, Tuple
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+SORT_KEYS = "token_name, id, date"
+
+
+def month_key(day: date) -> int:
+    """`year * 100 + month`, the value partition filters compare against."""
+    return day.year * 100 + day.month
+
+
+class ParquetMirror:
+    """
+    Local copy of table C as Hive-partitioned Parquet: `<root>/year=YYYY/month=M/data.parquet`.
+
+    Every partition is sorted by (token_name, id, date) and written in modest row groups, so
+    the min/max statistics of each row group let DuckDB skip everything but the requested
+    token, and filters on the `year` / `month` partition columns skip whole files.
+
+    The months touched by flushed batches are recorded with `touch` (or, from the ingest
+    flow's checkpoint store, `touch_since`) and only those partitions are rewritten by
+    `refresh`; `rebuild` writes every month of the table.
+    """
+
+    def __init__(self, root: str, row_group_size: int = 16_384) -> None:
+        self.root = root
+        self.row_group_size = row_group_size
+        self.touched: Set[Tuple[int, int]] = set()
+
+    def exists(self) -> bool:
+        return bool(glob.glob(os.path.join(self.root, "year=*", "month=*", "*.parquet")))
+
+    def relation(self) -> str:
+        """Table expression for queries; exposes `year` and `month` as partition columns."""
+        path = os.path.join(self.root, "*", "*", "*.parquet")
+        return f"read_parquet('{path}', hive_partitioning = true)"
+
+    def touch(self, df: Optional[pl.DataFrame]) -> None:
+        """Remember the (year, month) partitions a frame with epoch-second `date`s falls in."""
+        if df is None or df.is_empty():
+            return
+        months = (
+            df.select(pl.from_epoch(pl.col("date"), time_unit="s").alias("ts"))
+            .select(pl.col("ts").dt.year().alias("year"), pl.col("ts").dt.month().alias("month"))
+            .unique()
+        )
+        self.touched.update(months.iter_rows())
+
+    def touch_since(self, first_date: int, last_date: Optional[int] = None) -> None:
+        """Remember every partition from the month of `first_date` to that of `last_date` (now)."""
+        first = datetime.fromtimestamp(first_date, tz=timezone.utc)
+        last = datetime.fromtimestamp(time.time() if last_date is None else last_date, tz=timezone.utc)
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            self.touched.add((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    def _write_month(self, con, table_name: str, year: int, month: int) -> None:
+        partition = os.path.join(self.root, f"year={year}", f"month={month}")
+        os.makedirs(partition, exist_ok=True)
+        tmp_path = os.path.join(partition, "data.parquet.tmp")
+        con.execute(
+            f"""
+            COPY (
+                SELECT * FROM {table_name}
+                WHERE day >= make_date(?, ?, 1)
+                    AND day < CAST(make_date(?, ?, 1) + INTERVAL 1 MONTH AS DATE)
+                ORDER BY {SORT_KEYS}
+            ) TO '{tmp_path}' (FORMAT PARQUET, ROW_GROUP_SIZE {self.row_group_size})
+            """,
+            [year, month, year, month],
+        )
+        os.replace(tmp_path, os.path.join(partition, "data.parquet"))
+
+    def refresh(self, con, table_name: str, months: Iterable[Tuple[int, int]] = None) -> int:
+        """Rewrite the given (or touched) months from `table_name`. Returns the count."""
+        months = sorted(self.touched if months is None else months)
+        for year, month in months:
+            self._write_month(con, table_name, year, month)
+        self.touched.clear()
+        if months:
+            logger.info("Refreshed %s mirror partitions under %s", len(months), self.root)
+        return len(months)
+
+    def rebuild(self, con, table_name: str) -> int:
+        """Write every month of `table_name`, dropping partitions no longer in the table."""
+        months = con.execute(
+            f"SELECT DISTINCT year(day), month(day) FROM {table_name}"
+        ).fetchall()
+        keep = {os.path.join(self.root, f"year={y}", f"month={m}") for y, m in months}
+        for partition in glob.glob(os.path.join(self.root, "year=*", "month=*")):
+            if partition not in keep:
+                shutil.rmtree(partition)
+        return self.refresh(con, table_name, months)
@@ -0,0 +1,204 @@
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import polars as pl
+
+from .extract import token_tvl_frame, token_tvl_frame_from_stream
+from .watermark import WatermarkIndex
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def parse_and_filter(
+    payload: bytes,
+    watermarks: Optional[pl.DataFrame],
+    streaming: bool = False,
+    on_overflow: str = "zero",
+):
+    """
+    Parse one protocol payload and drop rows at or below its watermarks.
+
+    Runs in a worker process, so it only receives the protocol's own watermark slice.
+    Returns the new rows, the number of rows in the payload and the protocol id.
+    """
+    if streaming:
+        df = token_tvl_frame_from_stream(io.BytesIO(payload), on_overflow=on_overflow)
+    else:
+        df = token_tvl_frame(json.loads(payload), on_overflow=on_overflow)
+    if df.is_empty():
+        return df, 0, None
+    protocol_id = df["id"][0]
+    if watermarks is not None:
+        return WatermarkIndex({protocol_id: watermarks}).filter_new_rows(df), df.height, protocol_id
+    return df, df.height, protocol_id
+
+
+class IngestPipeline:
+    """
+    Three-stage protocol ingest connected by bounded queues:
+
+    1. download: async fetches scheduled by an AdaptiveScheduler; unchanged payloads are
+       settled against the checkpoint store here and never reach the later stages.
+    2. parse: `parse_and_filter` on a ProcessPoolExecutor, so JSON parsing and filtering
+       use all cores instead of blocking the event loop.
+    3. write: a single consumer feeding the BulkLoader, with its flushes run off the loop.
+       A failed flush marks the slugs of its batch failed and the stage keeps draining.
+
+    The queues hold at most `queue_size` items, so a slow writer applies backpressure to
+    parsing and parsing to downloads. A download job only ends once the writer has consumed
+    its slug, so the scheduler's memory charge covers the payload through every stage.
+    """
+
+    def __init__(
+        self,
+        fetcher,
+        store,
+        loader,
+        scheduler,
+        watermarks: Optional[WatermarkIndex],
+        protocol_ids: Dict[str, str],
+        parse_workers: Optional[int] = None,
+        queue_size: int = 8,
+        streaming: bool = False,
+        on_overflow: str = "zero",
+        debug_dir: Optional[str] = None,
+        log: logging.Logger = logger,
+    ) -> None:
+        self.fetcher = fetcher
+        self.store = store
+        self.loader = loader
+        self.scheduler = scheduler
+        self.watermarks = watermarks
+        self.protocol_ids = protocol_ids
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.streaming = streaming
+        self.on_overflow = on_overflow
+        self.debug_dir = debug_dir
+        self.log = log
+
+    def _watermark_slice(self, slug: str):
+        if self.watermarks is None:
+            return None
+        protocol_id = self.protocol_ids.get(slug)
+        return None if protocol_id is None else self.watermarks.for_protocol(protocol_id)
+
+    async def _download(self, slug: str, parse_queue: asyncio.Queue) -> None:
+        payload = await self.fetcher.fetch_protocol_cached(slug)
+        if payload is None:
+            self.store.mark_failed(slug)
+            return
+        if self.store.is_unchanged(slug, payload.digest):
+            # same body as the last successful ingest, nothing to parse
+            self.store.mark_done(slug, payload_hash=payload.digest)
+            return
+        if self.debug_dir is not None:
+            with open(os.path.join(self.debug_dir, f"{slug}.json"), "wb") as f:
+                f.write(payload.read())
+        consumed = asyncio.get_running_loop().create_future()
+        await parse_queue.put((slug, payload.read(), payload.digest, consumed))
+        # the job, and the scheduler's memory charge for it, lasts until the slug is written
+        await consumed
+
+    @staticmethod
+    def _settle(consumed: asyncio.Future) -> None:
+        if not consumed.done():
+            consumed.set_result(None)
+
+    async def _parse(self, pool, parse_queue: asyncio.Queue, write_queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while (item := await parse_queue.get()) is not _DONE:
+            slug, content, digest, consumed = item
+            try:
+                df, total_rows, protocol_id = await loop.run_in_executor(
+                    pool, parse_and_filter, content, self._watermark_slice(slug),
+                    self.streaming, self.on_overflow,
+                )
+            except Exception:
+                self.log.exception("Failed to process %s.", slug)
+                self.store.mark_failed(slug)
+                self._settle(consumed)
+                continue
+            if slug not in self.protocol_ids and self.watermarks is not None and total_rows:
+                # slug missing from the headers, so its slice could not be sent ahead
+                df = self.watermarks.filter_new_rows(df)
+            await write_queue.put((slug, protocol_id, digest, df, total_rows, consumed))
+
+    async def _write(self, write_queue: asyncio.Queue) -> None:
+        while (item := await write_queue.get()) is not _DONE:
+            *item, consumed = item
+            try:
+                await self._write_one(*item)
+            finally:
+                self._settle(consumed)
+
+    async def _write_one(self, slug, protocol_id, digest, df, total_rows) -> None:
+        if not total_rows:
+            self.log.critical("No data found in llama data %s.", slug)
+            self.store.mark_done(slug, payload_hash=digest)
+            return
+        if df.is_empty():
+            self.store.mark_done(slug, protocol_id, digest)
+            return
+        if self.debug_dir is not None:
+            df.write_parquet(os.path.join(self.debug_dir, f"{slug}.parquet"))
+        # the slug is marked done by the store once this batch is flushed
+        try:
+            await asyncio.to_thread(self.loader.add, df, (slug, protocol_id, digest))
+        except Exception:
+            # keep draining, or the parsers and downloads would block on full queues
+            self.log.exception("Failed to write the batch buffered up to %s.", slug)
+            for failed_slug, _, _ in self.loader.discard():
+                self.store.mark_failed(failed_slug)
+            return
+        self.log.warning("Buffered %s lines of new data for %s", df.height, slug)
+
+    async def run(self, slugs, priority=None) -> None:
+        parse_queue = asyncio.Queue(maxsize=self.queue_size)
+        write_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        # polars' thread pool does not survive fork, so workers are spawned
+        pool = ProcessPoolExecutor(
+            max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        with pool:
+            writer = asyncio.ensure_future(self._write(write_queue))
+            parsers = [
+                asyncio.ensure_future(self._parse(pool, parse_queue, write_queue))
+                for _ in range(self.parse_workers)
+            ]
+            downloads = asyncio.ensure_future(self.scheduler.run(
+                slugs, lambda slug: self._download(slug, parse_queue), priority=priority
+            ))
+            tasks = parsers + [writer, downloads]
+
+            def stop_on_failure(task):
+                # downloads wait for the writer, so a dead stage would otherwise hang the run
+                if not task.cancelled() and task.exception() is not None:
+                    for other in tasks:
+                        other.cancel()
+
+            for task in tasks:
+                task.add_done_callback(stop_on_failure)
+            try:
+                await downloads
+                for _ in parsers:
+                    await parse_queue.put(_DONE)
+                await asyncio.gather(*parsers)
+                await write_queue.put(_DONE)
+                await writer
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+                raise
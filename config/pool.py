@@ -0,0 +1,130 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class PoolTimeout(TimeoutError):
+    """No cursor became free within the pool's timeout."""
+
+
+class CursorPool:
+    """
+    Fixed set of DuckDB cursors over one connection, handed out one per query.
+
+    A DuckDB connection runs one statement at a time, and starting a new one invalidates a
+    result that is still being read. Cursors share the connection's database but execute
+    independently, so threads holding different cursors query concurrently. Cursors are
+    opened on first use; when all `size` are taken, `cursor()` waits up to `timeout`
+    seconds for one to be returned and then raises `PoolTimeout`.
+    """
+
+    def __init__(self, con, size: int = 8, timeout: float = 30.0) -> None:
+        self.con = con
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self.con.cursor()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(
+                f"No DuckDB cursor free after {self.timeout}s ({self.size} in use)"
+            ) from None
+
+    def acquire(self):
+        """Take a cursor; it must be handed back with `release`."""
+        return self._take()
+
+    def release(self, cursor) -> None:
+        self._idle.put(cursor)
+
+    @contextmanager
+    def cursor(self) -> Iterator:
+        cursor = self.acquire()
+        try:
+            yield cursor
+        finally:
+            self.release(cursor)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class PooledReader:
+    """
+    Record batch reader over a pooled cursor that it owns.
+
+    The cursor goes back to the pool once the batches are exhausted, on `close`, or when
+    the reader is garbage collected, also if no batch was ever read, e.g. when a streamed
+    response is dropped before its body starts.
+    """
+
+    def __init__(self, pool: CursorPool, cursor, reader) -> None:
+        self._pool = pool
+        self._cursor = cursor
+        self._reader = reader
+        self._lock = threading.Lock()
+
+    @property
+    def schema(self):
+        return self._reader.schema
+
+    def read_next_batch(self):
+        try:
+            return self._reader.read_next_batch()
+        except StopIteration:
+            self.close()
+            raise
+
+    def read_all(self):
+        try:
+            return self._reader.read_all()
+        finally:
+            self.close()
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read_next_batch()
+            except StopIteration:
+                return
+
+    def close(self) -> None:
+        with self._lock:
+            cursor, self._cursor = self._cursor, None
+        if cursor is None:
+            return
+        try:
+            self._reader.close()
+        finally:
+            self._pool.release(cursor)
+
+    def __enter__(self) -> "PooledReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if getattr(self, "_cursor", None) is not None:
+            self.close()
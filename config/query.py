@@ -1,49 +1,125 @@
-from google.cloud import bigquery, exceptions
-from google.cloud.bigquery import DatasetReference
-from google.cloud.bigquery.table import Table
-from google.cloud.bigquery.client import Client
-from google.cloud.bigquery.dataset import DatasetReference
-from google.oauth2 import service_account
-from google.oauth2.service_account import Credentials
-from typing import Optional
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
 import pandas as pd
-import streamlit as st
-from .config import TABLES, MD_TOKEN
+from .config import TABLES, MD_TOKEN, C_MIRROR_DIR, RESULT_BATCH_SIZE, DATA_VERSION_TABLE, QUERY_POOL_SIZE, QUERY_POOL_TIMEOUT
+from .pool import CursorPool, PooledReader
+from .loader import read_data_version
+from .mirror import ParquetMirror, month_key
+from .rollup import GRANULARITIES, Rollups
 import duckdb
 
 import sys
 import os
+import threading
 
-from datetime import datetime
+from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
 from dateutil.parser import parse
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.config import QUERY_DATA_SET, QUERY_PROJECT
 
+if TYPE_CHECKING:
+    from google.cloud.bigquery.client import Client
+    from google.cloud.bigquery.dataset import DatasetReference
+    from google.cloud.bigquery.table import Table
+
+BQ_TYPES = (
+    (bool, 'BOOL'),
+    (int, 'INT64'),
+    (float, 'FLOAT64'),
+    (datetime, 'TIMESTAMP'),
+    (date, 'DATE'),
+    (str, 'STRING'),
+)
+
+
+def _bq_type(value) -> str:
+    for python_type, bq_type in BQ_TYPES:
+        if isinstance(value, python_type):
+            return bq_type
+    raise TypeError(f"Unsupported query parameter type: {type(value).__name__}")
+
+
+def _bq_parameter(name: str, value):
+    """Named BigQuery query parameter; lists become ARRAY parameters."""
+    from google.cloud import bigquery
+
+    if isinstance(value, (list, tuple)):
+        element_type = _bq_type(value[0]) if value else 'STRING'
+        return bigquery.ArrayQueryParameter(name, element_type, list(value))
+    return bigquery.ScalarQueryParameter(name, _bq_type(value), value)
+
+
 class BigQueryClient:
+    """
+    Queries the BigQuery copy of the tables. The google-cloud and streamlit imports and the
+    service-account credentials are only loaded when the first query needs the client.
+    """
+
     def __init__(self, project: str = QUERY_PROJECT, dataset: str = QUERY_DATA_SET) -> None:
-        self.credentials: Credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"]
-        )
-        self.client: Client = bigquery.Client(credentials=self.credentials, project=project)
-        self.dataset_ref: DatasetReference = DatasetReference(project, dataset)
+        self.project = project
+        self.dataset = dataset
+        self._client = None
+
+    @property
+    def client(self) -> 'Client':
+        if self._client is None:
+            import streamlit as st
+            from google.cloud import bigquery
+            from google.oauth2 import service_account
+
+            credentials = service_account.Credentials.from_service_account_info(
+                st.secrets["gcp_service_account"]
+            )
+            self._client = bigquery.Client(credentials=credentials, project=self.project)
+        return self._client
 
-    def _execute_query(self, query: str) -> pd.DataFrame:
+    @property
+    def dataset_ref(self) -> 'DatasetReference':
+        from google.cloud.bigquery import DatasetReference
+
+        return DatasetReference(self.project, self.dataset)
+
+    def _execute_query(self, query: str, params: Optional[dict] = None) -> pd.DataFrame:
+        """Run `query` with its `@name` placeholders bound from `params`. The query text is the
+        same for every call of a method, so BigQuery can serve repeats from its result cache."""
+        from google.cloud import bigquery, exceptions
+
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[_bq_parameter(name, value) for name, value in (params or {}).items()]
+        )
         try:
-            return self.client.query(query).to_dataframe()
+            return self.client.query(query, job_config=job_config).to_dataframe()
         except exceptions.GoogleCloudError as e:
             raise RuntimeError(f"Query execution failed: {e}")
+
+    def _param(self, name: str) -> str:
+        """Placeholder for the named parameter `name` in this engine's SQL dialect."""
+        return f'@{name}'
+
+    def _in_list(self, column: str, name: str) -> str:
+        return f'{column} IN UNNEST(@{name})'
         
     def _get_date_trunc_expr(self, granularity: str) -> str:
+        # the BigQuery copy of table C only has the epoch seconds `date`, not `day`
+        day = "DATE(TIMESTAMP_SECONDS(CAST(ROUND(C.date) AS INT64)))"
         expressions = {
-            'weekly': "DATE_TRUNC(DATE(TIMESTAMP_SECONDS(CAST(ROUND(C.date) AS INT64))), WEEK(MONDAY))",
-            'monthly': "DATE_TRUNC(DATE(TIMESTAMP_SECONDS(CAST(ROUND(C.date) AS INT64))), MONTH)",
-            'daily': "DATE(DATE(TIMESTAMP_SECONDS(CAST(ROUND(C.date) AS INT64))))"
+            'weekly': f"DATE_TRUNC({day}, WEEK(MONDAY))",
+            'monthly': f"DATE_TRUNC({day}, MONTH)",
+            'daily': day
         }
         return expressions.get(granularity, expressions['daily'])
 
-    def _get_table(self, table_name: str) -> Table:
+    def _month_filter(self, year: str, month: str) -> str:
+        """`date` within the month, compared as epoch seconds so the column is not cast per row."""
+        first_day = f"DATE(@{year}, @{month}, 1)"
+        return (
+            f"date >= UNIX_SECONDS(TIMESTAMP({first_day})) AND "
+            f"date < UNIX_SECONDS(TIMESTAMP(DATE_ADD({first_day}, INTERVAL 1 MONTH)))"
+        )
+
+    def _get_table(self, table_name: str) -> 'Table':
         table_ref = self.dataset_ref.table(table_name)
         return self.client._get_table(table_ref) 
 
@@ -61,17 +137,17 @@ class BigQueryClient:
         return formatted_time
 
     def _get_table_name(self, table_name: str) -> str:
-        return f'{self.dataset_ref.dataset_id}.{table_name}'
+        return f'{self.dataset}.{table_name}'
 
     def get_dataframe(self, table_name: str, limit: Optional[int] = None) -> pd.DataFrame:
         if limit is not None:
             query = (
-                f"SELECT * FROM {self._get_table_name(table_name)} LIMIT {limit}"
-            )
-        else:
-            query = (
-                f"SELECT * FROM {self._get_table_name(table_name)}"
+                f"SELECT * FROM {self._get_table_name(table_name)} LIMIT {self._param('limit')}"
             )
+            return self._execute_query(query, {'limit': int(limit)})
+        query = (
+            f"SELECT * FROM {self._get_table_name(table_name)}"
+        )
         return self._execute_query(query)
     
     def get_table_rows(self, table_name, unique_ids):
@@ -79,9 +155,10 @@ class BigQueryClient:
         query = f"""
         SELECT *
         FROM {self._get_table_name(table_name)}
-        WHERE id IN ({', '.join(map(str, unique_ids))})
+        WHERE {self._in_list('id', 'ids')}
         """
-        return self._execute_query(query)
+        # ids are text in the tables, but callers may pass them as ints
+        return self._execute_query(query, {'ids': [str(i) for i in unique_ids]})
         
     def get_token_distribution(self, token_name: str, granularity: str) -> pd.DataFrame:
         """Retrieve the distribution of a specific token across protocols over time at specified granularity."""
@@ -103,7 +180,7 @@ class BigQueryClient:
         INNER JOIN 
             {self.dataset_ref.dataset_id}.{TABLES['A']} A ON C.id = A.id
         WHERE 
-            C.token_name = '{token_name}' AND
+            C.token_name = @token_name AND
             C.quantity > 0 AND
             C.value_usd > 0
         GROUP BY 
@@ -117,7 +194,7 @@ class BigQueryClient:
             aggregated_date,
             id
         """        
-        return self._execute_query(query)
+        return self._execute_query(query, {'token_name': token_name})
     
     def get_protocol_data(self, protocol_name: str, granularity: str) -> pd.DataFrame:
         """Retrieve data for a specific protocol with granularity."""
@@ -141,7 +218,7 @@ class BigQueryClient:
         INNER JOIN 
             {self.dataset_ref.dataset_id}.{TABLES['A']} A ON C.id = A.id
         WHERE 
-            A.name = '{protocol_name}' AND
+            A.name = @protocol_name AND
             C.quantity > 0 AND
             C.value_usd > 0
         GROUP BY 
@@ -156,7 +233,7 @@ class BigQueryClient:
             aggregated_date,
             id
         """
-        return self._execute_query(query)
+        return self._execute_query(query, {'protocol_name': protocol_name})
     
     def compare_periods(self, year1: int, month1: int, year2: int, month2: int, table: str = TABLES['C']) -> pd.DataFrame:
         """Compare monthly aggregated data between two months."""
@@ -172,8 +249,7 @@ class BigQueryClient:
             FROM
                 {self._get_table_name(table)}
             WHERE
-                EXTRACT(YEAR FROM TIMESTAMP_SECONDS(CAST(date AS INT64))) = {year1} AND
-                EXTRACT(MONTH FROM TIMESTAMP_SECONDS(CAST(date AS INT64))) = {month1}
+                {self._month_filter('year1', 'month1')}
             GROUP BY
                 id, chain_name, token_name, year_month
         ),
@@ -188,8 +264,7 @@ class BigQueryClient:
             FROM
                 {self._get_table_name(table)}
             WHERE
-                EXTRACT(YEAR FROM TIMESTAMP_SECONDS(CAST(date AS INT64))) = {year2} AND
-                EXTRACT(MONTH FROM TIMESTAMP_SECONDS(CAST(date AS INT64))) = {month2}
+                {self._month_filter('year2', 'month2')}
             GROUP BY
                 id, chain_name, token_name, year_month
         )
@@ -213,7 +288,8 @@ class BigQueryClient:
             m2.qty_m2_avg - m1.qty != 0 OR
             m2.usd_m2_avg - m1.usd != 0
         """
-        return self._execute_query(query)
+        params = {'year1': int(year1), 'month1': int(month1), 'year2': int(year2), 'month2': int(month2)}
+        return self._execute_query(query, params)
     
     def query_by_month(self, year: int, month: int, table: str = TABLES['C']) -> pd.DataFrame:
         """Query aggregated data by month."""
@@ -229,13 +305,12 @@ class BigQueryClient:
         FROM
             {self._get_table_name(table)}
         WHERE
-            EXTRACT(YEAR FROM TIMESTAMP_SECONDS(CAST(date AS INT64))) = {year} AND
-            EXTRACT(MONTH FROM TIMESTAMP_SECONDS(CAST(date AS INT64))) = {month}
+            {self._month_filter('year', 'month')}
         GROUP BY
             id, chain_name, token_name, year_month
         """
         # Execute the query and return the DataFrame
-        return self._execute_query(query)
+        return self._execute_query(query, {'year': int(year), 'month': int(month)})
     
     def get_unique_token_names(self, table: str = TABLES['C']) -> pd.DataFrame:
         """Fetch unique token names from a specified table."""
@@ -243,7 +318,7 @@ class BigQueryClient:
         query = f"SELECT DISTINCT token_name FROM {self._get_table_name(table)}"
         try:
             return self._execute_query(query)
-        except exceptions.BadRequest as e:
+        except (RuntimeError, duckdb.Error) as e:
             if 'token_name' in str(e):
                 raise ValueError("The column 'token_name' does not exist in the specified table.") from e
             else:
@@ -266,23 +341,159 @@ class BigQueryClient:
         query = f"SELECT DISTINCT name, mcap FROM {self._get_table_name(table_name)} ORDER BY mcap DESC"
         try:
             return self._execute_query(query)
-        except exceptions.BadRequest as e:
+        except (RuntimeError, duckdb.Error) as e:
             if 'name' in str(e) or 'mcap' in str(e):
                 raise ValueError("Error in querying table A: " + str(e)) from e
             else:
                 raise
 
+PERIODS = {
+    'daily': "'1 day'",
+    'weekly': "'7 days'",
+    'monthly': "'1 month'",
+    'yearly': "'1 year'",
+}
+
+
+def period_end(start_date: datetime, granularity: str) -> datetime:
+    """The day one period after `start_date`, which `compare_periods` compares it with."""
+    if granularity == 'yearly':
+        return start_date + relativedelta(years=1)
+    elif granularity == 'monthly':
+        return start_date + relativedelta(months=1)
+    elif granularity == 'weekly':
+        return start_date + relativedelta(days=7)
+    elif granularity == 'daily':
+        return start_date + relativedelta(days=1)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+class StatementCache:
+    """
+    Parsed DuckDB statements keyed by their SQL text, least recently used first.
+
+    The query builders emit one text per query shape (which filters are present) and pass
+    values as named `$parameters`, so every request of the same shape reuses the parsed
+    statement and only binds new values. A parsed statement is not tied to the cursor that
+    parsed it, so one cache serves every cursor of a pool.
+    """
+
+    def __init__(self, max_size: int = 256) -> None:
+        self.max_size = max_size
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._statements)
+
+    def get(self, con, query: str):
+        with self._lock:
+            statement = self._statements.get(query)
+            if statement is not None:
+                self._statements.move_to_end(query)
+                return statement
+        statement = con.extract_statements(query)[0]
+        with self._lock:
+            self._statements[query] = statement
+            if len(self._statements) > self.max_size:
+                self._statements.popitem(last=False)
+        return statement
+
+
 class MotherduckClient(BigQueryClient):
-    def __init__(self) -> None:
-        super().__init__()  # Initialize parent class if needed
-        self.client = duckdb.connect(f'md:?motherduck_token={MD_TOKEN}')
+    """
+    Queries MotherDuck, or the DuckDB connection passed as `con`. The MotherDuck connection
+    and the cursor pool are opened on the first query, so constructing a client is free.
+    """
+
+    def __init__(
+        self,
+        mirror_dir: Optional[str] = C_MIRROR_DIR,
+        con=None,
+        token: str = MD_TOKEN,
+        pool_size: int = QUERY_POOL_SIZE,
+        pool_timeout: float = QUERY_POOL_TIMEOUT,
+    ) -> None:
+        super().__init__()
+        self.token = token
+        self._client = con
+        self._pool = None
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self._connect_lock = threading.Lock()
+        self.mirror = ParquetMirror(mirror_dir) if mirror_dir else None
+        self.rollups = Rollups(TABLES['C'])
+        self._has_rollups = None
+        self.statements = StatementCache()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._connect_lock:
+                if self._client is None:
+                    self._client = duckdb.connect(f'md:?motherduck_token={self.token}')
+        return self._client
+
+    @property
+    def pool(self) -> CursorPool:
+        if self._pool is None:
+            client = self.client
+            with self._connect_lock:
+                if self._pool is None:
+                    self._pool = CursorPool(client, size=self.pool_size, timeout=self.pool_timeout)
+        return self._pool
         
-    def _execute_query(self, query: str) -> pd.DataFrame:
-        result = self.client.execute(query).df()
+    def _execute_query(self, query: str, params: Optional[dict] = None) -> pd.DataFrame:
+        with self.pool.cursor() as cursor:
+            result = cursor.execute(self.statements.get(cursor, query), params or {}).df()
         return result
 
+    def _execute_batches(self, query: str, params: Optional[dict] = None, batch_size: int = RESULT_BATCH_SIZE) -> PooledReader:
+        """
+        Run the query and return a reader yielding record batches of up to `batch_size` rows.
+
+        The reader keeps its pooled cursor until it is exhausted, closed or garbage
+        collected, so other queries on the client run on other cursors meanwhile.
+        """
+        cursor = self.pool.acquire()
+        try:
+            reader = cursor.execute(self.statements.get(cursor, query), params or {}).to_arrow_reader(batch_size)
+        except Exception:
+            self.pool.release(cursor)
+            raise
+        return PooledReader(self.pool, cursor, reader)
+
+    def get_data_version(self) -> int:
+        """Version stamp the ingest flows bump after writing tables A and C."""
+        with self.pool.cursor() as cursor:
+            return read_data_version(cursor, DATA_VERSION_TABLE)
+
+    def _param(self, name: str) -> str:
+        return f'${name}'
+
+    def _in_list(self, column: str, name: str) -> str:
+        return f'list_contains(${name}, {column})'
+
     def _get_table_name(self, table_name: str) -> str:
         return table_name
+
+    def _uses_mirror(self, table_name: str) -> bool:
+        return table_name == TABLES['C'] and self.mirror is not None and self.mirror.exists()
+
+    def _uses_rollups(self, table_name: str, granularity: str) -> bool:
+        """Rollup tables are looked up once per client; the ingest flow creates them."""
+        if table_name != TABLES['C'] or granularity not in GRANULARITIES:
+            return False
+        if self._has_rollups is None:
+            with self.pool.cursor() as cursor:
+                self._has_rollups = self.rollups.exist(cursor)
+        return self._has_rollups
+
+    def _get_source(self, table_name: str) -> str:
+        """Table C is read from the local Parquet mirror when one has been written."""
+        if self._uses_mirror(table_name):
+            return self.mirror.relation()
+        return self._get_table_name(table_name)
     
     def _get_date_trunc_expr(self, granularity: str) -> str:
         """
@@ -303,70 +514,139 @@ class MotherduckClient(BigQueryClient):
         return expressions.get(granularity, f"Unsupported granularity: {granularity}")
     
     def compare_periods(self, input_date: str, granularity: str) -> pd.DataFrame:
-        """TODO: NEEDS FIXING. LOSES MOST TOKEN DATA FOR UNKNOWN REASON. 
-                    NEED TO CHECK AGGREGATE FUNCTION FIRST."""
-
+        """
+        Compare every (protocol, chain, token) position on `input_date` with the same position
+        one period (day, week, month or year) later. Returns the start-day rows, with their
+        `qty` and `usd`, and `usd_change` / `qty_change` to the end day, for the positions
+        held on both days.
+        """
         parsed_date = parse(input_date)
         start_date = datetime(parsed_date.year, parsed_date.month, parsed_date.day)
+        end_date = period_end(start_date, granularity)
 
-        if granularity == 'yearly':
-            end_date = start_date + relativedelta(years=1)
-        elif granularity == 'monthly':
-            end_date = start_date + relativedelta(months=1)
-        elif granularity == 'weekly':
-            end_date = start_date + relativedelta(days=7)
-        elif granularity == 'daily':
-            end_date = start_date + relativedelta(days=1)
-        else:
-            raise ValueError(f"Unsupported granularity: {granularity}")
-        
-        # Format dates as strings for use in queries
-        start_date = start_date.strftime('%Y-%m-%d')
-        end_date = end_date.strftime('%Y-%m-%d')
-        
-        """TODO: DOES NOT WORK FOR WEEKLY GRANULARITY. """
-        query = self._get_aggregated_data(TABLES['C'], granularity, start_date=start_date, end_date=end_date, edge_dates_only=True)
-        df = self._execute_query(query)
-
-        df.sort_values(by=['id', 'chain_name', 'token_name', 'aggregated_date'], inplace=True)
-
-        # Calculate changes across the period
-        df['usd_change'] = df.groupby(['id', 'chain_name', 'token_name'])['usd'].diff()
-        df['qty_change'] = df.groupby(['id', 'chain_name', 'token_name'])['qty'].diff()
+        query, params = self._compare_periods_query(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        return self._execute_query(query, params)
 
-        # Isolate start date values and prepare for merging, including aggregated_date
-        start_date_df = df[df['aggregated_date'] == start_date][['id', 'chain_name', 'token_name', 'usd', 'qty', 'aggregated_date']].copy()
-        start_date_df.rename(columns={'usd': 'start_usd', 'qty': 'start_qty', 'aggregated_date': 'start_date'}, inplace=True)
-
-        # Merge start date values with changes
-        df_final = pd.merge(df, start_date_df, on=['id', 'chain_name', 'token_name'], how='left')
-
-        # Filter to keep only rows with changes
-        df_final = df_final.dropna(subset=['usd_change', 'qty_change'])
+    def compare_period_range(self, start_date: str, end_date: str, granularity: str = 'daily', batch_size: int = RESULT_BATCH_SIZE) -> Iterator[Tuple[pd.Timestamp, pd.DataFrame]]:
+        """
+        `compare_periods` for every day from `start_date` up to, not including, `end_date`,
+        from one query. Yields `(day, frame)` in date order while the result streams in, so
+        only about one batch of rows is held at a time.
+        """
+        query, params = self._compare_period_range_query(start_date, end_date, granularity)
+        reader = self._execute_batches(query, params, batch_size)
+        pending = None
+        try:
+            for batch in reader:
+                df = batch.to_pandas()
+                if pending is not None:
+                    df = pd.concat([pending, df], ignore_index=True)
+                if df.empty:
+                    continue
+                # the last day of a batch may continue in the next one
+                last_day = df['aggregated_date'].iloc[-1]
+                complete = (df['aggregated_date'] != last_day).to_numpy()
+                for day, C in df[complete].groupby('aggregated_date', sort=False):
+                    yield day, C.reset_index(drop=True)
+                pending = df[~complete]
+            if pending is not None and not pending.empty:
+                yield pending['aggregated_date'].iloc[0], pending.reset_index(drop=True)
+        finally:
+            reader.close()
 
-        # Replace original qty, usd, and aggregated_date with start date values
-        df_final['usd'] = df_final['start_usd']
-        df_final['qty'] = df_final['start_qty']
-        df_final['aggregated_date'] = df_final['start_date']
+    def _join_edge_days(self, days: str, end_day: str, where: str, order_by: str) -> str:
+        """Start-day rows of the `days` query joined to their position on `end_day`."""
+        return f"""
+        WITH Days AS ({days})
+        SELECT
+            S.aggregated_date,
+            S.id,
+            S.protocol_name,
+            S.category,
+            S.type,
+            S.chain_name,
+            S.token_name,
+            S.qty,
+            S.usd,
+            E.usd - S.usd AS usd_change,
+            E.qty - S.qty AS qty_change
+        FROM Days S
+        INNER JOIN Days E
+            ON S.id = E.id AND S.chain_name = E.chain_name AND S.token_name = E.token_name
+            AND E.aggregated_date = {end_day}
+        WHERE
+            {where}
+        ORDER BY
+            {order_by}
+        """
 
-        # Drop the temporary columns used for merging
-        df_final.drop(['start_usd', 'start_qty', 'start_date'], axis=1, inplace=True)
+    def _compare_periods_query(self, start_date: str, end_date: str) -> tuple:
+        """
+        The start/end comparison as one query: daily averages on the two edge days, joined
+        on (id, chain_name, token_name). Edge days are compared as exact days at every
+        granularity, so a start that is not the first day of its week or month keeps its rows.
+        """
+        days, params = self._get_aggregated_data(TABLES['C'], 'daily', start_date=start_date, end_date=end_date, edge_dates_only=True)
+        query = self._join_edge_days(
+            days,
+            end_day="CAST($end_day AS TIMESTAMP)",
+            where="S.aggregated_date = CAST($start_day AS TIMESTAMP)",
+            order_by="S.id, S.chain_name, S.token_name",
+        )
+        return query, params
 
-        return df_final
+    def _compare_period_range_query(self, start_date: str, end_date: str, granularity: str) -> tuple:
+        """
+        Daily averages over the whole range, read once, each start day joined to the day one
+        period later.
+        """
+        range_start = datetime.strptime(start_date, '%Y-%m-%d')
+        range_end = datetime.strptime(end_date, '%Y-%m-%d')
+        scan_end = period_end(range_end - relativedelta(days=1), granularity)
+        days, params = self._get_aggregated_data(TABLES['C'], 'daily', start_date=start_date, end_date=scan_end.strftime('%Y-%m-%d'))
+        params['range_end'] = range_end.date()
+        query = self._join_edge_days(
+            days,
+            end_day=f"S.aggregated_date + INTERVAL {PERIODS[granularity]}",
+            where="S.aggregated_date < CAST($range_end AS TIMESTAMP)",
+            order_by="S.aggregated_date, S.id, S.chain_name, S.token_name",
+        )
+        return query, params
     
-    def _get_aggregated_data(self, table_name: str, granularity: str, token_name: str = None, protocol_name: str = None, start_date: str = None, end_date: str = None, edge_dates_only: bool = False) -> str:
-        from datetime import datetime
+    def _filter_params(self, token_name: str = None, protocol_name: str = None, start_date: str = None, end_date: str = None) -> dict:
+        """Bound values for the optional filters of the aggregated-data queries."""
+        params = {}
+        if token_name:
+            params['token_name'] = token_name
+        if protocol_name:
+            params['protocol_name'] = protocol_name
+        if start_date and end_date:
+            params['start_day'] = datetime.strptime(start_date, '%Y-%m-%d').date()
+            params['end_day'] = datetime.strptime(end_date, '%Y-%m-%d').date()
+        return params
+
+    def _get_aggregated_data(self, table_name: str, granularity: str, token_name: str = None, protocol_name: str = None, start_date: str = None, end_date: str = None, edge_dates_only: bool = False) -> tuple:
+        """Returns the query text, which only depends on the shape of the request, and its parameters."""
+        if self._uses_rollups(table_name, granularity):
+            return self._get_rollup_data(granularity, token_name, protocol_name, start_date, end_date, edge_dates_only)
+        params = self._filter_params(token_name, protocol_name, start_date, end_date)
         date_trunc_expr = self._get_date_trunc_expr(granularity)
-        token_filter = f"AND C.token_name = '{token_name}'" if token_name else ""
-        protocol_filter = f"AND A.name = '{protocol_name}'" if protocol_name else ""
+        token_filter = "AND C.token_name = $token_name" if token_name else ""
+        protocol_filter = "AND A.name = $protocol_name" if protocol_name else ""
         date_filter = ""
-        if start_date and end_date:
-            start_timestamp = int(datetime.strptime(start_date, '%Y-%m-%d').timestamp())
-            end_timestamp = int(datetime.strptime(end_date, '%Y-%m-%d').timestamp())
+        partition_filter = ""
+        if 'start_day' in params:
+            # `day` is a native DATE column, so its row-group min/max stats can be used
             if edge_dates_only:
-                date_filter = f"AND CAST(C.date AS BIGINT) IN ({start_timestamp}, {end_timestamp})"
+                date_filter = "AND C.day IN ($start_day, $end_day)"
             else:
-                date_filter = f"AND CAST(C.date AS BIGINT) BETWEEN {start_timestamp} AND {end_timestamp}"
+                date_filter = "AND C.day BETWEEN $start_day AND $end_day"
+            if self._uses_mirror(table_name):
+                # only open the year=/month= partitions the days fall in
+                params['start_key'] = month_key(params['start_day'])
+                params['end_key'] = month_key(params['end_day'])
+                operator = "IN ($start_key, $end_key)" if edge_dates_only else "BETWEEN $start_key AND $end_key"
+                partition_filter = f"AND C.year * 100 + C.month {operator}"
 
         query = f"""
         WITH AggregatedData AS (
@@ -381,7 +661,7 @@ class MotherduckClient(BigQueryClient):
                 C.quantity,
                 C.value_usd
             FROM 
-                {self._get_table_name(table_name)} C
+                {self._get_source(table_name)} C
             INNER JOIN 
                 {self._get_table_name(TABLES['A'])} A ON C.id = A.id
             WHERE 
@@ -390,6 +670,7 @@ class MotherduckClient(BigQueryClient):
                 {token_filter}
                 {protocol_filter}
                 {date_filter}
+                {partition_filter}
         )
         SELECT
             aggregated_date,
@@ -413,15 +694,77 @@ class MotherduckClient(BigQueryClient):
         ORDER BY 
             aggregated_date, id
         """
-        return query
+        return query, params
     
+    def _get_rollup_data(self, granularity: str, token_name: str = None, protocol_name: str = None, start_date: str = None, end_date: str = None, edge_dates_only: bool = False) -> tuple:
+        """
+        Same result as `_get_aggregated_data`, read from the pre-aggregated rollup tables.
+        Date-bounded queries read the daily rollup and regroup its buckets, so edge days can
+        still be picked out at any granularity.
+        """
+        tables = self.rollups.tables()
+        params = self._filter_params(token_name, protocol_name, start_date, end_date)
+        token_filter = "AND R.token_name = $token_name" if token_name else ""
+        protocol_filter = "AND A.name = $protocol_name" if protocol_name else ""
+        date_filter = ""
+        rollup = tables[granularity]
+        if 'start_day' in params:
+            rollup = tables['daily']
+            if edge_dates_only:
+                date_filter = "AND R.bucket IN (CAST($start_day AS TIMESTAMP), CAST($end_day AS TIMESTAMP))"
+            else:
+                date_filter = "AND R.bucket BETWEEN CAST($start_day AS TIMESTAMP) AND CAST($end_day AS TIMESTAMP)"
+
+        query = f"""
+        SELECT
+            DATE_TRUNC('{GRANULARITIES[granularity]}', R.bucket) as aggregated_date,
+            R.id as id,
+            A.name as protocol_name,
+            A.category as category,
+            A.type as type,
+            R.chain_name,
+            R.token_name,
+            SUM(R.qty_sum) / SUM(R.n) as qty,
+            SUM(R.usd_sum) / SUM(R.n) as usd
+        FROM
+            {rollup} R
+        INNER JOIN
+            {self._get_table_name(TABLES['A'])} A ON R.id = A.id
+        WHERE
+            TRUE
+            {token_filter}
+            {protocol_filter}
+            {date_filter}
+        GROUP BY
+            aggregated_date,
+            R.id,
+            protocol_name,
+            A.category,
+            A.type,
+            R.chain_name,
+            R.token_name
+        ORDER BY
+            aggregated_date, R.id
+        """
+        return query, params
+
     def get_token_distribution(self, token_name: str, granularity: str) -> pd.DataFrame:
         """Retrieve the distribution of a specific token across protocols over time at specified granularity."""
-        query = self._get_aggregated_data(TABLES['C'], granularity=granularity, token_name=token_name)
-        return self._execute_query(query)
+        query, params = self._get_aggregated_data(TABLES['C'], granularity=granularity, token_name=token_name)
+        return self._execute_query(query, params)
 
     def get_protocol_data(self, protocol_name: str, granularity: str) -> pd.DataFrame:
         """Retrieve data for a specific protocol with granularity, calculating the average of sums."""
-        query = self._get_aggregated_data(TABLES['C'], granularity=granularity, protocol_name=protocol_name)
-        return self._execute_query(query)
+        query, params = self._get_aggregated_data(TABLES['C'], granularity=granularity, protocol_name=protocol_name)
+        return self._execute_query(query, params)
+
+    def get_token_distribution_batches(self, token_name: str, granularity: str, batch_size: int = RESULT_BATCH_SIZE) -> PooledReader:
+        """`get_token_distribution` as Arrow record batches, without building a pandas frame."""
+        query, params = self._get_aggregated_data(TABLES['C'], granularity=granularity, token_name=token_name)
+        return self._execute_batches(query, params, batch_size)
+
+    def get_protocol_data_batches(self, protocol_name: str, granularity: str, batch_size: int = RESULT_BATCH_SIZE) -> PooledReader:
+        """`get_protocol_data` as Arrow record batches, without building a pandas frame."""
+        query, params = self._get_aggregated_data(TABLES['C'], granularity=granularity, protocol_name=protocol_name)
+        return self._execute_batches(query, params, batch_size)
     
@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+
+
+class CachedResult(NamedTuple):
+    version: int
+    body: bytes
+    media_type: str
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an `If-None-Match` header lists `etag` (weak comparison, as for GET)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+class ResultCache:
+    """
+    Encoded API responses keyed on (endpoint, params), evicted least recently used first once
+    their bodies exceed `max_bytes`.
+
+    Entries are stamped with the data version current when they were produced, read through
+    `load_version` at most every `version_ttl` seconds. A bump by the ingest flow therefore
+    turns every older entry into a miss within `version_ttl`, and the ETag, derived from the
+    key and the version alone, lets a client holding an unchanged payload be answered with a
+    304 without touching the warehouse or the cache.
+    """
+
+    def __init__(
+        self,
+        load_version: Callable[[], int],
+        max_bytes: int = 256 * 1024**2,
+        version_ttl: float = 30.0,
+    ) -> None:
+        self.load_version = load_version
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def version(self) -> int:
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked >= self.version_ttl:
+            self._version = self.load_version()
+            self._version_checked = now
+        return self._version
+
+    @staticmethod
+    def etag(key: tuple, version: int) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return f'W/"{version}-{digest}"'
+
+    def get(self, key: tuple, version: int) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, version: int, body: bytes, media_type: str) -> bool:
+        """Store a body unless it alone exceeds the budget. Returns whether it was stored."""
+        if len(body) > self.max_bytes:
+            return False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous.body)
+            self._entries[key] = CachedResult(version, body, media_type)
+            self.size_bytes += len(body)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted.body)
+        return True
+
+    def tee(self, key: tuple, version: int, chunks: Iterable[bytes], media_type: str) -> Iterator[bytes]:
+        """
+        Pass a streamed body through, storing it once the stream completes. Bodies that grow
+        past the budget are dropped on the way, so streaming stays bounded in memory.
+        """
+        parts, size = [], 0
+        for chunk in chunks:
+            if parts is not None:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    parts = None
+                else:
+                    parts.append(chunk)
+            yield chunk
+        if parts is not None:
+            self.put(key, version, b"".join(parts), media_type)
@@ -0,0 +1,122 @@
+import logging
+from typing import Dict, Iterable, Optional
+
+import polars as pl
+
+from .loader import table_exists
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {
+    "daily": "day",
+    "weekly": "week",
+    "monthly": "month",
+    "yearly": "year",
+}
+
+
+ROLLUP_SELECT = """
+SELECT
+    {bucket} AS bucket,
+    C.id,
+    C.chain_name,
+    C.token_name,
+    SUM(C.quantity) AS qty_sum,
+    SUM(C.value_usd) AS usd_sum,
+    COUNT(*) AS n
+FROM {source} C
+{join}
+WHERE C.quantity > 0 AND C.value_usd > 0 {where}
+GROUP BY ALL
+"""
+
+
+def rollup_table(source: str, granularity: str) -> str:
+    return f"{source}_{granularity}"
+
+
+def bucket_expr(granularity: str, column: str) -> str:
+    """Start of the bucket an epoch-seconds `column` falls in."""
+    unit = GRANULARITIES[granularity]
+    return f"DATE_TRUNC('{unit}', TIMESTAMP 'epoch' + {column} * INTERVAL '1 second')"
+
+
+class Rollups:
+    """
+    Pre-aggregated copies of table C, one per granularity, holding per
+    (bucket, id, chain_name, token_name) the sums of quantity and value_usd and the row count
+    over the rows the query layer keeps (quantity > 0 and value_usd > 0). Averages are
+    `qty_sum / n`, and coarser buckets can be rolled up from the daily table exactly.
+
+    `touch` remembers the earliest new date per protocol of a flushed frame; the ingest flow
+    passes the same from its checkpoint store to `touch_protocols`, so it survives a crash. `refresh` then recomputes, for those protocols only, every bucket from
+    the one holding that date onwards. Recomputing from table C rather than adding the frame
+    to the stored sums keeps a refresh idempotent, so retried or pushed-down flushes that
+    wrote fewer rows than they were given cannot double count.
+    """
+
+    def __init__(self, source: str, granularities: Iterable[str] = tuple(GRANULARITIES)) -> None:
+        self.source = source
+        self.granularities = list(granularities)
+        self.touched: Dict[str, int] = {}
+
+    def tables(self) -> Dict[str, str]:
+        return {g: rollup_table(self.source, g) for g in self.granularities}
+
+    def exist(self, con) -> bool:
+        return all(table_exists(con, table) for table in self.tables().values())
+
+    def touch(self, df: Optional[pl.DataFrame]) -> None:
+        if df is None or df.is_empty():
+            return
+        self.touch_protocols(df.group_by("id").agg(pl.col("date").min()).iter_rows())
+
+    def touch_protocols(self, first_dates) -> None:
+        """Mark protocols stale from a date on, given (id, first_date) pairs."""
+        for protocol_id, first_date in dict(first_dates).items():
+            previous = self.touched.get(protocol_id)
+            self.touched[protocol_id] = first_date if previous is None else min(previous, first_date)
+
+    def _select(self, granularity: str, where: str = "", join: str = "") -> str:
+        return ROLLUP_SELECT.format(
+            bucket=bucket_expr(granularity, "C.date"),
+            source=self.source,
+            join=join,
+            where=where,
+        )
+
+    def rebuild(self, con) -> None:
+        """(Re)create every rollup table from the whole of table C."""
+        for granularity, table in self.tables().items():
+            con.execute(f"CREATE OR REPLACE TABLE {table} AS {self._select(granularity)}")
+        self.touched.clear()
+
+    def refresh(self, con) -> int:
+        """Recompute the buckets of the touched protocols. Returns the number of protocols."""
+        if not self.touched:
+            return 0
+        con.execute("CREATE OR REPLACE TEMP TABLE rollup_touched (id VARCHAR, first_date BIGINT)")
+        con.executemany("INSERT INTO rollup_touched VALUES (?, ?)", list(self.touched.items()))
+        con.execute("BEGIN TRANSACTION")
+        try:
+            for granularity, table in self.tables().items():
+                start = bucket_expr(granularity, "t.first_date")
+                con.execute(f"""
+                DELETE FROM {table} R USING rollup_touched t
+                WHERE R.id = t.id AND R.bucket >= {start}
+                """)
+                con.execute(f"INSERT INTO {table} " + self._select(
+                    granularity,
+                    join="INNER JOIN rollup_touched t ON C.id = t.id",
+                    where=f"AND {bucket_expr(granularity, 'C.date')} >= {start}",
+                ))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.execute("DROP TABLE IF EXISTS rollup_touched")
+        refreshed = len(self.touched)
+        self.touched.clear()
+        logger.info("Refreshed rollups of %s protocols", refreshed)
+        return refreshed
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveScheduler:
+    """
+    Runs an async job per item on a bounded pool of workers.
+
+    Items are started largest-first (by `priority`) so the biggest protocols do not end up
+    as stragglers at the tail of the run, and a worker picks up the next item as soon as it
+    is free rather than waiting for a whole batch.
+
+    With a `memory_limit`, each item is charged `estimate(item)` bytes until its job returns,
+    and an item is only started once it fits next to the estimates of the running jobs.
+    The gate is not the process RSS: CPython rarely returns freed memory to the OS, so once
+    RSS crossed the limit it would hold concurrency at one for the rest of the run. A job is
+    always admitted when nothing else is running, so an oversized item cannot stall the
+    queue forever.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        memory_limit: Optional[int] = None,
+        estimate: Optional[Callable[[Any], int]] = None,
+    ) -> None:
+        self.max_workers = max(1, max_workers)
+        self.memory_limit = memory_limit
+        self.estimate = estimate
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.completed = 0
+        self.throttled = 0
+        self._released = None
+
+    def _fits(self, size: int) -> bool:
+        return self.in_flight == 0 or self.in_flight_bytes + size <= self.memory_limit
+
+    async def _admit(self, size: int) -> None:
+        if self.memory_limit is None or self._fits(size):
+            return
+        self.throttled += 1
+        async with self._released:
+            await self._released.wait_for(lambda: self._fits(size))
+
+    async def _worker(self, queue: asyncio.Queue, job: Callable[..., Awaitable]) -> None:
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            size = self.estimate(item) if self.estimate is not None else 0
+            await self._admit(size)
+            self.in_flight += 1
+            self.in_flight_bytes += size
+            try:
+                await job(item)
+            finally:
+                self.in_flight -= 1
+                self.in_flight_bytes -= size
+                self.completed += 1
+                async with self._released:
+                    self._released.notify_all()
+
+    async def run(
+        self,
+        items: Iterable,
+        job: Callable[..., Awaitable],
+        priority: Optional[Callable] = None,
+    ) -> None:
+        items = list(items)
+        if priority is not None:
+            items.sort(key=priority, reverse=True)
+        queue = asyncio.Queue()
+        self._released = asyncio.Condition()
+        for item in items:
+            queue.put_nowait(item)
+
+        workers = [
+            asyncio.ensure_future(self._worker(queue, job))
+            for _ in range(min(self.max_workers, len(items)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
+        if self.throttled:
+            logger.info(
+                "Memory limit delayed %s of %s jobs", self.throttled, self.completed
+            )
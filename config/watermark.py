@@ -0,0 +1,65 @@
+from typing import Dict, Optional
+
+import polars as pl
+
+WATERMARK_KEYS = ["chain_name", "token_name"]
+
+
+def latest_dates(con, table_name: str, protocol_ids=None) -> pl.DataFrame:
+    """MAX(date) per (id, chain_name, token_name), optionally for a subset of protocols."""
+    where, params = "", []
+    if protocol_ids is not None:
+        where, params = "WHERE list_contains(?, id)", [[str(i) for i in protocol_ids]]
+    query = f"""
+    SELECT id, chain_name, token_name, MAX(date) AS latest_date
+    FROM {table_name}
+    {where}
+    GROUP BY id, chain_name, token_name
+    """
+    return con.execute(query, params).pl()
+
+
+class WatermarkIndex:
+    """
+    Latest ingested date of every (chain_name, token_name), split per protocol id.
+
+    Built once per run; each protocol task only joins against its own slice, which holds a
+    few dozen rows, instead of the MAX(date) of every token in table C.
+    """
+
+    def __init__(self, by_protocol: Dict[str, pl.DataFrame]) -> None:
+        self.by_protocol = by_protocol
+
+    def __len__(self) -> int:
+        return len(self.by_protocol)
+
+    @classmethod
+    def from_frame(cls, df: pl.DataFrame) -> "WatermarkIndex":
+        """Build from a frame with columns id, chain_name, token_name, latest_date."""
+        if df.is_empty():
+            return cls({})
+        partitions = df.partition_by("id", as_dict=True, include_key=False)
+        return cls({
+            str(key[0] if isinstance(key, tuple) else key): frame
+            for key, frame in partitions.items()
+        })
+
+    @classmethod
+    def from_table(cls, con, table_name: str) -> "WatermarkIndex":
+        return cls.from_frame(latest_dates(con, table_name))
+
+    def for_protocol(self, protocol_id) -> Optional[pl.DataFrame]:
+        return self.by_protocol.get(str(protocol_id))
+
+    def filter_new_rows(self, df: pl.DataFrame) -> pl.DataFrame:
+        """Keep the rows of a single protocol's frame that are newer than its watermarks."""
+        if df.is_empty():
+            return df
+        watermarks = self.for_protocol(df["id"][0])
+        if watermarks is None:
+            return df
+        return (
+            df.join(watermarks, on=WATERMARK_KEYS, how="left")
+            .filter(pl.col("latest_date").is_null() | (pl.col("date") > pl.col("latest_date")))
+            .drop("latest_date")
+        )
@@ -1,9 +1,14 @@
-from fastapi import FastAPI, HTTPException, Query, Path, Response
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Query, Path, Request, Response
+from fastapi.encoders import jsonable_encoder
 from config.etl_network import ETLNetwork
 from config.query import MotherduckClient
-from fastapi.responses import HTMLResponse
-from config.plot import NetworkVisualizer
-from functools import lru_cache
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from config.config import RESULT_CACHE_BYTES, DATA_VERSION_TTL, QUERY_POOL_SIZE
+from config.pool import PoolTimeout
+from config.formats import MEDIA_TYPES, encode_batches
+from config.result_cache import ResultCache, etag_matches
 
 
 app = FastAPI()
@@ -12,8 +17,52 @@ bq = MotherduckClient()
     
 etl_network = ETLNetwork(bq=bq)
 
+results = ResultCache(bq.get_data_version, max_bytes=RESULT_CACHE_BYTES, version_ttl=DATA_VERSION_TTL)
+
+# one thread per pooled cursor, so blocking queries never run on the event loop
+query_executor = ThreadPoolExecutor(max_workers=QUERY_POOL_SIZE, thread_name_prefix="query")
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(query_executor, fn, *args)
+
+def _error(e: Exception) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, PoolTimeout):
+        return HTTPException(status_code=503, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+def _media_type(format: str) -> str:
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    return MEDIA_TYPES[format]
+
+def _cached_response(request: Request, key: tuple, media_type: str, produce) -> Response:
+    """
+    Answer from the result cache, or with a 304 if the client already holds this version.
+    On a miss `produce()` returns the body as bytes or as an iterator of chunks; the latter
+    is streamed and cached once complete.
+    """
+    version = results.version()
+    headers = {"ETag": results.etag(key, version), "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    hit = results.get(key, version)
+    if hit is not None:
+        return Response(content=hit.body, media_type=hit.media_type, headers=headers)
+    body = produce()
+    if isinstance(body, bytes):
+        results.put(key, version, body, media_type)
+        return Response(content=body, media_type=media_type, headers=headers)
+    return StreamingResponse(results.tee(key, version, body, media_type), media_type=media_type, headers=headers)
+
+def build_network_json(date_input: str, TOP_X: int = None, granularity: str = 'daily', mode: str = 'usd', type: bool = False) -> dict:
+    C = bq.compare_periods(date_input, granularity=granularity)
+    return etl_network.process_dataframe(C, TOP_X=TOP_X, mode=mode, type=type)
+
 @app.get("/network-json/{date_input}", summary="Network Data")
 async def get_network_json(
+    request: Request,
     date_input: str = Path(..., description="Date in 'YYYY-MM-DD' format."),
     TOP_X: int = Query(None, description="Number of top connections."),
     granularity: str = Query('daily', description=", 'daily', 'monthly', 'yearly'."),
@@ -25,36 +74,50 @@ async def get_network_json(
     Retrieves network data for a given date with automatic granularity detection.
     """
     try:
-        C = bq.compare_periods(date_input, granularity=granularity)
-        # print(C.head(1))
-        network_json = etl_network.process_dataframe(C, TOP_X=TOP_X, mode=mode, type=type)
-        return network_json
+        key = ('network-json', date_input, TOP_X, granularity, mode, type)
+        return await _run(_cached_response, request, key, "application/json", lambda: JSONResponse(
+            jsonable_encoder(build_network_json(date_input, TOP_X, granularity, mode, type))
+        ).body)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _error(e)
 
 @app.get("/token-distribution/{token_name}/{granularity}", summary="Token Distribution")
-async def token_distribution(token_name: str, granularity: str):
+async def token_distribution(
+    request: Request,
+    token_name: str,
+    granularity: str,
+    format: str = Query('csv', description="'csv', 'arrow' or 'parquet'.")
+):
     """
-    Returns token distribution data.
+    Returns token distribution data, streamed in record batches.
     """
+    media_type = _media_type(format)
     try:
-        df = bq.get_token_distribution(token_name, granularity)
-        csv_data = df.to_csv(index=False)
-        return Response(content=csv_data, media_type="text/csv")
+        key = ('token-distribution', token_name, granularity, format)
+        return await _run(_cached_response, request, key, media_type, lambda: encode_batches(
+            bq.get_token_distribution_batches(token_name, granularity), format
+        ))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _error(e)
 
 @app.get("/protocol-data/{protocol_name}/{granularity}", summary="Protocol Data")
-async def protocol_data(protocol_name: str, granularity: str):
+async def protocol_data(
+    request: Request,
+    protocol_name: str,
+    granularity: str,
+    format: str = Query('csv', description="'csv', 'arrow' or 'parquet'.")
+):
     """
-    Returns protocol data.
+    Returns protocol data, streamed in record batches.
     """
+    media_type = _media_type(format)
     try:
-        df = bq.get_protocol_data(protocol_name, granularity)
-        csv_data = df.to_csv(index=False)
-        return Response(content=csv_data, media_type="text/csv")
+        key = ('protocol-data', protocol_name, granularity, format)
+        return await _run(_cached_response, request, key, media_type, lambda: encode_batches(
+            bq.get_protocol_data_batches(protocol_name, granularity), format
+        ))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _error(e)
     
 @app.get("/render-network/{date_input}", summary="Render Network Visualization", response_class=HTMLResponse)
 async def render_network(
@@ -68,40 +131,38 @@ async def render_network(
     Returns an HTML page with a rendered network visualization for a given date.
     """
     try:
-        # Directly reuse the get_network_json endpoint
-        network_json = await get_network_json(date_input, TOP_X, granularity, mode, type)
+        # Build the same data the network-json endpoint returns
+        network_json = await _run(build_network_json, date_input, TOP_X, granularity, mode, type)
         
-        # Initialize the NetworkVisualizer
+        # Initialize the NetworkVisualizer; pyvis and matplotlib are only loaded for this page
+        from config.plot import NetworkVisualizer
         visualizer = NetworkVisualizer(notebook=False)  # Set notebook to False for web rendering
         
         # Generate the HTML content
-        html_content = visualizer.visualize_network(network_json)
+        html_content = await _run(visualizer.visualize_network, network_json)
         
         return HTMLResponse(content=html_content, status_code=200)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _error(e)
     
 @app.get("/unique-protocols", summary="Unique Protocol Names")
-async def unique_protocols():
+async def unique_protocols(request: Request):
     """
     Returns a list of unique protocol names from table A.
     """
     try:
-        df = bq.get_unique_protocol_names()
-        csv_data = df.to_csv(index=False)
-        return Response(content=csv_data, media_type="text/csv")
+        return await _run(_cached_response, request, ('unique-protocols',), "text/csv", lambda: bq.get_unique_protocol_names().to_csv(index=False).encode())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _error(e)
     
 
 @app.get("/unique-token-names", summary="Unique Token Names")
-async def unique_token_names():
+async def unique_token_names(request: Request):
     """
     Returns a list of unique token names from the default table.
     """
     try:
-        df = bq.get_unique_token_names()  # No table name passed, uses default
-        csv_data = df.to_csv(index=False)
-        return Response(content=csv_data, media_type="text/csv")
+        # No table name passed, uses default
+        return await _run(_cached_response, request, ('unique-token-names',), "text/csv", lambda: bq.get_unique_token_names().to_csv(index=False).encode())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise _error(e)
\ No newline at end of file
@@ -1,20 +1,20 @@
-import requests
 import json
 import os
 import yaml
-import pickle
 import pandas as pd
-import polars as pl
 from prefect import task, flow, get_run_logger
-from config.config import TABLES, MD_TOKEN, CATEGORY_MAPPING
+from config.config import TABLES, MD_TOKEN, CATEGORY_TO_TYPE, DATA_VERSION_TABLE, C_MIRROR_DIR
 import duckdb
 import asyncio
 import psutil
 from config.etl_network import ETLNetwork
 from config.query import MotherduckClient
-from config.plot import save_heatmap
-from google.cloud import bigquery
-from google.cloud.exceptions import NotFound
+from config.fetch import LlamaFetcher
+from config.extract import token_tvl_frame
+from config.loader import add_day_columns, bump_data_version, insert_frame, replace_table
+from config.watermark import WatermarkIndex
+from config.mirror import ParquetMirror
+from config.rollup import Rollups
 
 def load_config():
     with open("config.yaml", "r") as file:
@@ -25,17 +25,25 @@ DATA_DIR = config["data_dir"]
 BASE_DIR = config["base_dir"]
 BASE_URL = config["base_url"]
 MAX_SLUGS = config.get("max_slugs", None)
+MAX_CONCURRENT_REQUESTS = config.get("max_concurrent_requests", 16)
+REQUESTS_PER_SECOND = config.get("requests_per_second", None)
+MAX_RETRIES = config.get("max_retries", 3)
+RETRY_BACKOFF = config.get("retry_backoff", 1.0)
+ROLLUPS = config.get("rollups", True)
 
 os.makedirs(DATA_DIR, exist_ok=True)
 PROTOCOL_HEADERS_FILE = os.path.join(BASE_DIR, "protocol_headers.json")
 PROTOCOL_HEADERS_PARQUET = os.path.join(BASE_DIR, "protocol_headers.parquet")
-FAILED_SLUGS_FILE = os.path.join(DATA_DIR, "failed_protocols.pkl")
 
 
-def fetch_data(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
+def make_fetcher():
+    return LlamaFetcher(
+        BASE_URL,
+        max_concurrency=MAX_CONCURRENT_REQUESTS,
+        requests_per_second=REQUESTS_PER_SECOND,
+        max_retries=MAX_RETRIES,
+        backoff=RETRY_BACKOFF,
+    )
 
 
 def save_data_to_file(data, filename):
@@ -44,18 +52,16 @@ def save_data_to_file(data, filename):
 
 
 @task
-async def download_protocol_headers():
-    url = f"{BASE_URL}protocols"
-    data = fetch_data(url)
+async def download_protocol_headers(fetcher):
+    data = await fetcher.fetch_protocols()
     if data:
         save_data_to_file(data, PROTOCOL_HEADERS_FILE)
         df = pd.DataFrame(data)
         for col in df.select_dtypes(include=["object"]).columns:
             df[col] = df[col].astype(str)
-        df["type"] = "default"
+        df["type"] = df["category"].map(CATEGORY_TO_TYPE).fillna("default")
         df.to_parquet(PROTOCOL_HEADERS_PARQUET, index=False)
-        await upload_df_to_motherduck.fn(PROTOCOL_HEADERS_PARQUET, TABLES["A"])
-        await add_type_column.fn()
+        await replace_motherduck_table.fn(df, TABLES["A"])
         os.remove(PROTOCOL_HEADERS_FILE)
         os.remove(PROTOCOL_HEADERS_PARQUET)
     else:
@@ -65,24 +71,19 @@ async def download_protocol_headers():
 
 @task
 async def add_type_column():
+    """Re-derive `type` of the stored headers, e.g. after a mapping change."""
     con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
     con.execute(
         f"ALTER TABLE {TABLES['A']} ADD COLUMN IF NOT EXISTS type VARCHAR;"
     )
-
-    category_to_type = {}
-    for type_name, categories in CATEGORY_MAPPING.items():
-        for category in categories:
-            category_to_type[category] = type_name
-
-    for category, type_name in category_to_type.items():
-        update_query = f"""
+    cases = " ".join(["WHEN ? THEN ?"] * len(CATEGORY_TO_TYPE))
+    con.execute(
+        f"""
         UPDATE {TABLES['A']}
-        SET type = '{type_name}'
-        WHERE category = '{category}';
-        """
-        con.execute(update_query)
-
+        SET type = CASE category {cases} ELSE COALESCE(type, 'default') END;
+        """,
+        [value for pair in CATEGORY_TO_TYPE.items() for value in pair],
+    )
     con.close()
 
 
@@ -94,146 +95,63 @@ def get_all_protocol_slugs():
     return [row[0] for row in result]
 
 
-@task(retries=3, retry_delay_seconds=[1, 10, 100])
-def download_tvl_data():
-    all_protocol_slugs = get_all_protocol_slugs()
-    if MAX_SLUGS is not None:
-        all_protocol_slugs = all_protocol_slugs[:MAX_SLUGS]
-    failed_slugs = []
-    for protocol in all_protocol_slugs:
-        url = f"{BASE_URL}protocol/{protocol}"
-        data = fetch_data(url)
-        if data:
-            filename = os.path.join(DATA_DIR, f"{protocol}.json")
-            save_data_to_file(data, filename)
-        else:
-            failed_slugs.append(protocol)
-    if failed_slugs:
-        with open(FAILED_SLUGS_FILE, "wb") as f:
-            pickle.dump(failed_slugs, f)
-
-
-def extract_token_tvl(file_path):
-    with open(file_path, "r") as f:
-        data = json.load(f)
-
-    results = []
-    for chain_name, chain_data in data["chainTvls"].items():
-        tokens_usd = chain_data["tokensInUsd"]
-        tokens_quantity = chain_data["tokens"]
-
-        for usd_entry, quantity_entry in zip(tokens_usd, tokens_quantity):
-            date = usd_entry["date"]
-            for token_name, value_usd in usd_entry["tokens"].items():
-                quantity = quantity_entry["tokens"].get(token_name, 0)
-                # large int handling
-                value_usd_str = str(value_usd)
-                quantity_str = str(quantity)
-                results.append(
-                    {
-                        "id": data["id"],
-                        "chain_name": chain_name,
-                        "date": date,
-                        "token_name": token_name,
-                        "quantity": quantity_str,
-                        "value_usd": value_usd_str,
-                    }
-                )
-
-    df = pl.DataFrame(results)
-
-    # convert large int back
-    if "quantity" in df.columns:
-        df = df.with_columns(pl.col("quantity").cast(pl.Float64).fill_null(0))
-    if "value_usd" in df.columns:
-        df = df.with_columns(pl.col("value_usd").cast(pl.Float64).fill_null(0))
-
-    return df
-
-
 @task
-async def process_and_filter_file(
-    con, json_file_path, parquet_file_path, latest_dates
-):
-    df = extract_token_tvl(json_file_path)
-    if not df.is_empty():
-        df = df.join(
-            latest_dates, on=["id", "chain_name", "token_name"], how="left"
-        )
-        filtered_rows = df.filter(pl.col("date") > pl.col("latest_date"))
-
-        filtered_rows = filtered_rows.drop("latest_date")
-
-        if not filtered_rows.is_empty():
-            filtered_rows.write_parquet(parquet_file_path)
-            await upload_df_to_motherduck.fn(
-                parquet_file_path, TABLES["C"], con
-            )
-            get_run_logger().warning(
-                "Uploading %s lines of new data for %s",
-                filtered_rows.shape[0],
-                json_file_path,
-            )
-            os.remove(parquet_file_path)
-        else:
-            # get_run_logger().warning("No new data to process for %s.", json_file_path)
-            pass
-    else:
-        get_run_logger().critical(
-            "No data found in llama data %s.", json_file_path
+async def process_protocol(con, slug, data, watermarks):
+    """Append the rows of a protocol payload newer than its watermarks to table C."""
+    df = token_tvl_frame(data)
+    if df.is_empty():
+        get_run_logger().critical("No data found in llama data %s.", slug)
+        return
+    new_rows = watermarks.filter_new_rows(df)
+    if not new_rows.is_empty():
+        # BY NAME, with the day/day_idx columns the MotherDuck flow writes as well
+        insert_frame(con, TABLES["C"], new_rows)
+        get_run_logger().warning(
+            "Uploading %s lines of new data for %s", new_rows.height, slug
         )
 
 
-async def clear_motherduck_table(tables: list, delete_tables: list = None):
+@task(retries=3, retry_delay_seconds=[1, 10, 100])
+async def replace_motherduck_table(df, table_name):
     con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
-    if delete_tables is None:
-        delete_tables = []
-
-    for table in tables:
-        if table in delete_tables:
-            con.execute(f"DROP TABLE IF EXISTS {table};")
-        else:
-            exists = con.execute(
-                f"SELECT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = '{table}')"
-            ).fetchone()[0]
-            if exists:
-                con.execute(f"DELETE FROM {table};")
+    replace_table(con, table_name, df)
     con.close()
 
 
-@task(retries=3, retry_delay_seconds=[1, 10, 100])
-async def upload_df_to_motherduck(
-    file_path,
-    table_name,
-    con=duckdb.connect(f"md:?motherduck_token={MD_TOKEN}"),
-):
-    exists = con.execute(
-        f"SELECT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = '{table_name}')"
-    ).fetchone()[0]
+@task
+async def download_and_process_single_protocol(slug, watermarks, fetcher):
+    data = await fetcher.fetch_protocol(slug)
+    if data:
+        con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
+        try:
+            await process_protocol.fn(con, slug, data, watermarks)
+        finally:
+            con.close()
 
-    if not exists:
-        con.execute(
-            f"CREATE TABLE {table_name} AS SELECT * FROM read_parquet('{file_path}')"
-        )
-    else:
-        con.execute(
-            f"INSERT INTO {table_name} SELECT * FROM read_parquet('{file_path}')"
-        )
+
+@task
+async def rebuild_derived_tables():
+    """
+    Rebuild the rollups and the Parquet mirror from the whole of table C. This flow keeps
+    no checkpoint store to refresh them incrementally from.
+    """
+    con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
+    rollups = Rollups(TABLES["C"])
+    # existing rollups are read by the API even with rollups off, so keep them current
+    if ROLLUPS or rollups.exist(con):
+        rollups.rebuild(con)
+        get_run_logger().info("Rebuilt rollup tables %s", ", ".join(rollups.tables().values()))
+    if C_MIRROR_DIR:
+        ParquetMirror(C_MIRROR_DIR).rebuild(con, TABLES["C"])
+    con.close()
 
 
 @task
-async def download_and_process_single_protocol(slug, latest_dates):
-    url = f"{BASE_URL}protocol/{slug}"
-    data = fetch_data(url)
-    if data:
-        con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
-        json_file_path = os.path.join(DATA_DIR, f"{slug}.json")
-        parquet_file_path = os.path.join(DATA_DIR, f"{slug}.parquet")
-        save_data_to_file(data, json_file_path)
-        await process_and_filter_file.fn(
-            con, json_file_path, parquet_file_path, latest_dates
-        )
-        os.remove(json_file_path)
+async def publish_data_version():
+    con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
+    version = bump_data_version(con, DATA_VERSION_TABLE)
+    con.close()
+    get_run_logger().info("Published data version %s", version)
 
 
 @task
@@ -260,6 +178,8 @@ def _calculate_concurrent_tasks(
 
 
 def _generate_and_save_heatmap():
+    from config.plot import save_heatmap
+
     con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
 
     query = """
@@ -285,41 +205,38 @@ def _generate_and_save_heatmap():
 @task
 async def _get_latest_dates_for_tokens():
     con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
-    query = """
-    SELECT id, chain_name, token_name, MAX(date) as latest_date
-    FROM {table_name}
-    GROUP BY id, chain_name, token_name
-    """.format(
-        table_name=TABLES["C"]
-    )
-    df = con.execute(query).fetchdf()
+    add_day_columns(con, TABLES["C"])
+    watermarks = WatermarkIndex.from_table(con, TABLES["C"])
     con.close()
-    latest_dates_df = pl.from_pandas(df)
     get_run_logger().info("Fetched latest dates for tokens.")
-    return latest_dates_df
+    return watermarks
 
 
 @flow
 async def ingest_llama_motherduck():
-    await clear_motherduck_table(tables=["A"], delete_tables=["A"])
-    await download_protocol_headers()
-    latest_dates = await _get_latest_dates_for_tokens()
-
-    all_protocol_slugs = get_all_protocol_slugs()[:MAX_SLUGS]
-    max_concurrent_tasks = _calculate_concurrent_tasks()
-    total_slugs_to_process = (
-        len(all_protocol_slugs)
-        if MAX_SLUGS is None
-        else min(len(all_protocol_slugs), MAX_SLUGS)
-    )
+    async with make_fetcher() as fetcher:
+        await download_protocol_headers(fetcher)
+        watermarks = await _get_latest_dates_for_tokens()
+
+        all_protocol_slugs = get_all_protocol_slugs()[:MAX_SLUGS]
+        max_concurrent_tasks = _calculate_concurrent_tasks()
+        total_slugs_to_process = (
+            len(all_protocol_slugs)
+            if MAX_SLUGS is None
+            else min(len(all_protocol_slugs), MAX_SLUGS)
+        )
 
-    for i in range(0, total_slugs_to_process, max_concurrent_tasks):
-        batch_slugs = all_protocol_slugs[i : i + max_concurrent_tasks]
-        tasks = [
-            download_and_process_single_protocol(slug, latest_dates)
-            for slug in batch_slugs
-        ]
-        await asyncio.gather(*tasks)
+        for i in range(0, total_slugs_to_process, max_concurrent_tasks):
+            batch_slugs = all_protocol_slugs[i : i + max_concurrent_tasks]
+            tasks = [
+                download_and_process_single_protocol(
+                    slug, watermarks, fetcher
+                )
+                for slug in batch_slugs
+            ]
+            await asyncio.gather(*tasks)
 
+    await rebuild_derived_tables()
+    await publish_data_version()
     await update_mapping()
     _generate_and_save_heatmap()
\ No newline at end of file
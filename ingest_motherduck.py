@@ -1,20 +1,34 @@
-import requests
 import json
 import os
 import yaml
-import pickle
 import pandas as pd
 import polars as pl
 from prefect import task, flow, get_run_logger
-from config.config import TABLES, MD_TOKEN, CATEGORY_MAPPING
+from config.config import (
+    TABLES,
+    MD_TOKEN,
+    CATEGORY_TO_TYPE,
+    C_MIRROR_DIR,
+    DATA_VERSION_TABLE,
+)
 import duckdb
 import asyncio
 import psutil
 from config.etl_network import ETLNetwork
 from config.query import MotherduckClient
-from config.plot import save_heatmap
-from google.cloud import bigquery
-from google.cloud.exceptions import NotFound
+from config.fetch import LlamaFetcher, ResponseCache
+from config.loader import (
+    BulkLoader,
+    add_day_columns,
+    bump_data_version,
+    replace_table,
+)
+from config.watermark import WatermarkIndex, latest_dates
+from config.checkpoint import CheckpointStore
+from config.scheduler import AdaptiveScheduler
+from config.pipeline import IngestPipeline
+from config.mirror import ParquetMirror
+from config.rollup import Rollups
 
 def load_config():
     with open("config.yaml", "r") as file:
@@ -25,17 +39,42 @@ DATA_DIR = config["data_dir"]
 BASE_DIR = config["base_dir"]
 BASE_URL = config["base_url"]
 MAX_SLUGS = config.get("max_slugs", None)
+MAX_CONCURRENT_REQUESTS = config.get("max_concurrent_requests", 16)
+MAX_WORKERS = config.get("max_workers", 32)
+REQUESTS_PER_SECOND = config.get("requests_per_second", None)
+MAX_RETRIES = config.get("max_retries", 3)
+RETRY_BACKOFF = config.get("retry_backoff", 1.0)
+STREAMING_PARSE = config.get("streaming_parse", False)
+OVERFLOW_POLICY = config.get("overflow_policy", "zero")
+KEEP_TEMP_FILES = config.get("keep_temp_files", False)
+FLUSH_ROWS = config.get("flush_rows", 1_000_000)
+FLUSH_BYTES = config.get("flush_bytes", 256 * 1024**2)
+WATERMARK_PUSHDOWN = config.get("watermark_pushdown", False)
+PARSE_WORKERS = config.get("parse_workers", None)
+PIPELINE_QUEUE_SIZE = config.get("pipeline_queue_size", 8)
+ROLLUPS = config.get("rollups", True)
+PAYLOAD_MEMORY_FACTOR = config.get("payload_memory_factor", 8)
+DEFAULT_PAYLOAD_BYTES = config.get("default_payload_bytes", 4 * 1024 * 1024)
 
 os.makedirs(DATA_DIR, exist_ok=True)
 PROTOCOL_HEADERS_FILE = os.path.join(BASE_DIR, "protocol_headers.json")
 PROTOCOL_HEADERS_PARQUET = os.path.join(BASE_DIR, "protocol_headers.parquet")
-FAILED_SLUGS_FILE = os.path.join(DATA_DIR, "failed_protocols.pkl")
-
-
-def fetch_data(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
+HTTP_CACHE = config.get("http_cache", True)
+HTTP_CACHE_DIR = os.path.join(DATA_DIR, "http_cache")
+CHECKPOINT_DB = os.path.join(
+    DATA_DIR, config.get("checkpoint_db", "checkpoints.sqlite")
+)
+
+
+def make_fetcher():
+    return LlamaFetcher(
+        BASE_URL,
+        max_concurrency=MAX_CONCURRENT_REQUESTS,
+        requests_per_second=REQUESTS_PER_SECOND,
+        max_retries=MAX_RETRIES,
+        backoff=RETRY_BACKOFF,
+        cache=ResponseCache(HTTP_CACHE_DIR) if HTTP_CACHE else None,
+    )
 
 
 def save_data_to_file(data, filename):
@@ -44,63 +83,37 @@ def save_data_to_file(data, filename):
 
 
 @task
-async def download_protocol_headers():
-    url = f"{BASE_URL}protocols"
-    data = fetch_data(url)
+async def download_protocol_headers(fetcher):
+    data = await fetcher.fetch_protocols()
     if data:
-        save_data_to_file(data, PROTOCOL_HEADERS_FILE)
         df = pd.DataFrame(data)
         for col in df.select_dtypes(include=["object"]).columns:
             df[col] = df[col].astype(str)
-        df["type"] = "default"
-        df.to_parquet(PROTOCOL_HEADERS_PARQUET, index=False)
-        await upload_df_to_motherduck.fn(PROTOCOL_HEADERS_PARQUET, TABLES["A"])
-        await add_type_column.fn()
-        os.remove(PROTOCOL_HEADERS_FILE)
-        os.remove(PROTOCOL_HEADERS_PARQUET)
+        df["type"] = df["category"].map(CATEGORY_TO_TYPE).fillna("default")
+        if KEEP_TEMP_FILES:
+            save_data_to_file(data, PROTOCOL_HEADERS_FILE)
+            df.to_parquet(PROTOCOL_HEADERS_PARQUET, index=False)
+        await replace_motherduck_table.fn(df, TABLES["A"])
     else:
         get_run_logger().info("No data found in the API response.")
     return data
 
 
-@task(retries=3, retry_delay_seconds=[1, 10, 100])
-def download_tvl_data():
-    all_protocol_slugs = get_all_protocol_slugs()
-    if MAX_SLUGS is not None:
-        all_protocol_slugs = all_protocol_slugs[:MAX_SLUGS]
-    failed_slugs = []
-    for protocol in all_protocol_slugs:
-        url = f"{BASE_URL}protocol/{protocol}"
-        data = fetch_data(url)
-        if data:
-            filename = os.path.join(DATA_DIR, f"{protocol}.json")
-            save_data_to_file(data, filename)
-        else:
-            failed_slugs.append(protocol)
-    if failed_slugs:
-        with open(FAILED_SLUGS_FILE, "wb") as f:
-            pickle.dump(failed_slugs, f)
-
 @task
 async def add_type_column():
+    """Re-derive `type` of the stored headers, e.g. after a mapping change."""
     con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
     con.execute(
         f"ALTER TABLE {TABLES['A']} ADD COLUMN IF NOT EXISTS type VARCHAR;"
     )
-
-    category_to_type = {}
-    for type_name, categories in CATEGORY_MAPPING.items():
-        for category in categories:
-            category_to_type[category] = type_name
-
-    for category, type_name in category_to_type.items():
-        update_query = f"""
+    cases = " ".join(["WHEN ? THEN ?"] * len(CATEGORY_TO_TYPE))
+    con.execute(
+        f"""
         UPDATE {TABLES['A']}
-        SET type = '{type_name}'
-        WHERE category = '{category}';
-        """
-        con.execute(update_query)
-
+        SET type = CASE category {cases} ELSE COALESCE(type, 'default') END;
+        """,
+        [value for pair in CATEGORY_TO_TYPE.items() for value in pair],
+    )
     con.close()
 
 
@@ -112,127 +125,51 @@ def get_all_protocol_slugs():
     return [row[0] for row in result]
 
 
-def extract_token_tvl(file_path):
-    with open(file_path, "r") as f:
-        data = json.load(f)
-
-    results = []
-    for chain_name, chain_data in data["chainTvls"].items():
-        tokens_usd = chain_data["tokensInUsd"]
-        tokens_quantity = chain_data["tokens"]
-
-        for usd_entry, quantity_entry in zip(tokens_usd, tokens_quantity):
-            date = usd_entry["date"]
-            for token_name, value_usd in usd_entry["tokens"].items():
-                quantity = quantity_entry["tokens"].get(token_name, 0)
-                # large int handling
-                value_usd_str = str(value_usd)
-                quantity_str = str(quantity)
-                results.append(
-                    {
-                        "id": data["id"],
-                        "chain_name": chain_name,
-                        "date": date,
-                        "token_name": token_name,
-                        "quantity": quantity_str,
-                        "value_usd": value_usd_str,
-                    }
-                )
-
-    df = pl.DataFrame(results)
-
-    # convert large int back
-    if "quantity" in df.columns:
-        df = df.with_columns(pl.col("quantity").cast(pl.Float64).fill_null(0))
-    if "value_usd" in df.columns:
-        df = df.with_columns(pl.col("value_usd").cast(pl.Float64).fill_null(0))
-
-    return df
+@task(retries=3, retry_delay_seconds=[1, 10, 100])
+async def replace_motherduck_table(df, table_name):
+    con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
+    replace_table(con, table_name, df)
+    con.close()
 
 
-@task
-async def process_and_filter_file(
-    con, json_file_path, parquet_file_path, latest_dates
-):
-    df = extract_token_tvl(json_file_path)
-    if not df.is_empty():
-        df = df.join(
-            latest_dates, on=["id", "chain_name", "token_name"], how="left"
-        )
-        filtered_rows = df.filter(pl.col("date") > pl.col("latest_date"))
+@task(retries=3, retry_delay_seconds=[1, 10, 100])
+async def flush_loader(loader):
+    rows = loader.flush()
+    get_run_logger().warning(
+        "Flushed %s rows into %s (%s inserts this run)",
+        rows,
+        loader.table_name,
+        loader.flushes,
+    )
 
-        filtered_rows = filtered_rows.drop("latest_date")
 
-        if not filtered_rows.is_empty():
-            filtered_rows.write_parquet(parquet_file_path)
-            await upload_df_to_motherduck.fn(
-                parquet_file_path, TABLES["C"], con
-            )
-            get_run_logger().warning(
-                "Uploading %s lines of new data for %s",
-                filtered_rows.shape[0],
-                json_file_path,
-            )
-            os.remove(parquet_file_path)
-        else:
-            # get_run_logger().warning("No new data to process for %s.", json_file_path)
-            pass
+@task
+async def refresh_mirror(mirror, con):
+    if mirror.exists():
+        months = mirror.refresh(con, TABLES["C"])
     else:
-        get_run_logger().critical(
-            "No data found in llama data %s.", json_file_path
-        )
-
-
-async def clear_motherduck_table(tables: list, delete_tables: list = None):
-    con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
-    if delete_tables is None:
-        delete_tables = []
-
-    for table in tables:
-        if table in delete_tables:
-            con.execute(f"DROP TABLE IF EXISTS {table};")
-        else:
-            exists = con.execute(
-                f"SELECT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = '{table}')"
-            ).fetchone()[0]
-            if exists:
-                con.execute(f"DELETE FROM {table};")
-    con.close()
-
+        months = mirror.rebuild(con, TABLES["C"])
+    get_run_logger().info(
+        "Rewrote %s monthly partitions of %s", months, mirror.root
+    )
 
-@task(retries=3, retry_delay_seconds=[1, 10, 100])
-async def upload_df_to_motherduck(
-    file_path,
-    table_name,
-    con=duckdb.connect(f"md:?motherduck_token={MD_TOKEN}"),
-):
-    exists = con.execute(
-        f"SELECT EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = '{table_name}')"
-    ).fetchone()[0]
 
-    if not exists:
-        con.execute(
-            f"CREATE TABLE {table_name} AS SELECT * FROM read_parquet('{file_path}')"
-        )
+@task
+async def refresh_rollups(rollups, con):
+    if rollups.exist(con):
+        protocols = rollups.refresh(con)
+        get_run_logger().info("Refreshed rollups of %s protocols", protocols)
     else:
-        con.execute(
-            f"INSERT INTO {table_name} SELECT * FROM read_parquet('{file_path}')"
+        rollups.rebuild(con)
+        get_run_logger().info(
+            "Built rollup tables %s", ", ".join(rollups.tables().values())
         )
 
 
 @task
-async def download_and_process_single_protocol(slug, latest_dates):
-    url = f"{BASE_URL}protocol/{slug}"
-    data = fetch_data(url)
-    if data:
-        con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
-        json_file_path = os.path.join(DATA_DIR, f"{slug}.json")
-        parquet_file_path = os.path.join(DATA_DIR, f"{slug}.parquet")
-        save_data_to_file(data, json_file_path)
-        await process_and_filter_file.fn(
-            con, json_file_path, parquet_file_path, latest_dates
-        )
-        os.remove(json_file_path)
+async def publish_data_version(con):
+    version = bump_data_version(con, DATA_VERSION_TABLE)
+    get_run_logger().info("Published data version %s", version)
 
 
 @task
@@ -247,18 +184,44 @@ def _get_system_memory_info_gb():
     return mem.total / (1024.0**3)
 
 
-def _calculate_concurrent_tasks(
-    memory_per_task_gb=20 / 200, safety_factor=config["safety_factor"]
+def _memory_limit_bytes(safety_factor=config["safety_factor"]):
+    return int(_get_system_memory_info_gb() * safety_factor * 1024.0**3)
+
+
+def _protocol_size_priority(fetcher, headers):
+    """Largest-first ordering: last cached payload size, then current TVL."""
+    tvl_by_slug = {
+        protocol.get("slug"): protocol.get("tvl") or 0
+        for protocol in headers or []
+    }
+
+    def priority(slug):
+        entry = fetcher.cache.entry(slug) if fetcher.cache is not None else None
+        return (entry["size"] if entry else 0, tvl_by_slug.get(slug, 0))
+
+    return priority
+
+
+def _protocol_memory_estimate(
+    fetcher, factor=PAYLOAD_MEMORY_FACTOR, default_size=DEFAULT_PAYLOAD_BYTES
 ):
-    total_memory_gb = _get_system_memory_info_gb()
-    usable_memory_gb = total_memory_gb * safety_factor
-    max_concurrent_tasks_based_on_memory = int(
-        usable_memory_gb / memory_per_task_gb
-    )
-    return max_concurrent_tasks_based_on_memory
+    """
+    Bytes a protocol's job may hold: its payload size times parse overhead.
+
+    The size is the last cached payload, or `default_size` for a protocol that has not been
+    cached yet (a first run, or `http_cache: false`), so no job is admitted for free.
+    """
+
+    def estimate(slug):
+        entry = fetcher.cache.entry(slug) if fetcher.cache is not None else None
+        return int((entry["size"] if entry else default_size) * factor)
+
+    return estimate
 
 
 def _generate_and_save_heatmap():
+    from config.plot import save_heatmap
+
     con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
 
     query = """
@@ -282,43 +245,99 @@ def _generate_and_save_heatmap():
 
 
 @task
-async def _get_latest_dates_for_tokens():
-    con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
-    query = """
-    SELECT id, chain_name, token_name, MAX(date) as latest_date
-    FROM {table_name}
-    GROUP BY id, chain_name, token_name
-    """.format(
-        table_name=TABLES["C"]
+async def _get_latest_dates_for_tokens(store):
+    if WATERMARK_PUSHDOWN:
+        return None
+    uncertain = store.uncertain_protocols()
+    if not store.has_watermarks() or uncertain:
+        con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
+        if not store.has_watermarks():
+            # first run with this store: seed it from table C once
+            store.save_watermarks(latest_dates(con, TABLES["C"]))
+        else:
+            # a run died mid-flush; re-read only the affected protocols
+            store.save_watermarks(
+                latest_dates(con, TABLES["C"], protocol_ids=uncertain),
+                protocol_ids=uncertain,
+            )
+        con.close()
+    watermarks = WatermarkIndex.from_frame(store.watermark_frame())
+    get_run_logger().info(
+        "Loaded latest dates for tokens of %s protocols.", len(watermarks)
     )
-    df = con.execute(query).fetchdf()
-    con.close()
-    latest_dates_df = pl.from_pandas(df)
-    get_run_logger().info("Fetched latest dates for tokens.")
-    return latest_dates_df
+    return watermarks
 
 
 @flow
 async def ingest_llama_motherduck():
-    await clear_motherduck_table(tables=["A"], delete_tables=["A"])
-    await download_protocol_headers()
-    latest_dates = await _get_latest_dates_for_tokens()
-
-    all_protocol_slugs = get_all_protocol_slugs()[:MAX_SLUGS]
-    max_concurrent_tasks = _calculate_concurrent_tasks()
-    total_slugs_to_process = (
-        len(all_protocol_slugs)
-        if MAX_SLUGS is None
-        else min(len(all_protocol_slugs), MAX_SLUGS)
-    )
+    store = CheckpointStore(CHECKPOINT_DB)
+    run_id = store.start_run()
+    get_run_logger().info("Checkpoint run %s.", run_id)
+    async with make_fetcher() as fetcher:
+        headers = await download_protocol_headers(fetcher)
+        watermarks = await _get_latest_dates_for_tokens(store)
+
+        all_protocol_slugs = store.pending_slugs(
+            get_all_protocol_slugs()[:MAX_SLUGS]
+        )
 
-    for i in range(0, total_slugs_to_process, max_concurrent_tasks):
-        batch_slugs = all_protocol_slugs[i : i + max_concurrent_tasks]
-        tasks = [
-            download_and_process_single_protocol(slug, latest_dates)
-            for slug in batch_slugs
-        ]
-        await asyncio.gather(*tasks)
+        mirror = ParquetMirror(C_MIRROR_DIR) if C_MIRROR_DIR else None
+        rollups = Rollups(TABLES["C"]) if ROLLUPS else None
+
+        con = duckdb.connect(f"md:?motherduck_token={MD_TOKEN}")
+        add_day_columns(con, TABLES["C"])
+        loader = BulkLoader(
+            con,
+            TABLES["C"],
+            max_rows=FLUSH_ROWS,
+            max_bytes=FLUSH_BYTES,
+            incremental=WATERMARK_PUSHDOWN,
+            before_flush=store.mark_flushing,
+            on_flush=store.record_flush,
+        )
+        scheduler = AdaptiveScheduler(
+            max_workers=MAX_WORKERS,
+            memory_limit=_memory_limit_bytes(),
+            estimate=_protocol_memory_estimate(fetcher),
+        )
+        pipeline = IngestPipeline(
+            fetcher,
+            store,
+            loader,
+            scheduler,
+            watermarks,
+            protocol_ids={
+                protocol.get("slug"): str(protocol.get("id"))
+                for protocol in headers or []
+            },
+            parse_workers=PARSE_WORKERS,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            streaming=STREAMING_PARSE,
+            on_overflow=OVERFLOW_POLICY,
+            debug_dir=DATA_DIR if KEEP_TEMP_FILES else None,
+            log=get_run_logger(),
+        )
+        await pipeline.run(
+            all_protocol_slugs,
+            priority=_protocol_size_priority(fetcher, headers),
+        )
+        await flush_loader(loader)
+        if fetcher.cache is not None:
+            fetcher.cache.sweep()
+        # includes flushes of earlier runs that died before their refresh
+        unrefreshed = store.unrefreshed_protocols()
+        if mirror is not None:
+            if unrefreshed:
+                mirror.touch_since(min(unrefreshed.values()))
+            await refresh_mirror(mirror, con)
+        if rollups is not None:
+            rollups.touch_protocols(unrefreshed)
+            await refresh_rollups(rollups, con)
+        store.clear_unrefreshed(unrefreshed)
+        await publish_data_version(con)
+        con.close()
+    store.finish_run()
+    store.close()
 
     await update_mapping()
     _generate_and_save_heatmap()
@@ -1,30 +1,26 @@
 from config.config import MD_TOKEN
+from config.etl_network import ETLNetwork
+from config.query import MotherduckClient
 from prefect import flow, task
-from datetime import datetime, timedelta
-import requests
+from datetime import datetime
 import json
 import os
 import tempfile
-import asyncio
 import duckdb
-import httpx
 
 
 @task
-async def fetch_and_save_json(date_str, base_url, params, temp_dir):
-    url = f"{base_url}/network-json/{date_str}"
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, params=params)
-        if response.status_code == 200:
-            network_json = response.json()
-            filename = os.path.join(temp_dir, f"network_data_{date_str}.json")
-            with open(filename, 'w') as f:
-                json.dump(network_json, f)
-            print(f"Data for {date_str} saved to {filename}")
-            return filename
-        else:
-            print(f"Failed to retrieve data for {date_str}: {response.status_code}")
-            return None
+def compute_and_save_json(start_date, end_date, params, temp_dir):
+    """Compute every day's network from one query and save each to its own JSON file."""
+    etl_network = ETLNetwork(bq=MotherduckClient())
+    file_paths = []
+    for date_str, network_json in etl_network.process_range(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), **params):
+        filename = os.path.join(temp_dir, f"network_data_{date_str}.json")
+        with open(filename, 'w') as f:
+            json.dump(network_json, f)
+        print(f"Data for {date_str} saved to {filename}")
+        file_paths.append(filename)
+    return file_paths
         
 @task
 def upload_to_duckdb(file_path):
@@ -33,8 +29,7 @@ def upload_to_duckdb(file_path):
     print(f"Uploaded {file_path} to DuckDB")
 
 @flow
-async def main_flow(start_date, end_date):
-    base_url = "http://127.0.0.1:8000"
+def main_flow(start_date, end_date):
     params = {
         "TOP_X": None,
         "granularity": "daily",
@@ -43,16 +38,8 @@ async def main_flow(start_date, end_date):
     }
     temp_dir = tempfile.mkdtemp()
     
-    tasks = []
-    current_date = start_date
-    while current_date < end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        task = fetch_and_save_json(date_str, base_url, params, temp_dir)
-        tasks.append(task)
-        current_date += timedelta(days=1)
-    
-    file_paths = await asyncio.gather(*tasks)
-    for file_path in filter(None, file_paths):  # Filter out None values
+    file_paths = compute_and_save_json(start_date, end_date, params, temp_dir)
+    for file_path in file_paths:
         upload_to_duckdb(file_path)
     
     # Clean up
@@ -61,9 +48,10 @@ async def main_flow(start_date, end_date):
     os.rmdir(temp_dir)
     print("Temporary files and directory deleted.")
 
-# Define your start and end dates
-start_date = datetime(2023, 1, 1)
-end_date = datetime(2023, 3, 1)
+if __name__ == "__main__":
+    # Define your start and end dates
+    start_date = datetime(2023, 1, 1)
+    end_date = datetime(2023, 3, 1)
 
-# Run the flow
-asyncio.run(main_flow(start_date, end_date))
\ No newline at end of file
+    # Run the flow
+    main_flow(start_date, end_date)
\ No newline at end of file
@@ -0,0 +1,110 @@
+import duckdb
+import polars as pl
+import pytest
+
+from config.checkpoint import CheckpointStore
+from config.loader import BulkLoader
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "checkpoints.sqlite")
+
+
+def rows(protocol_id, dates, token="USDC"):
+    return pl.DataFrame({
+        "id": [protocol_id] * len(dates),
+        "chain_name": ["Ethereum"] * len(dates),
+        "date": dates,
+        "token_name": [token] * len(dates),
+    })
+
+
+def test_interrupted_run_is_resumed(store_path):
+    store = CheckpointStore(store_path)
+    run_id = store.start_run()
+    store.mark_done("aave", "111", "hash-a")
+    store.mark_failed("lido")
+    store.close()
+
+    store = CheckpointStore(store_path)
+    assert store.start_run() == run_id
+    assert store.pending_slugs(["aave", "lido", "curve"]) == ["lido", "curve"]
+    store.finish_run()
+    assert store.start_run() != run_id
+    assert store.pending_slugs(["aave", "lido"]) == ["aave", "lido"]
+
+
+def test_unchanged_payload_is_detected(store_path):
+    store = CheckpointStore(store_path)
+    store.start_run()
+    store.mark_done("aave", "111", "hash-a")
+    assert store.is_unchanged("aave", "hash-a")
+    assert not store.is_unchanged("aave", "hash-b")
+    assert not store.is_unchanged("lido", "hash-a")
+
+
+def test_flush_advances_watermarks_and_marks_done(store_path):
+    store = CheckpointStore(store_path)
+    store.start_run()
+    store.save_watermarks(rows("111", [50]).rename({"date": "latest_date"}))
+
+    con = duckdb.connect(database=":memory:")
+    loader = BulkLoader(con, "C", before_flush=store.mark_flushing, on_flush=store.record_flush)
+    loader.add(rows("111", [100, 200]), key=("aave", "111", "hash-a"))
+    loader.add(rows("182", [300], token="ETH"), key=("lido", "182", "hash-l"))
+    loader.flush()
+
+    assert store.uncertain_protocols() == []
+    assert sorted(store.watermark_frame().rows()) == [
+        ("111", "Ethereum", "USDC", 200),
+        ("182", "Ethereum", "ETH", 300),
+    ]
+    state = store.slug_state("aave")
+    assert (state["status"], state["payload_hash"], state["last_date"], state["rows"]) == (
+        "done", "hash-a", 200, 2
+    )
+
+
+def test_unrefreshed_protocols_survive_a_restart(store_path):
+    con = duckdb.connect(database=":memory:")
+    store = CheckpointStore(store_path)
+    store.start_run()
+    loader = BulkLoader(con, "C", before_flush=store.mark_flushing, on_flush=store.record_flush)
+    loader.add(rows("111", [300, 200]), key=("aave", "111", "hash-a"))
+    loader.flush()
+    store.close()
+
+    # the run died after the flush, before the rollups were refreshed
+    store = CheckpointStore(store_path)
+    store.start_run()
+    unrefreshed = store.unrefreshed_protocols()
+    assert unrefreshed == {"111": 200}
+    assert store.pending_slugs(["aave"]) == []
+
+    # a flush during the refresh moves the protocol earlier, so its entry is kept
+    loader = BulkLoader(con, "C", before_flush=store.mark_flushing, on_flush=store.record_flush)
+    loader.add(rows("111", [100]), key=("aave", "111", "hash-b"))
+    loader.flush()
+    loader.add(rows("182", [500], token="ETH"), key=("lido", "182", "hash-l"))
+    loader.flush()
+    store.clear_unrefreshed(unrefreshed)
+    assert store.unrefreshed_protocols() == {"111": 100, "182": 500}
+
+
+def test_failed_flush_leaves_protocols_uncertain(store_path):
+    store = CheckpointStore(store_path)
+    store.start_run()
+    loader = BulkLoader(_LostConnection(), "C", before_flush=store.mark_flushing,
+                        on_flush=store.record_flush)
+    loader.add(rows("111", [100]), key=("aave", "111", "hash-a"))
+    with pytest.raises(RuntimeError):
+        loader.flush()
+    assert store.uncertain_protocols() == ["111"]
+    assert store.pending_slugs(["aave"]) == ["aave"]
+    assert not store.is_unchanged("aave", "hash-a")
+
+
+class _LostConnection:
+    def execute(self, query, *args):
+        raise RuntimeError("connection lost")
@@ -0,0 +1,108 @@
+from datetime import datetime
+
+import duckdb
+import polars as pl
+import pytest
+
+from config.config import TABLES
+from config.loader import insert_frame
+from config.query import MotherduckClient
+from config.rollup import Rollups
+from tests.conftest import DAY, HOUR, JAN_1, a_protocols, c_rows, local_client
+
+
+def rows(protocol_id, token, dates, quantities, usd_per_unit=2.0):
+    return c_rows(protocol_id, token, dates, quantities, [q * usd_per_unit for q in quantities])
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect(database=":memory:")
+    a_protocols(con)
+    wednesday = JAN_1 + 2 * DAY
+    insert_frame(con, TABLES["C"], pl.concat([
+        # two readings on the start day are averaged
+        rows("111", "USDC", [wednesday, wednesday + HOUR, wednesday + DAY, wednesday + 7 * DAY], [10.0, 12.0, 15.0, 20.0]),
+        rows("182", "ETH", [wednesday, wednesday + DAY, wednesday + 7 * DAY], [5.0, 4.0, 4.0]),
+        # only held on the start day
+        rows("182", "STETH", [wednesday], [3.0]),
+        # empty on the end day, so not a position there
+        rows("111", "DAI", [wednesday, wednesday + DAY], [1.0, 0.0]),
+    ]))
+    yield con
+    con.close()
+
+
+def comparison(con, rollups, granularity, date="2024-01-03"):
+    if rollups:
+        Rollups(TABLES["C"]).rebuild(con)
+    df = local_client(con, rollups).compare_periods(date, granularity)
+    return {
+        (row["id"], row["token_name"]): (row["qty"], row["usd"], row["qty_change"], row["usd_change"])
+        for row in df.to_dict("records")
+    }, df
+
+
+@pytest.mark.parametrize("rollups", [False, True])
+def test_daily_comparison_joins_edge_days(con, rollups):
+    changes, df = comparison(con, rollups, "daily")
+    assert changes == {
+        ("111", "USDC"): (11.0, 22.0, 4.0, 8.0),
+        ("182", "ETH"): (5.0, 10.0, -1.0, -2.0),
+    }
+    assert set(df["aggregated_date"]) == {datetime(2024, 1, 3)}
+    assert list(df.columns) == [
+        "aggregated_date", "id", "protocol_name", "category", "type", "chain_name",
+        "token_name", "qty", "usd", "usd_change", "qty_change",
+    ]
+
+
+@pytest.mark.parametrize("rollups", [False, True])
+def test_weekly_comparison_starting_mid_week(con, rollups):
+    changes, _ = comparison(con, rollups, "weekly")
+    assert changes == {
+        ("111", "USDC"): (11.0, 22.0, 9.0, 18.0),
+        ("182", "ETH"): (5.0, 10.0, -1.0, -2.0),
+    }
+
+
+def test_comparison_without_end_day_data_is_empty(con):
+    changes, _ = comparison(con, False, "monthly")
+    assert changes == {}
+
+
+def by_day(client, start, end, granularity):
+    return {
+        day.strftime("%Y-%m-%d"): C
+        for day, C in client.compare_period_range(start, end, granularity, batch_size=2)
+    }
+
+
+@pytest.mark.parametrize("rollups", [False, True])
+@pytest.mark.parametrize("granularity", ["daily", "weekly"])
+def test_range_matches_compare_periods_per_day(con, rollups, granularity):
+    if rollups:
+        Rollups(TABLES["C"]).rebuild(con)
+    client = local_client(con, rollups)
+    days = by_day(client, "2024-01-01", "2024-01-11", granularity)
+    for day in ["2024-01-%02d" % d for d in range(1, 11)]:
+        expected = client.compare_periods(day, granularity)
+        if expected.empty:
+            assert day not in days
+        else:
+            assert days[day].to_dict("records") == expected.to_dict("records")
+    assert list(days) == sorted(days) and days
+
+
+def test_range_end_is_exclusive(con):
+    client = local_client(con)
+    assert list(by_day(client, "2024-01-03", "2024-01-04", "daily")) == ["2024-01-03"]
+    assert by_day(client, "2024-01-01", "2024-01-03", "daily") == {}
+
+
+def test_range_releases_its_cursor_when_abandoned(con):
+    client = MotherduckClient(mirror_dir=None, con=con, pool_size=1, pool_timeout=0.05)
+    days = client.compare_period_range("2024-01-03", "2024-01-05", "daily", batch_size=1)
+    next(days)
+    days.close()
+    assert client._execute_query("SELECT 1 AS x")["x"][0] == 1
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from config.edges import build_edges
+
+
+def net_by_dict(sources, targets, weights):
+    """Pairwise netting as ETLNetwork._process_edges did it, without self-loops."""
+    aggregate = {}
+    for source, target, size in zip(sources, targets, weights):
+        if source == target:
+            continue
+        key = tuple(sorted([source, target]))
+        aggregate[key] = aggregate.get(key, 0) + (size if source < target else -size)
+    return {
+        (a, b) if net > 0 else (b, a): abs(net)
+        for (a, b), net in aggregate.items()
+        if net != 0
+    }
+
+
+def links(edges):
+    return {
+        (link["source"], link["target"]): link["size"]
+        for link in edges.to_json()["links"]
+    }
+
+
+def test_opposite_flows_are_netted():
+    edges = build_edges(["A", "B", "A", "C"], ["B", "A", "B", "A"], [5.0, 2.0, 1.0, 3.0])
+    assert links(edges) == {("A", "B"): 4.0, ("C", "A"): 3.0}
+
+
+def test_balanced_flows_cancel_out():
+    edges = build_edges(["A", "B"], ["B", "A"], [2.0, 2.0])
+    assert links(edges) == {}
+    assert edges.labels.tolist() == ["A", "B"]
+
+
+def test_self_loops_are_counted_once():
+    edges = build_edges(["Lending", "Lending", "Dexes"], ["Lending", "Lending", "Lending"], [1.0, 2.0, 4.0])
+    assert links(edges) == {("Lending", "Lending"): 3.0, ("Dexes", "Lending"): 4.0}
+
+
+def test_node_sizes_sum_sent_and_received_values():
+    edges = build_edges(
+        ["A", "B", None], ["B", "C", "C"], [1.0, 1.0, 1.0],
+        from_value=[10.0, 0.0, 100.0], to_value=[0.0, 7.0, 100.0],
+    )
+    sizes = {node["id"]: node["size"] for node in edges.to_json()["nodes"]}
+    assert sizes == {"A": 10.0, "B": 0.0, "C": 7.0}
+    assert links(edges) == {("A", "B"): 1.0, ("B", "C"): 1.0}
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_dict_netting(seed):
+    rng = np.random.default_rng(seed)
+    names = [f"n{i}" for i in range(40)]
+    sources, targets = rng.choice(names, 2000), rng.choice(names, 2000)
+    weights = rng.integers(1, 100, 2000).astype(float)
+    expected = net_by_dict(sources, targets, weights)
+    actual = {key: size for key, size in links(build_edges(sources, targets, weights)).items() if key[0] != key[1]}
+    assert actual == expected
+
+
+def test_top_keeps_heaviest_edges_and_their_nodes():
+    edges = build_edges(["A", "B", "C", "D"], ["B", "C", "D", "E"], [1.0, 4.0, 3.0, 2.0],
+                        from_value=[1.0, 2.0, 3.0, 4.0])
+    top = edges.top(2)
+    assert [(link["source"], link["target"], link["size"]) for link in top.to_json()["links"]] == [
+        ("B", "C", 4.0), ("C", "D", 3.0),
+    ]
+    assert {node["id"]: node["size"] for node in top.to_json()["nodes"]} == {"B": 2.0, "C": 3.0, "D": 4.0}
+    assert edges.top(None) is edges
+    assert edges.top(10) is edges
+    assert edges.top(0).to_json() == {"nodes": [], "links": []}
+    with pytest.raises(ValueError):
+        edges.top(-1)
+
+
+def test_top_matches_full_sort():
+    rng = np.random.default_rng(3)
+    names = [f"n{i}" for i in range(300)]
+    edges = build_edges(rng.choice(names, 20000), rng.choice(names, 20000), rng.random(20000))
+    expected = np.sort(edges.size)[::-1][:50]
+    assert np.array_equal(edges.top(50).size, expected)
@@ -1,3 +1,17 @@
+import io
+
+import duckdb
+import pyarrow.ipc as pa_ipc
+import pytest
+from fastapi.testclient import TestClient
+
+import endpoint
+from config.config import DATA_VERSION_TABLE, TABLES
+from config.loader import bump_data_version, insert_frame
+from config.result_cache import ResultCache
+from tests.conftest import AAVE, JAN_1, a_protocols, c_rows, local_client
+
+
 # import pandas as pd
 # from fastapi.testclient import TestClient
 # from unittest.mock import patch
@@ -22,4 +36,44 @@
 # def test_protocol_data(mock_get_protocol_data):
 #     response = client.get("/protocol-data/MakerDAO/monthly")
 #     assert response.status_code == 200
-#     assert response.json() != []
\ No newline at end of file
+#     assert response.json() != []
+
+
+@pytest.fixture
+def api(monkeypatch):
+    con = duckdb.connect(database=":memory:")
+    a_protocols(con, [AAVE])
+    insert_frame(con, TABLES["C"], c_rows("111", "USDC", [JAN_1]))
+    bq = local_client(con)
+    monkeypatch.setattr(endpoint, "bq", bq)
+    monkeypatch.setattr(endpoint, "results", ResultCache(bq.get_data_version, version_ttl=0))
+    yield TestClient(endpoint.app), con
+    con.close()
+
+
+def test_token_distribution_formats(api):
+    client, _ = api
+    csv = client.get("/token-distribution/USDC/daily")
+    assert csv.status_code == 200
+    assert csv.headers["content-type"].startswith("text/csv")
+    assert csv.text == endpoint.bq.get_token_distribution("USDC", "daily").to_csv(index=False)
+    assert csv.text.splitlines()[1].startswith("2024-01-01,111,Aave")
+
+    arrow = client.get("/token-distribution/USDC/daily", params={"format": "arrow"})
+    assert pa_ipc.open_stream(io.BytesIO(arrow.content)).read_all().num_rows == 1
+
+    assert client.get("/token-distribution/USDC/daily", params={"format": "xml"}).status_code == 400
+
+
+def test_unchanged_results_revalidate_until_data_version_bumps(api):
+    client, con = api
+    first = client.get("/protocol-data/Aave/daily")
+    etag = first.headers["etag"]
+    assert client.get("/protocol-data/Aave/daily", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/protocol-data/Aave/daily").content == first.content
+    assert endpoint.results.hits == 1
+
+    bump_data_version(con, DATA_VERSION_TABLE)
+    fresh = client.get("/protocol-data/Aave/daily", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] != etag
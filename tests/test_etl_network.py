@@ -0,0 +1,186 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from config.config import MAPPING_PATH
+from config.etl_network import ETLNetwork, map_distinct
+
+CATEGORIES = {
+    "MAP": {"STETH": {"id": "182", "frequency": 10}},
+    "LP": {"UNI-V2 LP": {"id": "LP", "frequency": 3}},
+    "UNKNOWN": {},
+    "PRIMARY": {"USDC": {"id": "USDC", "frequency": 50}, "USDT": {"id": "2810", "frequency": 40}},
+    "OTHER": {},
+}
+ID_TO_INFO = {
+    "111": {"name": "Aave", "category": "Lending"},
+    "182": {"name": "Lido", "category": "Asset Management"},
+    "2810": {"name": "Tether", "category": "Assets"},
+}
+
+
+@pytest.fixture
+def network(tmp_path):
+    for filename, data in [
+        ("rev_map.json", {}),
+        ("token_to_protocol.json", CATEGORIES),
+        ("id_to_info.json", ID_TO_INFO),
+    ]:
+        with open(tmp_path / filename, "w") as f:
+            json.dump(data, f)
+    return ETLNetwork(bq=None, mapping_path=str(tmp_path) + os.sep)
+
+
+def movements(ids, tokens, size, seed=0):
+    rng = np.random.default_rng(seed)
+    usd_change = rng.normal(size=size)
+    return pd.DataFrame({
+        "id": rng.choice(ids, size),
+        "chain_name": rng.choice(["Ethereum", "Arbitrum"], size),
+        "token_name": rng.choice(tokens, size),
+        "qty": rng.random(size),
+        "usd": rng.random(size),
+        "qty_change": usd_change * 2,
+        "usd_change": usd_change,
+        "qty_from": None, "qty_to": None, "usd_from": None, "usd_to": None,
+    })
+
+
+def resolve_by_row(network, C):
+    """The per-row lookups process_dataframe used before the flat indices."""
+    def find_token_id(token_name):
+        for category, tokens in network.categories.items():
+            if token_name in tokens:
+                return str(tokens[token_name].get("id", None))
+        return None
+
+    def replace_with_name(value):
+        return network.id_to_info.get(str(value), {}).get("name", value)
+
+    token_id = C["token_name"].apply(find_token_id)
+    ids = C["id"].astype(str)
+    from_node = ids.where(C["usd_change"] < 0, token_id).apply(replace_with_name)
+    to_node = token_id.where(C["usd_change"] < 0, ids).apply(replace_with_name)
+    return nodes(from_node), nodes(to_node)
+
+
+def nodes(column):
+    # `where` turned the missing token ids into NaN; the indexed lookup leaves None
+    return [None if pd.isna(value) else value for value in column]
+
+
+def test_map_distinct_keeps_or_drops_unmapped_values():
+    values = pd.Series(["a", "b", None, "a"])
+    assert map_distinct(values, {"a": 1}).tolist() == [1, None, None, 1]
+    assert map_distinct(values, {"a": 1}, keep_unmapped=True).tolist() == [1, "b", None, 1]
+
+
+def test_flat_indices_cover_every_category(network):
+    assert network.token_to_id == {"STETH": "182", "UNI-V2 LP": "LP", "USDC": "USDC", "USDT": "2810"}
+    assert network.id_to_name["2810"] == "Tether"
+
+
+def test_resolve_nodes_matches_row_by_row_lookup(network):
+    C = movements(["111", "182", 999], ["STETH", "USDC", "USDT", "UNI-V2 LP", "NOT-MAPPED"], 500)
+    expected = resolve_by_row(network, C.copy())
+    resolved = network._resolve_nodes(C)
+    assert (nodes(resolved["from_node"]), nodes(resolved["to_node"])) == expected
+    assert (resolved["usd_change"] >= 0).all()
+
+
+def category_by_scan(network, node_name):
+    """The per-node scan over id_to_info that type aggregation used before the index."""
+    for id, info in network.id_to_info.items():
+        if info.get("name") == node_name:
+            return info.get("category", "AGGREGATED")
+    if node_name.isdigit() or node_name == "3594":
+        return "AGGREGATED"
+    return node_name
+
+
+def test_node_category_matches_scan(network):
+    for node_name in ["Aave", "Lido", "Tether", "USDC", "999", "3594", "LP"]:
+        assert network._node_category(node_name) == category_by_scan(network, node_name)
+
+
+def test_type_network_aggregates_categories(network):
+    C = movements(["111", "182"], ["STETH", "USDC", "USDT"], 200)
+    result = network.process_dataframe(C, type=True)
+    assert {node["id"] for node in result["nodes"]} <= {"Lending", "Asset Management", "Assets", "USDC"}
+    assert all(link["size"] > 0 for link in result["links"])
+
+
+def test_protocol_network_without_type(network):
+    C = pd.DataFrame({
+        "id": ["111", "182", "111"],
+        "chain_name": ["Ethereum"] * 3,
+        "token_name": ["USDC", "USDC", "USDT"],
+        "qty": [10.0, 5.0, 4.0],
+        "usd": [10.0, 5.0, 4.0],
+        "qty_change": [-3.0, 2.0, 1.0],
+        "usd_change": [-3.0, 2.0, 1.0],
+    })
+    result = network.process_dataframe(C)
+    nodes = {node["id"]: (node["size"], node["category"]) for node in result["nodes"]}
+    assert nodes == {"Aave": (14.0, "Lending"), "USDC": (0.0, "USDC"), "Lido": (5.0, "Asset Management"), "Tether": (0.0, "Assets")}
+    links = {(link["source"], link["target"]): link["size"] for link in result["links"]}
+    assert links == {("Aave", "USDC"): 3.0, ("USDC", "Lido"): 2.0, ("Tether", "Aave"): 1.0}
+
+    top = network.process_dataframe(C, TOP_X=1)
+    assert top["links"] == [{"source": "Aave", "target": "USDC", "size": 3.0}]
+    assert [node["id"] for node in top["nodes"]] == ["Aave", "USDC"]
+
+
+@pytest.mark.performance
+@pytest.mark.skipif(not os.path.exists(os.path.join(MAPPING_PATH, "token_to_protocol.json")),
+                    reason="needs the mapping files under data/mapping")
+def test_resolve_nodes_speed_on_full_day_frame():
+    network = ETLNetwork(bq=None)
+    tokens = list(network.token_to_id)[:5000] + ["NOT-MAPPED"]
+    C = movements(list(network.id_to_info)[:2000], tokens, 300_000)
+
+    start = time.perf_counter()
+    expected = resolve_by_row(network, C.copy())
+    by_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resolved = network._resolve_nodes(C)
+    vectorized = time.perf_counter() - start
+
+    print(f"\n300k movements: per-row {by_row:.2f}s, indexed {vectorized:.2f}s ({by_row / vectorized:.1f}x)")
+    assert (nodes(resolved["from_node"]), nodes(resolved["to_node"])) == expected
+
+
+@pytest.mark.performance
+@pytest.mark.skipif(not os.path.exists(os.path.join(MAPPING_PATH, "token_to_protocol.json")),
+                    reason="needs the mapping files under data/mapping")
+def test_type_network_speed_on_full_day_frame():
+    network = ETLNetwork(bq=None)
+    tokens = list(network.token_to_id)[:5000]
+    C = movements(list(network.id_to_info)[:2000], tokens, 300_000)
+
+    start = time.perf_counter()
+    network.process_dataframe(C, type=True)
+    elapsed = time.perf_counter() - start
+
+    print(f"\n300k movements aggregated by type in {elapsed:.2f}s")
+    assert elapsed < 1
+
+
+def test_process_range_builds_one_network_per_day(network):
+    C = movements(["111", "182"], ["STETH", "USDC", "USDT"], 40)
+    days = [pd.Timestamp("2024-01-02"), pd.Timestamp("2024-01-03")]
+
+    class Client:
+        def compare_period_range(self, start_date, end_date, granularity):
+            assert (start_date, end_date, granularity) == ("2024-01-02", "2024-01-04", "weekly")
+            return [(day, C[i::2].reset_index(drop=True)) for i, day in enumerate(days)]
+
+    network.bq = Client()
+    result = list(network.process_range("2024-01-02", "2024-01-04", "weekly", TOP_X=3, type=True))
+    assert [day for day, _ in result] == ["2024-01-02", "2024-01-03"]
+    assert result[1][1] == network.process_dataframe(C[1::2].reset_index(drop=True), TOP_X=3, type=True)
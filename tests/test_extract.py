@@ -0,0 +1,81 @@
+import io
+import json
+import os
+import sys
+
+import polars as pl
+import pytest
+
+from config.extract import TOKEN_TVL_SCHEMA, token_tvl_frame, token_tvl_frame_from_stream
+from tests.conftest import LLAMA_FIXTURES
+
+
+def load_protocol(slug):
+    with open(os.path.join(LLAMA_FIXTURES, "protocol", f"{slug}.json")) as f:
+        return json.load(f)
+
+
+def row_dict_frame(data):
+    """The previous one-dict-per-row extraction, kept as a reference."""
+    results = []
+    for chain_name, chain_data in data["chainTvls"].items():
+        for usd_entry, quantity_entry in zip(chain_data["tokensInUsd"], chain_data["tokens"]):
+            for token_name, value_usd in usd_entry["tokens"].items():
+                quantity = quantity_entry["tokens"].get(token_name, 0)
+                results.append({
+                    "id": data["id"],
+                    "chain_name": chain_name,
+                    "date": usd_entry["date"],
+                    "token_name": token_name,
+                    "quantity": str(quantity),
+                    "value_usd": str(value_usd),
+                })
+    return pl.DataFrame(results).with_columns(
+        pl.col("quantity").cast(pl.Float64), pl.col("value_usd").cast(pl.Float64)
+    )
+
+
+@pytest.mark.parametrize("slug", ["aave", "lido"])
+def test_columnar_matches_row_dicts(slug):
+    data = load_protocol(slug)
+    df = token_tvl_frame(data)
+    assert df.drop("day", "day_idx").equals(row_dict_frame(data))
+    assert df["day"].equals(pl.from_epoch(df["date"], time_unit="s").dt.date().alias("day"))
+    assert (df["day_idx"].cast(pl.Int64) * 86400 == df["date"]).all()
+
+
+@pytest.mark.parametrize("slug", ["aave", "lido", "tiny-farm"])
+def test_streaming_matches_in_memory(slug):
+    with open(os.path.join(LLAMA_FIXTURES, "protocol", f"{slug}.json"), "rb") as f:
+        streamed = token_tvl_frame_from_stream(f)
+    assert streamed.equals(token_tvl_frame(load_protocol(slug)))
+
+
+def test_empty_payload_keeps_schema():
+    df = token_tvl_frame(load_protocol("tiny-farm"))
+    assert df.is_empty()
+    assert dict(df.schema) == TOKEN_TVL_SCHEMA
+
+
+def test_overflow_policies():
+    huge = 10**400
+    data = {
+        "id": "1",
+        "chainTvls": {
+            "Ethereum": {
+                "tokensInUsd": [{"date": 1704067200, "tokens": {"A": 1.0, "B": None}}],
+                "tokens": [{"date": 1704067200, "tokens": {"A": huge, "B": -huge}}],
+            }
+        },
+    }
+    assert token_tvl_frame(data)["quantity"].to_list() == [0.0, 0.0]
+    assert token_tvl_frame(data)["value_usd"].to_list() == [1.0, 0.0]
+    assert token_tvl_frame(data, on_overflow="clip")["quantity"].to_list() == [
+        sys.float_info.max,
+        -sys.float_info.max,
+    ]
+    with pytest.raises(OverflowError):
+        token_tvl_frame(data, on_overflow="raise")
+
+    streamed = token_tvl_frame_from_stream(io.BytesIO(json.dumps(data).encode()))
+    assert streamed.equals(token_tvl_frame(data))
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+
+import httpx
+
+from config.fetch import HostRateLimiter, LlamaFetcher, ResponseCache
+
+
+def test_fetch_protocols_and_protocol(llama_stub):
+    async def run():
+        async with LlamaFetcher(llama_stub.base_url) as fetcher:
+            headers = await fetcher.fetch_protocols()
+            protocols = await asyncio.gather(
+                *(fetcher.fetch_protocol(p["slug"]) for p in headers)
+            )
+            missing = await fetcher.fetch_protocol("does-not-exist")
+        return headers, protocols, missing
+
+    headers, protocols, missing = asyncio.run(run())
+    assert [p["slug"] for p in headers] == ["aave", "lido", "tiny-farm"]
+    assert [p["id"] for p in protocols] == ["111", "182", "9999"]
+    assert missing is None
+
+
+def test_fetch_retries_transient_errors(llama_stub):
+    llama_stub.fail_next("/protocol/aave", times=2)
+
+    async def run():
+        async with LlamaFetcher(llama_stub.base_url, backoff=0) as fetcher:
+            return await fetcher.fetch_protocol("aave")
+
+    assert asyncio.run(run())["id"] == "111"
+    assert llama_stub.requests.count("/protocol/aave") == 3
+
+
+def test_fetch_gives_up_after_max_retries(llama_stub):
+    llama_stub.fail_next("/protocol/aave", times=5)
+
+    async def run():
+        async with LlamaFetcher(llama_stub.base_url, max_retries=1, backoff=0) as fetcher:
+            return await fetcher.fetch_protocol("aave")
+
+    assert asyncio.run(run()) is None
+    assert llama_stub.requests.count("/protocol/aave") == 2
+
+
+def test_rate_limiter_spaces_requests_per_host():
+    limiter = HostRateLimiter(rate=20)
+
+    async def run():
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.wait("api.llama.fi") for _ in range(5)))
+        await limiter.wait("other.host")
+        return time.monotonic() - start
+
+    # 5 requests to one host at 20/s need at least 4 intervals of 50ms
+    assert asyncio.run(run()) >= 0.19
+
+
+def test_conditional_fetch_uses_cache(llama_stub, tmp_path):
+    cache = ResponseCache(str(tmp_path))
+
+    async def fetch_twice():
+        async with LlamaFetcher(llama_stub.base_url, cache=cache) as fetcher:
+            first = await fetcher.fetch_protocol_cached("aave")
+            second = await fetcher.fetch_protocol_cached("aave")
+        return first, second
+
+    first, second = asyncio.run(fetch_twice())
+    assert first.changed and not second.changed
+    assert first.digest == second.digest
+    assert second.read() == first.read()
+    assert os.listdir(tmp_path / "blobs") == [first.digest]
+
+
+def test_unchanged_body_without_validators_is_detected(llama_stub, tmp_path):
+    llama_stub.etags = False
+    cache = ResponseCache(str(tmp_path))
+
+    async def fetch_twice():
+        async with LlamaFetcher(llama_stub.base_url, cache=cache) as fetcher:
+            return [await fetcher.fetch_protocol_cached("lido") for _ in range(2)]
+
+    first, second = asyncio.run(fetch_twice())
+    assert first.changed and not second.changed
+    assert cache.entry("lido")["etag"] is None
+
+
+def test_shared_blob_survives_until_sweep(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    shared = cache.store("aave", b"same", httpx.Headers())
+    cache.store("lido", b"same", httpx.Headers())
+    cache.store("aave", b"new", httpx.Headers())
+    assert cache.entry("lido")["digest"] == shared
+    assert cache.load(shared) == b"same"
+
+    assert cache.sweep() == 0
+    cache.store("lido", b"newer", httpx.Headers())
+    assert cache.sweep() == 1
+    assert sorted(os.listdir(tmp_path / "blobs")) == sorted([cache.entry("aave")["digest"], cache.entry("lido")["digest"]])
+
+
+def test_throttled_host_does_not_hold_connection_slots():
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={}))
+
+    async def run():
+        async with LlamaFetcher("http://a/", max_concurrency=1, requests_per_second=2,
+                                transport=transport) as fetcher:
+            await fetcher.get("http://a/first")
+            throttled = asyncio.ensure_future(fetcher.get("http://a/second"))
+            await asyncio.sleep(0)
+            start = time.monotonic()
+            await fetcher.get("http://b/other")
+            elapsed = time.monotonic() - start
+            await throttled
+        return elapsed
+
+    # the second request to host a waits 0.5s for its slot without taking the only connection
+    assert asyncio.run(run()) < 0.25
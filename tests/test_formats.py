@@ -0,0 +1,76 @@
+import io
+
+import duckdb
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pq
+import pytest
+
+from config.config import TABLES
+from config.formats import encode_batches
+from config.loader import insert_frame
+from tests.conftest import AAVE, DAY, JAN_1, a_protocols, c_rows, local_client
+
+TABLE = pa.table({"token_name": ["USDC", "WETH", "DAI", "USDT", "WBTC"], "value": [1.0, 2.5, 3.0, 4.0, 5.5]})
+
+
+def reader(table, batch_size=2):
+    return pa.RecordBatchReader.from_batches(table.schema, table.to_batches(max_chunksize=batch_size))
+
+
+def decode(fmt, body):
+    if fmt == "csv":
+        return pa_csv.read_csv(io.BytesIO(body))
+    if fmt == "arrow":
+        return pa_ipc.open_stream(body).read_all()
+    return pq.read_table(io.BytesIO(body))
+
+
+@pytest.mark.parametrize("fmt", ["csv", "arrow", "parquet"])
+def test_encode_batches_round_trips_in_chunks(fmt):
+    chunks = list(encode_batches(reader(TABLE), fmt))
+    assert len(chunks) >= 3
+    assert decode(fmt, b"".join(chunks)).equals(TABLE)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "arrow", "parquet"])
+def test_encode_batches_keeps_schema_of_empty_result(fmt):
+    empty = TABLE.slice(0, 0)
+    decoded = decode(fmt, b"".join(encode_batches(reader(empty), fmt)))
+    assert decoded.num_rows == 0
+    assert decoded.column_names == TABLE.column_names
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        list(encode_batches(reader(TABLE), "xlsx"))
+
+
+@pytest.fixture
+def client():
+    con = duckdb.connect(database=":memory:")
+    a_protocols(con, [AAVE])
+    dates = [JAN_1 + i * DAY for i in range(10)]
+    insert_frame(con, TABLES["C"], c_rows("111", "USDC", dates, [1.0 + i for i in range(len(dates))]))
+    yield local_client(con)
+    con.close()
+
+
+def test_batches_match_dataframe_result(client):
+    expected = client.get_token_distribution("USDC", "daily")
+    batches = client.get_token_distribution_batches("USDC", "daily", batch_size=4)
+    # the reader has its own cursor, so other queries may run before it is consumed
+    assert not client.get_protocol_data("Aave", "daily").empty
+    table = batches.read_all()
+    assert table.num_rows == len(expected) == 10
+    assert table.column("qty").to_pylist() == expected["qty"].tolist()
+
+
+def test_csv_matches_pandas_to_csv(client):
+    expected = client.get_token_distribution("USDC", "daily").to_csv(index=False)
+    body = b"".join(encode_batches(client.get_token_distribution_batches("USDC", "daily", batch_size=4)))
+    assert body.decode() == expected
+
+    empty = client.get_token_distribution("NONE", "daily").to_csv(index=False)
+    assert b"".join(encode_batches(client.get_token_distribution_batches("NONE", "daily"))).decode() == empty
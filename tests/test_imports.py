@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# backends and plotting stacks that cost seconds to import and are only needed by some paths
+HEAVY_MODULES = ["google.cloud.bigquery", "streamlit", "sklearn", "matplotlib", "pyvis", "dask"]
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+client = getattr(sys.modules["{module}"], "bq", None)
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+    "connected": client is not None and client._client is not None,
+}}))
+"""
+
+
+def probe(module):
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.performance
+@pytest.mark.parametrize("module", ["config", "config.query", "endpoint", "ingest_motherduck"])
+def test_cold_import_loads_no_unused_backend(module):
+    report = probe(module)
+    print(f"\nimport {module}: {report['seconds']:.2f}s")
+    assert report["heavy"] == []
+    assert not report["connected"]
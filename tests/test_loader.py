@@ -0,0 +1,129 @@
+import datetime
+
+import duckdb
+import pandas as pd
+import polars as pl
+import pytest
+
+from config.loader import (
+    BulkLoader,
+    add_day_columns,
+    bump_data_version,
+    insert_frame,
+    read_data_version,
+    replace_table,
+    table_exists,
+)
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect(database=":memory:")
+    yield con
+    con.close()
+
+
+def test_insert_frame_creates_then_appends(con):
+    df = pl.DataFrame({"id": ["1", "2"], "date": [1, 2], "value_usd": [1.5, 2.5]})
+    assert not table_exists(con, "C_protocol_token_tvl")
+
+    insert_frame(con, "C_protocol_token_tvl", df)
+    insert_frame(con, "C_protocol_token_tvl", df.with_columns(pl.col("date") + 10))
+
+    rows = con.execute("SELECT id, date, value_usd FROM C_protocol_token_tvl ORDER BY date").fetchall()
+    assert rows == [("1", 1, 1.5), ("2", 2, 2.5), ("1", 11, 1.5), ("2", 12, 2.5)]
+    # the staging view is dropped after each insert
+    assert con.execute("SELECT COUNT(*) FROM duckdb_views() WHERE NOT internal").fetchone()[0] == 0
+
+
+def test_insert_frame_accepts_pandas(con):
+    insert_frame(con, "A_protocols", pd.DataFrame({"id": ["111"], "slug": ["aave"]}))
+    assert con.execute("SELECT slug FROM A_protocols").fetchall() == [("aave",)]
+
+
+def make_rows(protocol_id, n):
+    return pl.DataFrame({
+        "id": [protocol_id] * n,
+        "date": list(range(n)),
+        "value_usd": [1.0] * n,
+    })
+
+
+def test_bulk_loader_coalesces_frames(con):
+    flushed = []
+    loader = BulkLoader(con, "C_protocol_token_tvl", max_rows=5,
+                        on_flush=lambda keys, df: flushed.append((keys, df.height)))
+    loader.add(make_rows("1", 2), key="aave")
+    loader.add(make_rows("2", 2), key="lido")
+    assert not table_exists(con, "C_protocol_token_tvl")
+
+    loader.add(make_rows("3", 2), key="curve")
+    assert flushed == [(["aave", "lido", "curve"], 6)]
+
+    loader.add(make_rows("4", 1), key="uniswap")
+    loader.add(make_rows("5", 0), key="empty")
+    assert loader.flush() == 1
+    assert flushed[-1] == (["uniswap", "empty"], 1)
+    assert loader.flushes == 2
+    assert con.execute("SELECT COUNT(*) FROM C_protocol_token_tvl").fetchone()[0] == 7
+
+
+def test_bulk_loader_checks_existence_once(con):
+    queries = []
+
+    class RecordingConnection:
+        def __getattr__(self, name):
+            return getattr(con, name)
+
+        def execute(self, query, *args):
+            queries.append(query)
+            return con.execute(query, *args)
+
+    loader = BulkLoader(RecordingConnection(), "C_protocol_token_tvl", max_rows=1)
+    for i in range(3):
+        loader.add(make_rows(str(i), 1))
+    assert sum("information_schema" in q for q in queries) == 1
+    assert sum(q.startswith("INSERT") for q in queries) == 2
+
+
+def test_replace_table_swaps_atomically(tmp_path):
+    con = duckdb.connect(str(tmp_path / "md.duckdb"))
+    replace_table(con, "A_protocols", pd.DataFrame({"id": ["111"], "slug": ["aave"]}))
+
+    reader = con.cursor()
+    reader.execute("BEGIN TRANSACTION")
+    assert reader.execute("SELECT slug FROM A_protocols").fetchall() == [("aave",)]
+
+    replace_table(con, "A_protocols", pd.DataFrame({"id": ["182", "9999"], "slug": ["lido", "tiny-farm"]}))
+    # a reader that started before the swap keeps its snapshot of the old table
+    assert reader.execute("SELECT slug FROM A_protocols").fetchall() == [("aave",)]
+    reader.execute("COMMIT")
+    assert reader.execute("SELECT COUNT(*) FROM A_protocols").fetchone()[0] == 2
+    assert not table_exists(con, "A_protocols__shadow")
+    con.close()
+
+
+def test_add_day_columns_backfills_existing_rows(con):
+    con.execute("""
+    CREATE TABLE C_protocol_token_tvl AS SELECT * FROM (VALUES
+        ('111', 1704067200), ('111', 1704153600.0)
+    ) t(id, date)
+    """)
+    add_day_columns(con, "C_protocol_token_tvl")
+    add_day_columns(con, "C_protocol_token_tvl")
+    insert_frame(con, "C_protocol_token_tvl", pl.DataFrame({
+        "date": [1704240000], "id": ["182"], "day": [datetime.date(2024, 1, 3)], "day_idx": [19725],
+    }))
+    rows = con.execute("SELECT id, day, day_idx FROM C_protocol_token_tvl ORDER BY date").fetchall()
+    assert rows == [
+        ("111", datetime.date(2024, 1, 1), 19723),
+        ("111", datetime.date(2024, 1, 2), 19724),
+        ("182", datetime.date(2024, 1, 3), 19725),
+    ]
+
+
+def test_data_version_starts_at_zero_and_increments(con):
+    assert read_data_version(con, "data_version") == 0
+    assert bump_data_version(con, "data_version") == 1
+    assert bump_data_version(con, "data_version") == 2
+    assert read_data_version(con, "data_version") == 2
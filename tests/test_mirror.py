@@ -0,0 +1,67 @@
+import os
+
+import duckdb
+import polars as pl
+import pytest
+
+from config.loader import insert_frame
+from config.mirror import ParquetMirror
+from tests.conftest import DAY, JAN_1, c_rows
+
+FEB_1 = 1706745600  # 2024-02-01
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect(database=":memory:")
+    insert_frame(con, "C", pl.concat([
+        c_rows("111", "WETH", [JAN_1, JAN_1 + DAY]),
+        c_rows("111", "USDC", [JAN_1 + DAY, FEB_1]),
+        c_rows("182", "USDC", [FEB_1]),
+    ]))
+    yield con
+    con.close()
+
+
+def test_rebuild_writes_sorted_month_partitions(con, tmp_path):
+    mirror = ParquetMirror(str(tmp_path / "C"))
+    assert not mirror.exists()
+    assert mirror.rebuild(con, "C") == 2
+    assert sorted(os.listdir(tmp_path / "C" / "year=2024")) == ["month=1", "month=2"]
+
+    january = con.execute(
+        f"SELECT token_name, date FROM {mirror.relation()} WHERE year = 2024 AND month = 1"
+    ).fetchall()
+    assert january == [("USDC", JAN_1 + DAY), ("WETH", JAN_1), ("WETH", JAN_1 + DAY)]
+
+
+def test_partition_filter_skips_other_months(con, tmp_path):
+    mirror = ParquetMirror(str(tmp_path / "C"))
+    mirror.rebuild(con, "C")
+    # a pruned partition is never opened, so a broken file there cannot fail the query
+    with open(tmp_path / "C" / "year=2024" / "month=2" / "data.parquet", "wb") as f:
+        f.write(b"not parquet")
+    count = con.execute(
+        f"SELECT COUNT(*) FROM {mirror.relation()} C WHERE C.year * 100 + C.month IN (202401)"
+    ).fetchone()[0]
+    assert count == 3
+
+
+def test_refresh_rewrites_only_touched_months(con, tmp_path):
+    mirror = ParquetMirror(str(tmp_path / "C"))
+    mirror.rebuild(con, "C")
+    january = tmp_path / "C" / "year=2024" / "month=1" / "data.parquet"
+    january_mtime = os.stat(january).st_mtime_ns
+
+    new_rows = c_rows("111", "USDC", [FEB_1 + DAY, FEB_1 + 40 * DAY])
+    insert_frame(con, "C", new_rows)
+    mirror.touch(new_rows)
+    assert mirror.touched == {(2024, 2), (2024, 3)}
+    assert mirror.refresh(con, "C") == 2
+
+    assert os.stat(january).st_mtime_ns == january_mtime
+    assert con.execute(f"SELECT COUNT(*) FROM {mirror.relation()}").fetchone()[0] == 7
+    assert mirror.touched == set()
+
+    mirror.touch_since(JAN_1 + DAY, last_date=FEB_1 + 40 * DAY)
+    assert mirror.touched == {(2024, 1), (2024, 2), (2024, 3)}
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+
+import duckdb
+import polars as pl
+import pytest
+
+from config.checkpoint import CheckpointStore
+from config.fetch import LlamaFetcher, ResponseCache
+from config.loader import BulkLoader
+from config.pipeline import IngestPipeline, parse_and_filter
+from config.scheduler import AdaptiveScheduler
+from config.watermark import WatermarkIndex
+
+from tests.conftest import LLAMA_FIXTURES
+
+SLUGS = ["aave", "lido", "tiny-farm"]
+PROTOCOL_IDS = {"aave": "111", "lido": "182", "tiny-farm": "9999"}
+
+
+def aave_payload():
+    with open(os.path.join(LLAMA_FIXTURES, "protocol", "aave.json"), "rb") as f:
+        return f.read()
+
+
+def test_parse_and_filter_applies_protocol_slice():
+    watermarks = pl.DataFrame({
+        "chain_name": ["Ethereum"], "token_name": ["USDC"], "latest_date": [1704067200],
+    })
+    df, total_rows, protocol_id = parse_and_filter(aave_payload(), watermarks)
+    assert (total_rows, protocol_id) == (6, "111")
+    assert df.height == 5
+    assert not df.filter(pl.col("token_name") == "USDC")["date"].is_in([1704067200]).any()
+
+    streamed, _, _ = parse_and_filter(aave_payload(), watermarks, streaming=True)
+    assert streamed.equals(df)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite"))
+    store.start_run()
+    yield store
+    store.close()
+
+
+def run_pipeline(base_url, cache_dir, store, con, watermarks):
+    async def run():
+        async with LlamaFetcher(base_url, cache=ResponseCache(cache_dir), backoff=0) as fetcher:
+            loader = BulkLoader(con, "C", before_flush=store.mark_flushing,
+                                on_flush=store.record_flush)
+            pipeline = IngestPipeline(
+                fetcher, store, loader, AdaptiveScheduler(max_workers=2), watermarks,
+                PROTOCOL_IDS, parse_workers=2, queue_size=1,
+            )
+            await pipeline.run(SLUGS + ["missing"])
+            loader.flush()
+    asyncio.run(run())
+
+
+def test_pipeline_writes_new_rows_and_checkpoints(llama_stub, tmp_path, store):
+    con = duckdb.connect(database=":memory:")
+    watermarks = WatermarkIndex.from_frame(pl.DataFrame({
+        "id": ["111"], "chain_name": ["Ethereum"], "token_name": ["USDC"],
+        "latest_date": [1704153600],
+    }))
+    run_pipeline(llama_stub.base_url, str(tmp_path / "cache"), store, con, watermarks)
+
+    counts = dict(con.execute("SELECT id, COUNT(*) FROM C GROUP BY id").fetchall())
+    assert counts == {"111": 4, "182": 2}
+    assert store.pending_slugs(SLUGS + ["missing"]) == ["missing"]
+    assert store.slug_state("missing")["status"] == "failed"
+    assert store.slug_state("aave")["rows"] == 4
+
+    # unchanged payloads are settled in the download stage and never parsed or written again
+    run_pipeline(llama_stub.base_url, str(tmp_path / "cache"), store, con, watermarks)
+    assert con.execute("SELECT COUNT(*) FROM C").fetchone()[0] == 6
+
+
+def test_failed_flush_marks_batch_failed_and_run_returns(llama_stub, tmp_path, store):
+    def fail(keys):
+        raise RuntimeError("flush failed")
+
+    async def run():
+        async with LlamaFetcher(llama_stub.base_url, cache=ResponseCache(str(tmp_path / "cache")), backoff=0) as fetcher:
+            loader = BulkLoader(duckdb.connect(database=":memory:"), "C", max_rows=1, before_flush=fail)
+            pipeline = IngestPipeline(
+                fetcher, store, loader, AdaptiveScheduler(max_workers=2), None,
+                PROTOCOL_IDS, parse_workers=2, queue_size=1,
+            )
+            await asyncio.wait_for(pipeline.run(SLUGS * 10), 20)
+            assert loader.pending_rows == 0
+    asyncio.run(run())
+
+    assert store.slug_state("aave")["status"] == "failed"
+    assert store.slug_state("lido")["status"] == "failed"
+
+
+def test_memory_charge_is_held_until_the_writer_consumes_a_slug(llama_stub, tmp_path, store):
+    scheduler = AdaptiveScheduler(max_workers=2, memory_limit=100, estimate=lambda slug: 100)
+    charged = []
+
+    class RecordingLoader(BulkLoader):
+        def add(self, df, key=None):
+            charged.append(scheduler.in_flight_bytes)
+            super().add(df, key)
+
+    async def run():
+        async with LlamaFetcher(llama_stub.base_url, cache=ResponseCache(str(tmp_path / "cache")), backoff=0) as fetcher:
+            loader = RecordingLoader(duckdb.connect(database=":memory:"), "C")
+            pipeline = IngestPipeline(
+                fetcher, store, loader, scheduler, None,
+                PROTOCOL_IDS, parse_workers=2, queue_size=1,
+            )
+            await asyncio.wait_for(pipeline.run(SLUGS), 20)
+            loader.flush()
+    asyncio.run(run())
+
+    assert charged == [100, 100]
+    assert scheduler.in_flight_bytes == 0
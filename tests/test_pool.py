@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import pytest
+
+from config.pool import CursorPool, PoolTimeout
+from config.query import MotherduckClient
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect(database=":memory:")
+    con.execute("CREATE TABLE t AS SELECT range AS i FROM range(100000)")
+    yield con
+    con.close()
+
+
+def test_cursors_are_reused_up_to_size(con):
+    pool = CursorPool(con, size=2, timeout=0.05)
+    with pool.cursor() as first:
+        pass
+    with pool.cursor() as again:
+        assert again is first
+    with pool.cursor(), pool.cursor():
+        with pytest.raises(PoolTimeout):
+            pool.acquire()
+    assert pool._opened == 2
+
+
+def test_concurrent_queries_get_their_own_cursor(con):
+    client = MotherduckClient(mirror_dir=None, con=con, pool_size=4)
+
+    def total(n):
+        return client._execute_query("SELECT SUM(i) AS s FROM t WHERE i < $n", {"n": n})["s"][0]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sums = list(executor.map(total, range(1, 201)))
+    assert sums == [n * (n - 1) // 2 for n in range(1, 201)]
+    assert client.pool._opened <= 4
+
+
+def test_reader_holds_its_cursor_until_closed(con):
+    client = MotherduckClient(mirror_dir=None, con=con, pool_size=1, pool_timeout=0.05)
+    reader = client._execute_batches("SELECT i FROM t", batch_size=1000)
+    with pytest.raises(PoolTimeout):
+        client._execute_query("SELECT 1")
+    assert sum(batch.num_rows for batch in reader) == 100000
+    assert client._execute_query("SELECT 1 AS x")["x"][0] == 1
+
+
+def test_unread_reader_returns_its_cursor(con):
+    client = MotherduckClient(mirror_dir=None, con=con, pool_size=1, pool_timeout=0.05)
+    client._execute_batches("SELECT i FROM t", batch_size=1000).close()
+    assert client._execute_query("SELECT 1 AS x")["x"][0] == 1
+
+    # a reader dropped without being read or closed, as by a response that never starts
+    client._execute_batches("SELECT i FROM t", batch_size=1000)
+    assert client._execute_query("SELECT 1 AS x")["x"][0] == 1
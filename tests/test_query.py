@@ -1,3 +1,4 @@
+import re
 import pytest
 from unittest.mock import MagicMock
 from config.query import BigQueryClient, MotherduckClient
@@ -40,4 +41,16 @@ def test_compare_periods_bigquery(bigquery_client):
 
 def test_compare_periods_duckdb(motherduck_client):
     df = motherduck_client.compare_periods('2023-01-24', 'monthly')
-    assert df == 'mocked dataframe'
\ No newline at end of file
+    assert df == 'mocked dataframe'
+
+def test_bigquery_queries_read_epoch_seconds_not_day():
+    client = BigQueryClient()
+    queries = []
+    client._execute_query = lambda query, params=None: queries.append(query)
+    client._get_table_name = lambda table_name: table_name
+    client.compare_periods(2024, 1, 2024, 2)
+    client.query_by_month(2024, 1)
+    client.get_token_distribution('USDC', 'weekly')
+    for query in queries:
+        assert not re.search(r'\bday\b', query)
+    assert 'date >= UNIX_SECONDS(TIMESTAMP(DATE(@year1, @month1, 1)))' in queries[0]
@@ -0,0 +1,53 @@
+import duckdb
+import polars as pl
+import pytest
+
+from config.config import TABLES
+from config.loader import insert_frame
+from config.query import StatementCache
+from tests.conftest import AAVE, DAY, JAN_1, a_protocols, c_rows, local_client
+
+
+@pytest.fixture
+def client():
+    con = duckdb.connect(database=":memory:")
+    a_protocols(con, [AAVE])
+    insert_frame(con, TABLES["C"], pl.concat([
+        c_rows("111", "USDC", [JAN_1], 1.0, 1.0),
+        c_rows("111", "WETH", [JAN_1 + DAY], 2.0, 2.0),
+    ]))
+    yield local_client(con)
+    con.close()
+
+
+def test_user_input_is_bound_not_interpolated(client):
+    query, params = client._get_aggregated_data(TABLES["C"], "daily", token_name="USDC' OR '1'='1")
+    assert "USDC" not in query
+    assert client._execute_query(query, params).empty
+    assert client.get_token_distribution("USDC", "daily")["token_name"].tolist() == ["USDC"]
+    assert client.get_protocol_data("Aave", "monthly")["qty"].tolist() == [1.0, 2.0]
+
+
+def test_same_shape_reuses_parsed_statement(client):
+    for token in ["USDC", "WETH", "USDC"]:
+        client.get_token_distribution(token, "daily")
+    client.get_protocol_data("Aave", "daily")
+    assert len(client.statements) == 2
+    assert client.compare_periods("2024-01-01", "daily")["usd_change"].tolist() == []
+    assert client.get_table_rows(TABLES["A"], ["111", "999"])["name"].tolist() == ["Aave"]
+
+
+def test_table_rows_accept_integer_ids(client):
+    assert client.get_table_rows(TABLES["A"], [111, 999])["name"].tolist() == ["Aave"]
+
+
+def test_statement_cache_evicts_least_recently_used():
+    con = duckdb.connect(database=":memory:")
+    cache = StatementCache(max_size=2)
+    first = cache.get(con, "SELECT 1")
+    cache.get(con, "SELECT 2")
+    assert cache.get(con, "SELECT 1") is first
+    cache.get(con, "SELECT 3")
+    assert len(cache) == 2
+    assert cache.get(con, "SELECT 1") is first
+    assert con.execute(cache.get(con, "SELECT $x + 1"), {"x": 41}).fetchone() == (42,)
@@ -0,0 +1,72 @@
+import pytest
+
+from config.result_cache import ResultCache, etag_matches
+
+
+class Versions:
+    def __init__(self):
+        self.current = 1
+        self.loads = 0
+
+    def __call__(self):
+        self.loads += 1
+        return self.current
+
+
+@pytest.fixture
+def versions():
+    return Versions()
+
+
+def test_evicts_least_recently_used_by_bytes(versions):
+    cache = ResultCache(versions, max_bytes=10)
+    cache.put(("a",), 1, b"aaaa", "text/csv")
+    cache.put(("b",), 1, b"bbbb", "text/csv")
+    assert cache.get(("a",), 1).body == b"aaaa"
+    cache.put(("c",), 1, b"cccc", "text/csv")
+    assert cache.get(("b",), 1) is None
+    assert cache.get(("a",), 1) is not None
+    assert cache.size_bytes == 8
+    assert not cache.put(("huge",), 1, b"x" * 11, "text/csv")
+    assert len(cache) == 2
+
+
+def test_version_bump_invalidates_entries(versions):
+    cache = ResultCache(versions, version_ttl=0)
+    cache.put(("a",), cache.version(), b"old", "text/csv")
+    assert cache.get(("a",), cache.version()).body == b"old"
+    versions.current = 2
+    assert cache.get(("a",), cache.version()) is None
+    assert cache.etag(("a",), 1) != cache.etag(("a",), 2)
+
+
+def test_version_is_polled_at_most_every_ttl(versions):
+    cache = ResultCache(versions, version_ttl=3600)
+    for _ in range(5):
+        assert cache.version() == 1
+    versions.current = 2
+    assert cache.version() == 1
+    assert versions.loads == 1
+
+
+def test_tee_caches_completed_streams_within_budget(versions):
+    cache = ResultCache(versions, max_bytes=6)
+    assert b"".join(cache.tee(("small",), 1, iter([b"ab", b"cd"]), "text/csv")) == b"abcd"
+    assert cache.get(("small",), 1).body == b"abcd"
+    assert b"".join(cache.tee(("big",), 1, iter([b"abcd", b"efgh"]), "text/csv")) == b"abcdefgh"
+    assert cache.get(("big",), 1) is None
+
+    # a stream abandoned half way is not cached
+    chunks = cache.tee(("partial",), 1, iter([b"ab", b"cd"]), "text/csv")
+    next(chunks)
+    chunks.close()
+    assert cache.get(("partial",), 1) is None
+
+
+def test_etag_matches_if_none_match_lists():
+    etag = ResultCache.etag(("a",), 3)
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag.removeprefix("W/")}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(ResultCache.etag(("a",), 4), etag)
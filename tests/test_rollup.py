@@ -0,0 +1,63 @@
+import duckdb
+import polars as pl
+import pytest
+
+from config.config import TABLES
+from config.loader import insert_frame
+from config.rollup import Rollups
+from tests.conftest import DAY, JAN_1, a_protocols, c_rows, local_client
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect(database=":memory:")
+    a_protocols(con)
+    insert_frame(con, TABLES["C"], pl.concat([
+        c_rows("111", "USDC", [JAN_1 + i * DAY for i in range(10)], [1.0 + i for i in range(10)], 2.0),
+        c_rows("182", "ETH", [JAN_1, JAN_1 + DAY], [1.0, 2.0], 2.0),
+        c_rows("182", "DUST", [JAN_1], 0.0, 2.0),
+    ]))
+    yield con
+    con.close()
+
+
+def aggregated(con, rollups, *args, **kwargs):
+    query, params = local_client(con, rollups)._get_aggregated_data(TABLES["C"], *args, **kwargs)
+    return con.execute(query, params).fetchall()
+
+
+@pytest.mark.parametrize("granularity", ["daily", "weekly", "monthly", "yearly"])
+def test_rollups_match_raw_aggregation(con, granularity):
+    Rollups(TABLES["C"]).rebuild(con)
+    assert aggregated(con, True, granularity) == aggregated(con, False, granularity)
+    assert aggregated(con, True, granularity, token_name="ETH") == \
+        aggregated(con, False, granularity, token_name="ETH")
+
+
+def test_edge_days_are_read_from_daily_rollup(con):
+    Rollups(TABLES["C"]).rebuild(con)
+    kwargs = dict(start_date="2024-01-01", end_date="2024-01-08", edge_dates_only=True)
+    assert aggregated(con, True, "weekly", **kwargs) == aggregated(con, False, "weekly", **kwargs)
+
+
+def test_refresh_recomputes_only_touched_protocols(con):
+    rollups = Rollups(TABLES["C"])
+    rollups.rebuild(con)
+    lido_before = con.execute(
+        f"SELECT * FROM {TABLES['C']}_daily WHERE id = '182' ORDER BY ALL"
+    ).fetchall()
+
+    new_rows = c_rows("111", "USDC", [JAN_1 + 9 * DAY, JAN_1 + 40 * DAY], [5.0, 6.0], 2.0)
+    insert_frame(con, TABLES["C"], new_rows)
+    rollups.touch(new_rows)
+    assert rollups.touched == {"111": JAN_1 + 9 * DAY}
+    assert rollups.refresh(con) == 1
+    # refreshing the same protocols again, as recorded by the checkpoint store, is a no-op
+    rollups.touch_protocols({"111": JAN_1 + 9 * DAY})
+    rollups.refresh(con)
+
+    for granularity in ["daily", "weekly", "monthly", "yearly"]:
+        assert aggregated(con, True, granularity) == aggregated(con, False, granularity)
+    assert con.execute(
+        f"SELECT * FROM {TABLES['C']}_daily WHERE id = '182' ORDER BY ALL"
+    ).fetchall() == lido_before
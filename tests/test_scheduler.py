@@ -0,0 +1,69 @@
+import asyncio
+
+from config.scheduler import AdaptiveScheduler
+
+
+def test_largest_first_with_bounded_workers():
+    sizes = {"tiny": 1, "aave": 50, "lido": 100, "curve": 20, "uni": 70}
+    started, running, peak = [], 0, 0
+
+    async def job(slug):
+        nonlocal running, peak
+        started.append(slug)
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(sizes[slug] / 1000)
+        running -= 1
+
+    scheduler = AdaptiveScheduler(max_workers=2)
+    asyncio.run(scheduler.run(sizes, job, priority=sizes.get))
+    assert started[:2] == ["lido", "uni"]
+    assert sorted(started) == sorted(sizes)
+    assert peak == 2
+    assert scheduler.completed == 5
+
+
+def test_free_slot_is_refilled_without_waiting_for_batch():
+    finished = []
+
+    async def job(duration):
+        await asyncio.sleep(duration)
+        finished.append(duration)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await AdaptiveScheduler(max_workers=2).run([0.3, 0.05, 0.05, 0.05], job)
+        return loop.time() - start
+
+    # fixed batches of two would take 0.3 + 0.05; a work queue finishes alongside the big job
+    assert asyncio.run(run()) < 0.34
+    assert finished[-1] == 0.3
+
+
+def test_admission_waits_while_estimated_memory_is_high():
+    sizes = {"lido": 100, "aave": 100, "a": 10, "b": 10, "c": 10, "d": 10}
+    concurrent, charged = {}, []
+
+    async def job(slug):
+        concurrent[slug] = scheduler.in_flight
+        charged.append(scheduler.in_flight_bytes)
+        await asyncio.sleep(0.02)
+
+    scheduler = AdaptiveScheduler(max_workers=4, memory_limit=150, estimate=sizes.get)
+    asyncio.run(scheduler.run(sizes, job, priority=sizes.get))
+    # the two large jobs never overlap, and the small ones still run side by side
+    assert max(charged) <= 150
+    assert scheduler.in_flight_bytes == 0
+    assert scheduler.completed == 6
+    assert scheduler.throttled > 0
+    assert max(concurrent[slug] for slug in "abcd") > 1
+
+
+def test_oversized_item_runs_alone():
+    async def job(item):
+        await asyncio.sleep(0.01)
+
+    scheduler = AdaptiveScheduler(max_workers=2, memory_limit=10, estimate=lambda item: item)
+    asyncio.run(scheduler.run([50, 1], job))
+    assert scheduler.completed == 2
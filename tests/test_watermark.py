@@ -0,0 +1,71 @@
+import duckdb
+import polars as pl
+import pytest
+
+from config.loader import insert_frame
+from config.watermark import WatermarkIndex
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect(database=":memory:")
+    con.execute("""
+    CREATE TABLE C_protocol_token_tvl AS SELECT * FROM (VALUES
+        ('111', 'Ethereum', 100, 'USDC', 1.0, 1.0),
+        ('111', 'Ethereum', 200, 'USDC', 1.0, 1.0),
+        ('111', 'Ethereum', 100, 'WETH', 1.0, 1.0),
+        ('182', 'Ethereum', 300, 'ETH', 1.0, 1.0)
+    ) t(id, chain_name, date, token_name, quantity, value_usd)
+    """)
+    yield con
+    con.close()
+
+
+def protocol_rows(protocol_id, rows):
+    return pl.DataFrame(
+        [(protocol_id, chain, date, token, 1.0, 1.0) for chain, date, token in rows],
+        schema=["id", "chain_name", "date", "token_name", "quantity", "value_usd"],
+        orient="row",
+    )
+
+
+INCOMING = [
+    ("Ethereum", 200, "USDC"),  # already stored
+    ("Ethereum", 300, "USDC"),  # newer than watermark
+    ("Ethereum", 100, "WETH"),  # already stored
+    ("Polygon", 100, "USDC"),  # token/chain not seen before
+]
+
+
+def test_index_is_sliced_per_protocol(con):
+    index = WatermarkIndex.from_table(con, "C_protocol_token_tvl")
+    assert len(index) == 2
+    assert index.for_protocol("111").height == 2
+    assert index.for_protocol(182).to_dicts() == [
+        {"chain_name": "Ethereum", "token_name": "ETH", "latest_date": 300}
+    ]
+    assert index.for_protocol("9999") is None
+
+
+def test_filter_new_rows(con):
+    index = WatermarkIndex.from_table(con, "C_protocol_token_tvl")
+    new_rows = index.filter_new_rows(protocol_rows("111", INCOMING))
+    assert new_rows.select("chain_name", "date", "token_name").rows() == [
+        ("Ethereum", 300, "USDC"),
+        ("Polygon", 100, "USDC"),
+    ]
+    unseen = protocol_rows("9999", [("Base", 1, "USDC")])
+    assert index.filter_new_rows(unseen).equals(unseen)
+
+
+def test_incremental_insert_matches_index(con):
+    expected = WatermarkIndex.from_table(con, "C_protocol_token_tvl").filter_new_rows(
+        protocol_rows("111", INCOMING)
+    )
+    insert_frame(con, "C_protocol_token_tvl", protocol_rows("111", INCOMING), incremental=True)
+    inserted = con.execute("""
+        SELECT chain_name, date, token_name FROM C_protocol_token_tvl
+        WHERE id = '111' AND (date = 300 OR chain_name = 'Polygon') ORDER BY date DESC
+    """).fetchall()
+    assert inserted == expected.select("chain_name", "date", "token_name").rows()
+    assert con.execute("SELECT COUNT(*) FROM C_protocol_token_tvl").fetchone()[0] == 6